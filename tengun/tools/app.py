@@ -1,17 +1,492 @@
+import argparse
+import asyncio
+import email.utils
+import gzip
+import hashlib
 import http.server
-import socketserver
+import os
+import re
+import sys
+import tempfile
+import threading
+import urllib.parse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from spatialindex import load_index, query_ranges
+except ImportError:
+    # /points には numpy が必要
+    load_index = None
 
 PORT = 5501
 
+# マルチスレッド(SharedArrayBuffer)を有効にするために、全レスポンスに付けるヘッダー
+CROSS_ORIGIN_HEADERS = [
+    ("Cross-Origin-Opener-Policy", "same-origin"),
+    ("Cross-Origin-Embedder-Policy", "require-corp"),
+]
+
+# Range: bytes=開始-終了 / bytes=開始- / bytes=-末尾からのバイト数（複数範囲の指定は全体を返す）
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# 初回のリクエストで圧縮してキャッシュする拡張子（.br / .gz が横にあればそちらを優先する）
+COMPRESS_EXTENSIONS = {".wasm", ".bin", ".js", ".html", ".css", ".json", ".cpp"}
+# 圧縮したファイルの置き場所（相対パスなら配信するディレクトリから。--compress-cache で変えられる）
+COMPRESS_CACHE_DIR = ".compressed_cache"
+# 使う順番（brotli は brotli パッケージがあるときだけ自分で圧縮する）
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+# これより大きいファイルはリクエストを待たせずに別スレッドで圧縮し、できるまでは圧縮せずに送る
+COMPRESS_INLINE_MAX_BYTES = 8 * 1024 * 1024
+# 圧縮するときに一度に読む大きさ
+COMPRESS_CHUNK_BYTES = 1024 * 1024
+# 先頭がこれで始まるファイルは圧縮済み（converter.py --format tgpc）なので圧縮しない
+COMPRESSED_MAGICS = (b"TGPC",)
+
+# /points で点を切り出す、converter.py --sort grid で並べ替えた点群ファイル（既定）
+POINTS_FILE = "points_textured.bin"
+
+_compress_locks = {}
+_compress_locks_lock = threading.Lock()
+_compress_pending = set()
+_point_indexes = {}
+_point_indexes_lock = threading.Lock()
+
+
+def parse_accept_encoding(header):
+    """Accept-Encoding から受け付ける圧縮方式の集合を返す（q=0 は除く）"""
+    accepted = set()
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(name)
+    if "*" in accepted:
+        accepted.update(encoding for encoding, _ in ENCODINGS)
+    return accepted
+
+
+def _compress_file(source_path, encoding, cache_path):
+    """source_path を少しずつ読んで圧縮し、cache_path に書く（書き終えてから置き換える）
+
+    書き終えたら、同じファイルの古い版（更新前の時刻・サイズで作ったもの）を消す。
+    """
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+    try:
+        with open(source_path, "rb") as src, os.fdopen(fd, "wb") as dst:
+            if encoding == "br":
+                compressor = brotli.Compressor()
+                for chunk in iter(lambda: src.read(COMPRESS_CHUNK_BYTES), b""):
+                    dst.write(compressor.process(chunk))
+                dst.write(compressor.finish())
+            else:
+                with gzip.GzipFile(fileobj=dst, mode="wb", compresslevel=6, mtime=0) as gz:
+                    for chunk in iter(lambda: src.read(COMPRESS_CHUNK_BYTES), b""):
+                        gz.write(chunk)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _remove_stale_variants(cache_path)
+
+
+def _remove_stale_variants(cache_path):
+    """cache_path と同じ元ファイル・同じ圧縮方式の、古いキャッシュを消す"""
+    cache_dir, name = os.path.split(cache_path)
+    path_key, _, rest = name.partition("-")
+    suffix = os.path.splitext(rest)[1]
+    for other in os.listdir(cache_dir):
+        if other != name and other.startswith(path_key + "-") and other.endswith(suffix):
+            try:
+                os.remove(os.path.join(cache_dir, other))
+            except OSError:
+                # 送信中で消せない（Windows）ときは、次に書き直すときに消す
+                pass
+
+
+def _is_precompressed(path):
+    with open(path, "rb") as f:
+        head = f.read(max(len(magic) for magic in COMPRESSED_MAGICS))
+    return head.startswith(COMPRESSED_MAGICS)
+
+
+def _compress_in_background(source_path, encoding, cache_path):
+    """別スレッドで圧縮を始める（同じキャッシュを圧縮中なら何もしない）"""
+    with _compress_locks_lock:
+        if cache_path in _compress_pending:
+            return
+        _compress_pending.add(cache_path)
+
+    def run():
+        try:
+            _compress_file(source_path, encoding, cache_path)
+        except OSError as e:
+            sys.stderr.write(f"圧縮に失敗しました: {source_path}: {e}\n")
+        finally:
+            with _compress_locks_lock:
+                _compress_pending.discard(cache_path)
+
+    threading.Thread(target=run, name="compress", daemon=True).start()
+
+
+def compressed_variant(path, stat, encoding, suffix, cache_dir):
+    """path を encoding で圧縮したファイルのパスを返す。用意できなければ None
+
+    横に置かれた <ファイル名>.br / .gz が元より新しければそれを使い、
+    なければ（対応する拡張子なら）圧縮して cache_dir に保存する。
+    COMPRESS_INLINE_MAX_BYTES より大きいファイルは別スレッドで圧縮し、できるまでは None を返す。
+    圧縮しても元より小さくならないファイル（乱数のような中身）は None を返し、そのまま送らせる。
+    """
+    sibling = path + suffix
+    if os.path.isfile(sibling):
+        sibling_stat = os.stat(sibling)
+        if sibling_stat.st_mtime >= stat.st_mtime:
+            return sibling if sibling_stat.st_size < stat.st_size else None
+    if os.path.splitext(path)[1].lower() not in COMPRESS_EXTENSIONS:
+        return None
+    if encoding == "br" and brotli is None:
+        return None
+
+    # 元ファイルのパス・更新時刻・サイズが同じ間は同じキャッシュを使う
+    # （名前の先頭をパスだけから作り、更新されたら古い版を見つけて消せるようにする）
+    path_key = hashlib.blake2b(os.path.abspath(path).encode("utf-8"), digest_size=16).hexdigest()
+    cache_path = os.path.join(cache_dir, f"{path_key}-{stat.st_mtime_ns:x}-{stat.st_size:x}{suffix}")
+    if os.path.exists(cache_path):
+        return cache_path if os.path.getsize(cache_path) < stat.st_size else None
+    if _is_precompressed(path):
+        return None
+    if stat.st_size > COMPRESS_INLINE_MAX_BYTES:
+        _compress_in_background(path, encoding, cache_path)
+        return None
+    with _compress_locks_lock:
+        lock = _compress_locks.setdefault(cache_path, threading.Lock())
+    # 同じファイルを同時に何度も圧縮しない
+    with lock:
+        if not os.path.exists(cache_path):
+            _compress_file(path, encoding, cache_path)
+    return cache_path if os.path.getsize(cache_path) < stat.st_size else None
+
+
+def choose_variant(path, stat, accept_encoding, cache_dir, log_error=None):
+    """Accept-Encoding に合わせて送るファイルを選び、(パス, 圧縮方式 or None) を返す"""
+    accepted = parse_accept_encoding(accept_encoding)
+    for candidate, suffix in ENCODINGS:
+        if candidate not in accepted:
+            continue
+        try:
+            variant = compressed_variant(path, stat, candidate, suffix, cache_dir)
+        except OSError as e:
+            if log_error is not None:
+                log_error("圧縮に失敗しました: %s", e)
+            variant = None
+        if variant is not None:
+            return variant, candidate
+    return path, None
+
+
+def make_etag(stat, encoding=None):
+    """ファイルの更新時刻とサイズから強い ETag を作る（圧縮した版は末尾に方式を付ける）"""
+    etag_base = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    return f'"{etag_base}-{encoding}"' if encoding else f'"{etag_base}"'
+
+
+def not_modified_etag(headers, stat):
+    """If-None-Match（なければ If-Modified-Since）から、ブラウザのキャッシュが最新か判定する
+
+    最新なら 304 で返す ETag を、そうでなければ None を返す。
+    圧縮した版の ETag で一致したときはその ETag を返す（キャッシュの検証子が変わらないように）。
+    """
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return make_etag(stat)
+        # 圧縮した版の ETag も同じファイルとみなす
+        current = {make_etag(stat)} | {make_etag(stat, encoding) for encoding, _ in ENCODINGS}
+        for tag in if_none_match.split(","):
+            tag = tag.strip().removeprefix("W/")
+            if tag in current:
+                return tag
+        return None
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since is not None:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return None
+        return make_etag(stat) if int(stat.st_mtime) <= since.timestamp() else None
+    return None
+
+
+def requested_range(headers, stat, last_modified):
+    """Range ヘッダーを解釈する
+
+    戻り値: None（全体を返す） / (開始, 終了)（両端を含む） / "unsatisfiable"（416 を返す）
+    """
+    range_header = headers.get("Range")
+    if range_header is None:
+        return None
+    match = RANGE_PATTERN.match(range_header.strip())
+    if_range = headers.get("If-Range")
+    # If-Range が今のファイルと違うなら、全体を返し直す
+    if match is None or (if_range is not None and if_range not in (last_modified, make_etag(stat))):
+        return None
+    size = stat.st_size
+    start_text, end_text = match.groups()
+    if start_text:
+        start = int(start_text)
+        end = min(int(end_text), size - 1) if end_text else size - 1
+    elif end_text:
+        # 末尾から N バイト
+        start = max(size - int(end_text), 0)
+        end = size - 1
+    else:
+        start, end = 0, size - 1
+    if start >= size or start > end:
+        return "unsatisfiable"
+    return start, end
+
+
+def get_point_index(path):
+    """点群ファイルの索引を読み込む（ファイルが更新されるまで使い回す）。索引がなければ None"""
+    stat = os.stat(path)
+    with _point_indexes_lock:
+        cached = _point_indexes.get(path)
+        if cached is not None and cached[0] == (stat.st_mtime_ns, stat.st_size):
+            return cached[1]
+    index = load_index(path)
+    with _point_indexes_lock:
+        _point_indexes[path] = ((stat.st_mtime_ns, stat.st_size), index)
+    return index
+
+
+class PointsRequestError(Exception):
+    def __init__(self, code, reason, explain=None):
+        super().__init__(explain or reason)
+        self.code = code
+        self.reason = reason
+        self.explain = explain
+
+
+def plan_points(query_string, translate_path):
+    """/points のクエリから (ファイルのパス, [(開始位置, 点の数), ...], 色ブロックの開始バイト) を求める"""
+    if load_index is None:
+        raise PointsRequestError(501, "Not Implemented", "/points には numpy が必要です")
+    query = urllib.parse.parse_qs(query_string)
+    path = translate_path("/" + query.get("file", [POINTS_FILE])[0].lstrip("/"))
+    try:
+        bbox = None
+        if "bbox" in query:
+            bbox = [float(v) for v in query["bbox"][0].split(",")]
+            if len(bbox) != 4:
+                raise ValueError
+        lod = int(query.get("lod", ["0"])[0])
+        if lod < 0:
+            raise ValueError
+    except ValueError:
+        raise PointsRequestError(400, "Bad Request", "bbox は xmin,zmin,xmax,zmax、lod は 0 以上の整数で指定してください")
+    if not os.path.isfile(path):
+        raise PointsRequestError(404, "File not found")
+    index = get_point_index(path)
+    if index is None or index.get("order") != "grid":
+        raise PointsRequestError(404, "Index not found", "格子の索引がありません（converter.py --sort grid で作ってください）")
+    return path, query_ranges(index, bbox, lod), index["points"] * 12
+
+
 class MyHttpRequestHandler(http.server.SimpleHTTPRequestHandler):
+    # keep-alive で1つの接続を使い回す（Content-Length を必ず送る）
+    protocol_version = "HTTP/1.1"
+    # ヘッダーと本文は別々に書き出すので、Nagle を切らないと2回目以降のリクエストが
+    # 遅延ACKを待って約40ミリ秒止まる
+    disable_nagle_algorithm = True
+    # 圧縮したファイルの置き場所（相対パスなら self.directory から）
+    compress_cache_dir = COMPRESS_CACHE_DIR
+
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path == "/points":
+            self.send_points()
+            return
+        super().do_GET()
+
+    def do_HEAD(self):
+        if urllib.parse.urlsplit(self.path).path == "/points":
+            self.send_points(head_only=True)
+            return
+        super().do_HEAD()
+
+    def send_points(self, head_only=False):
+        """/points?bbox=xmin,zmin,xmax,zmax&lod=N&file=... : 範囲内の点だけを返す
+
+        返すデータは points_textured.bin と同じ「位置(float32) → 色(uint8)」の並び。
+        並べ替えたファイルの索引からセルごとの連続した範囲を求め、
+        ファイルの該当部分をコピーせずに sendfile でそのまま送る。
+        head_only なら（HEAD リクエスト）ヘッダーだけを返す。
+        """
+        try:
+            path, ranges, colors_offset = plan_points(urllib.parse.urlsplit(self.path).query, self.translate_path)
+        except PointsRequestError as e:
+            self.send_error(e.code, e.reason, e.explain)
+            return
+        num_points = sum(count for _, count in ranges)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(num_points * 15))
+        self.send_header("X-Point-Count", str(num_points))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        if head_only:
+            return
+        with open(path, "rb") as f:
+            for start, count in ranges:
+                self.connection.sendfile(f, start * 12, count * 12)
+            for start, count in ranges:
+                self.connection.sendfile(f, colors_offset + start * 3, count * 3)
+
     def end_headers(self):
         # マルチスレッド(SharedArrayBuffer)を有効にするためのヘッダーを追加
-        self.send_header('Cross-Origin-Opener-Policy', 'same-origin')
-        self.send_header('Cross-Origin-Embedder-Policy', 'require-corp')
+        for name, value in CROSS_ORIGIN_HEADERS:
+            self.send_header(name, value)
         super().end_headers()
 
-# サーバーを起動
-with socketserver.TCPServer(("", PORT), MyHttpRequestHandler) as httpd:
-    print("サーバーを起動しました: http://127.0.0.1:{}".format(PORT))
-    print("必要なヘッダー (COOP/COEP) を追加しています。")
-    httpd.serve_forever()
\ No newline at end of file
+    def send_head(self):
+        """ファイルへのリクエストを、圧縮・条件付きリクエスト・Range に対応して返す
+
+        ディレクトリの一覧や見つからないファイルは従来通り SimpleHTTPRequestHandler に任せる。
+        """
+        self._range = None
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) and self.path.split("?", 1)[0].endswith("/"):
+            index_path = os.path.join(path, "index.html")
+            if os.path.isfile(index_path):
+                path = index_path
+        if not os.path.isfile(path):
+            return super().send_head()
+
+        stat = os.stat(path)
+        last_modified = self.date_time_string(stat.st_mtime)
+
+        # 1. 変わっていなければ 304 を返す（If-None-Match を優先する）
+        etag = not_modified_etag(self.headers, stat)
+        if etag is not None:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return None
+
+        # 2. Range 付きのリクエストは圧縮せずに一部だけ返す
+        byte_range = requested_range(self.headers, stat, last_modified)
+        if byte_range == "unsatisfiable":
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{stat.st_size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        if byte_range is not None:
+            start, end = byte_range
+            f = open(path, "rb")
+            try:
+                self.send_response(206)
+                self.send_header("Content-Type", self.guess_type(path))
+                self.send_header("Content-Range", f"bytes {start}-{end}/{stat.st_size}")
+                self.send_header("Content-Length", str(end - start + 1))
+                self.send_header("Last-Modified", last_modified)
+                self.send_header("ETag", make_etag(stat))
+                self.end_headers()
+                f.seek(start)
+                self._range = byte_range
+                return f
+            except Exception:
+                f.close()
+                raise
+
+        # 3. 受け付ける圧縮方式があれば、圧縮したファイルを返す
+        cache_dir = os.path.join(self.directory, self.compress_cache_dir)
+        send_path, encoding = choose_variant(path, stat, self.headers.get("Accept-Encoding"), cache_dir,
+                                             self.log_error)
+        f = open(send_path, "rb")
+        try:
+            size = os.fstat(f.fileno()).st_size
+            self.send_response(200)
+            self.send_header("Content-Type", self.guess_type(path))
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+            self.send_header("Content-Length", str(size))
+            self.send_header("Last-Modified", last_modified)
+            self.send_header("ETag", make_etag(stat, encoding))
+            self.send_header("Vary", "Accept-Encoding")
+            # 毎回 ETag で確かめてもらう（変わっていなければ 304 で済む）
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            return f
+        except Exception:
+            f.close()
+            raise
+
+    def send_response(self, code, message=None):
+        super().send_response(code, message)
+        if code in (200, 206):
+            # 途中で切れたダウンロードを再開できることを知らせる
+            self.send_header("Accept-Ranges", "bytes")
+
+    def copyfile(self, source, outputfile):
+        if self._range is None:
+            return super().copyfile(source, outputfile)
+        start, end = self._range
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = source.read(min(64 * 1024, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+
+
+class ThreadingServer(http.server.ThreadingHTTPServer):
+    # 大きな点群ファイルのダウンロード中でも、他のリクエストを別スレッドで処理する
+    daemon_threads = True
+    allow_reuse_address = True
+    # 既定の5では同時に多くの接続が来ると SYN が捨てられ、接続に1秒以上かかることがある
+    request_queue_size = 128
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tengun の開発用サーバー (COOP/COEP ヘッダー付き)")
+    parser.add_argument("--port", type=int, default=PORT, help="待ち受けるポート")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="asyncio 版のサーバーで起動する（同時接続が多いとき向け）")
+    parser.add_argument("--compress-cache", default=COMPRESS_CACHE_DIR, metavar="DIR",
+                        help="圧縮したファイルの置き場所（相対パスなら配信するディレクトリから）")
+    args = parser.parse_args()
+
+    if args.use_async:
+        from app_async import serve
+        asyncio.run(serve(args.port, args.compress_cache))
+        return
+
+    MyHttpRequestHandler.compress_cache_dir = args.compress_cache
+
+    # サーバーを起動
+    with ThreadingServer(("", args.port), MyHttpRequestHandler) as httpd:
+        print("サーバーを起動しました: http://127.0.0.1:{}".format(args.port))
+        print("必要なヘッダー (COOP/COEP) を追加しています。")
+        httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
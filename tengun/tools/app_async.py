@@ -0,0 +1,236 @@
+import asyncio
+import email.utils
+import http.client
+import mimetypes
+import os
+import posixpath
+import sys
+import urllib.parse
+from http import HTTPStatus
+
+from app import (COMPRESS_CACHE_DIR, CROSS_ORIGIN_HEADERS, PointsRequestError, choose_variant, make_etag,
+                 not_modified_etag, plan_points, requested_range)
+
+# --- 設定 ---
+# 配信するディレクトリ（app.py と同じく起動したディレクトリ）
+ROOT_DIR = os.getcwd()
+# リクエストヘッダーの最大サイズ
+MAX_HEADER_BYTES = 64 * 1024
+# keep-alive の接続で次のリクエストを待つ秒数
+KEEP_ALIVE_TIMEOUT = 15
+# --- ここまで ---
+
+# 圧縮したファイルの置き場所（serve() で決める）
+_compress_cache_dir = os.path.join(ROOT_DIR, COMPRESS_CACHE_DIR)
+
+mimetypes.add_type("application/wasm", ".wasm")
+mimetypes.add_type("text/javascript", ".js")
+
+
+def translate_path(url_path):
+    """URLのパスを ROOT_DIR 以下のファイルのパスにする（.. で外に出られないようにする）"""
+    url_path = urllib.parse.unquote(url_path.split("?", 1)[0].split("#", 1)[0])
+    trailing_slash = url_path.endswith("/")
+    path = ROOT_DIR
+    for word in posixpath.normpath(url_path).split("/"):
+        if not word or word in (os.curdir, os.pardir) or os.path.dirname(word):
+            continue
+        path = os.path.join(path, word)
+    return path + "/" if trailing_slash else path
+
+
+def guess_type(path):
+    content_type, _ = mimetypes.guess_type(path)
+    return content_type or "application/octet-stream"
+
+
+class Response:
+    """ステータスとヘッダーを組み立てて書き出す（COOP/COEP は必ず付ける）"""
+
+    def __init__(self, writer, status, keep_alive):
+        self.writer = writer
+        self.status = HTTPStatus(status)
+        self.headers = [
+            ("Server", "tengun-asyncio"),
+            ("Date", email.utils.formatdate(usegmt=True)),
+        ]
+        if not keep_alive:
+            self.headers.append(("Connection", "close"))
+
+    def add(self, name, value):
+        self.headers.append((name, str(value)))
+
+    async def send(self, body=b""):
+        lines = [f"HTTP/1.1 {self.status.value} {self.status.phrase}"]
+        lines += [f"{name}: {value}" for name, value in self.headers + CROSS_ORIGIN_HEADERS]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+
+
+async def send_error(writer, status, keep_alive, explain=None):
+    body = f"<html><body><h1>{status}</h1><p>{explain or HTTPStatus(status).phrase}</p></body></html>"
+    body = body.encode("utf-8")
+    response = Response(writer, status, keep_alive)
+    response.add("Content-Type", "text/html; charset=utf-8")
+    response.add("Content-Length", len(body))
+    await response.send(body)
+
+
+async def send_file_range(writer, path, offset, count):
+    """ファイルの一部を loop.sendfile でそのまま送る（使えない環境では読み書きに切り替わる）"""
+    if count <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    with open(path, "rb") as f:
+        await loop.sendfile(writer.transport, f, offset, count)
+
+
+async def handle_points(writer, query_string, keep_alive, head_only):
+    try:
+        path, ranges, colors_offset = plan_points(query_string, translate_path)
+    except PointsRequestError as e:
+        await send_error(writer, e.code, keep_alive, e.explain)
+        return
+    num_points = sum(count for _, count in ranges)
+    response = Response(writer, 200, keep_alive)
+    response.add("Content-Type", "application/octet-stream")
+    response.add("Content-Length", num_points * 15)
+    response.add("X-Point-Count", num_points)
+    response.add("Cache-Control", "no-cache")
+    await response.send()
+    if head_only:
+        return
+    for start, count in ranges:
+        await send_file_range(writer, path, start * 12, count * 12)
+    for start, count in ranges:
+        await send_file_range(writer, path, colors_offset + start * 3, count * 3)
+
+
+async def handle_file(writer, url_path, headers, keep_alive, head_only):
+    """app.py の MyHttpRequestHandler.send_head と同じ規則でファイルを返す"""
+    path = translate_path(url_path)
+    if os.path.isdir(path):
+        if not url_path.split("?", 1)[0].endswith("/"):
+            # ディレクトリは末尾に / を付けた URL へ転送する
+            response = Response(writer, 301, keep_alive)
+            response.add("Location", url_path.split("?", 1)[0] + "/")
+            response.add("Content-Length", 0)
+            await response.send()
+            return
+        path = os.path.join(path, "index.html")
+    if not os.path.isfile(path):
+        await send_error(writer, 404, keep_alive, "File not found")
+        return
+
+    stat = os.stat(path)
+    last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+
+    etag = not_modified_etag(headers, stat)
+    if etag is not None:
+        response = Response(writer, 304, keep_alive)
+        response.add("ETag", etag)
+        response.add("Last-Modified", last_modified)
+        response.add("Vary", "Accept-Encoding")
+        await response.send()
+        return
+
+    byte_range = requested_range(headers, stat, last_modified)
+    if byte_range == "unsatisfiable":
+        response = Response(writer, 416, keep_alive)
+        response.add("Content-Range", f"bytes */{stat.st_size}")
+        response.add("Content-Length", 0)
+        await response.send()
+        return
+    if byte_range is not None:
+        start, end = byte_range
+        response = Response(writer, 206, keep_alive)
+        response.add("Content-Type", guess_type(path))
+        response.add("Content-Range", f"bytes {start}-{end}/{stat.st_size}")
+        response.add("Content-Length", end - start + 1)
+        response.add("Last-Modified", last_modified)
+        response.add("ETag", make_etag(stat))
+        response.add("Accept-Ranges", "bytes")
+        await response.send()
+        if not head_only:
+            await send_file_range(writer, path, start, end - start + 1)
+        return
+
+    # 初回の圧縮はイベントループを止めないよう別スレッドで行う
+    send_path, encoding = await asyncio.to_thread(choose_variant, path, stat, headers.get("Accept-Encoding"),
+                                                  _compress_cache_dir)
+    size = os.stat(send_path).st_size
+    response = Response(writer, 200, keep_alive)
+    response.add("Content-Type", guess_type(path))
+    if encoding:
+        response.add("Content-Encoding", encoding)
+    response.add("Content-Length", size)
+    response.add("Last-Modified", last_modified)
+    response.add("ETag", make_etag(stat, encoding))
+    response.add("Vary", "Accept-Encoding")
+    response.add("Cache-Control", "no-cache")
+    response.add("Accept-Ranges", "bytes")
+    await response.send()
+    if not head_only:
+        await send_file_range(writer, send_path, 0, size)
+
+
+async def handle_connection(reader, writer):
+    """1つの接続で keep-alive のリクエストを順に処理する"""
+    try:
+        while True:
+            try:
+                raw = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                return
+            except asyncio.LimitOverrunError:
+                await send_error(writer, 431, False)
+                return
+
+            request_line, _, header_bytes = raw.partition(b"\r\n")
+            try:
+                method, target, version = request_line.decode("latin-1").split()
+            except ValueError:
+                await send_error(writer, 400, False)
+                return
+            headers = http.client.parse_headers(_BytesReader(header_bytes))
+            connection = (headers.get("Connection") or "").lower()
+            keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+
+            # GET / HEAD 以外は本文を読み捨てて 501 を返す
+            length = int(headers.get("Content-Length") or 0)
+            if length:
+                await reader.readexactly(length)
+            if method not in ("GET", "HEAD"):
+                await send_error(writer, 501, keep_alive)
+            elif urllib.parse.urlsplit(target).path == "/points":
+                await handle_points(writer, urllib.parse.urlsplit(target).query, keep_alive, method == "HEAD")
+            else:
+                await handle_file(writer, target, headers, keep_alive, method == "HEAD")
+            sys.stderr.write(f'{writer.get_extra_info("peername")[0]} - "{method} {target} {version}"\n')
+            if not keep_alive:
+                return
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+
+class _BytesReader:
+    """http.client.parse_headers に渡すための、行単位で読めるバッファ"""
+
+    def __init__(self, data):
+        self._lines = iter(data.splitlines(keepends=True) + [b"\r\n"])
+
+    def readline(self, limit=-1):
+        return next(self._lines, b"")
+
+
+async def serve(port, compress_cache=COMPRESS_CACHE_DIR):
+    """port で待ち受ける。compress_cache は圧縮したファイルの置き場所（相対パスなら ROOT_DIR から）"""
+    global _compress_cache_dir
+    _compress_cache_dir = os.path.join(ROOT_DIR, compress_cache)
+    server = await asyncio.start_server(handle_connection, "", port, limit=MAX_HEADER_BYTES, backlog=1024)
+    print("サーバーを起動しました (asyncio): http://127.0.0.1:{}".format(port))
+    print("必要なヘッダー (COOP/COEP) を追加しています。")
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,402 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import sys
+import tracemalloc
+
+import laspy
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+import instrument
+from converter import (Colorizer, build_parser, convert_file, convert_in_memory, convert_streaming, load_tif_datasets,
+                       prepare_rasters)
+from pointfile import (create_raw_points, normals_path_for, read_normals, read_points, write_points,
+                       zstandard)
+
+# --- 設定 ---
+# 計測する点の数と写真の枚数（写真の枚数は 1, 4, 9, 16, ... のような平方数）
+BENCH_POINTS = [1_000_000, 10_000_000, 50_000_000]
+BENCH_TILES = [1, 4, 64]
+# 合成データの置き場所
+BENCH_DATA_DIR = "bench_data"
+# 基準にする計測結果
+BASELINE_FILE = "bench_baseline.json"
+# 基準よりこの割合以上遅くなった段階があれば失敗にする (0.2 = 20%)
+SLOWDOWN_THRESHOLD = 0.2
+# これより短い段階は誤差が大きいので比べない（秒）
+MIN_COMPARE_SECONDS = 0.05
+# 合成データの範囲（メートル）と、写真全体を合わせた一辺のピクセル数
+AREA_SIZE = 1000.0
+RASTER_PIXELS = 4096
+# 出力が従来の実装と同じかを確かめるときの点の数（従来の実装は1点ずつ処理するので遅い）
+CHECK_POINTS = 200_000
+# pointfile の読み書きの往復を確かめる点の数と、ブロックの点数（複数ブロックになるように小さくする）
+ROUNDTRIP_POINTS = 10_000
+ROUNDTRIP_BLOCK_POINTS = 4_096
+THINNING_RATE = 2
+# --- ここまで ---
+
+
+def generate_las(path, num_points, seed=0, chunk_points=5_000_000):
+    """写真の範囲より少し広い範囲に一様に点を置いたLASを作る（写真の境界ちょうどの点も混ぜる）"""
+    header = laspy.LasHeader(point_format=3, version="1.2")
+    header.scales = [0.01, 0.01, 0.01]
+    header.offsets = [0, 0, 0]
+    rng = np.random.default_rng(seed)
+    with laspy.open(path, mode="w", header=header) as writer:
+        for start in range(0, num_points, chunk_points):
+            count = min(chunk_points, num_points - start)
+            record = laspy.ScaleAwarePointRecord.zeros(count, header=header)
+            x = rng.uniform(-10, AREA_SIZE + 10, count)
+            y = rng.uniform(-10, AREA_SIZE + 10, count)
+            if start == 0:
+                edge = min(count // 10, 1000)
+                x[:edge] = np.round(x[:edge] / 125.0) * 125.0
+                y[edge:2 * edge] = np.round(y[edge:2 * edge] / 125.0) * 125.0
+            record.x = x
+            record.y = y
+            record.z = rng.uniform(10, 50, count)
+            writer.write_points(record)
+
+
+def generate_tiles(directory, num_tiles, seed=0):
+    """AREA_SIZE 四方を num_tiles 枚に分けた GeoTIFF を作り、パスのリストを返す"""
+    per_axis = math.isqrt(num_tiles)
+    if per_axis * per_axis != num_tiles:
+        raise ValueError(f"写真の枚数は平方数にしてください: {num_tiles}")
+    os.makedirs(directory, exist_ok=True)
+    tile_pixels = RASTER_PIXELS // per_axis
+    pixel_size = AREA_SIZE / RASTER_PIXELS
+    tile_size = tile_pixels * pixel_size
+    rng = np.random.default_rng(seed)
+    paths = []
+    for ty in range(per_axis):
+        for tx in range(per_axis):
+            path = os.path.join(directory, f"tile_{ty:02d}_{tx:02d}.tif")
+            paths.append(path)
+            if os.path.exists(path):
+                continue
+            image = rng.integers(0, 256, size=(3, tile_pixels, tile_pixels), dtype=np.uint8)
+            transform = from_origin(tx * tile_size, AREA_SIZE - ty * tile_size, pixel_size, pixel_size)
+            with rasterio.open(path, "w", driver="GTiff", width=tile_pixels, height=tile_pixels, count=3,
+                               dtype="uint8", transform=transform, crs="EPSG:6677") as dataset:
+                dataset.write(image)
+    return paths
+
+
+def prepare_data(data_dir, num_points, num_tiles):
+    """合成データを用意する（作成済みならそれを使う）"""
+    os.makedirs(data_dir, exist_ok=True)
+    las_path = os.path.join(data_dir, f"points_{num_points}.las")
+    if not os.path.exists(las_path):
+        print(f"合成LAS '{las_path}' を作っています...")
+        generate_las(las_path, num_points)
+    tif_paths = generate_tiles(os.path.join(data_dir, f"tiles_{num_tiles}"), num_tiles)
+    return las_path, tif_paths
+
+
+def run_case(las_path, tif_paths, output_path, workers=1, trace_memory=False):
+    """converter.py の main と同じ呼び出し（load_tif_datasets → prepare_rasters → convert_file）を
+    instrument で段階ごとに計測し、{段階: 結果} を返す
+
+    変換の設定は converter.py の既定値（間引きの間隔と色付けのプロセス数だけ変える）。
+    trace_memory なら tracemalloc で Python が確保したメモリのピークも測る（遅くなる）。
+    """
+    options = build_parser().parse_args(["--las", las_path, "--tif", *tif_paths, "--output", output_path,
+                                         "--thinning-rate", str(THINNING_RATE), "--workers", str(workers)])
+    instrument.configure()
+    instrument.reset()
+    if trace_memory:
+        tracemalloc.start()
+    tif_datasets = []
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            with instrument.stage("load_rasters"):
+                tif_datasets = load_tif_datasets(options.tif)
+                prepare_rasters(tif_datasets, options)
+            convert_file(las_path, tif_datasets, output_path, options)
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        for tif in tif_datasets:
+            tif["dataset"].close()
+        instrument.configure(enabled=False)
+    results = {}
+    for row in instrument.summary():
+        results[row["stage"]] = {
+            "seconds": row["wall_seconds"],
+            "cpu_seconds": row["cpu_seconds"],
+            "points": row["points"],
+            "peak_rss_mb": row["peak_rss_mb"],
+        }
+        if "traced_peak_mb" in row:
+            results[row["stage"]]["traced_peak_mb"] = row["traced_peak_mb"]
+    return results
+
+
+def reference_convert(las_path, tif_paths, output_path):
+    """ベクトル化する前の converter.py と同じ、1点ずつ写真を探す実装"""
+    tif_datasets = []
+    for tif_path in tif_paths:
+        dataset = rasterio.open(tif_path)
+        tif_datasets.append({
+            "dataset": dataset,
+            "transform": dataset.transform,
+            "width": dataset.width,
+            "height": dataset.height,
+            "bounds": dataset.bounds,
+            "image_data": dataset.read(),
+        })
+    try:
+        with laspy.open(las_path) as las_file:
+            las = las_file.read()
+        thinned_points = las.points[::THINNING_RATE]
+        positions = np.vstack((
+            thinned_points.x, thinned_points.z, thinned_points.y
+        )).transpose().astype(np.float32)
+        if positions.size > 0:
+            positions[:, 1] -= np.min(positions[:, 1])
+
+        colors = []
+        point_coords_x = thinned_points.x
+        point_coords_y = thinned_points.y
+        for i in range(len(point_coords_x)):
+            px, py = point_coords_x[i], point_coords_y[i]
+            found_color = False
+            for tif in tif_datasets:
+                if tif["bounds"].left <= px <= tif["bounds"].right and \
+                   tif["bounds"].bottom <= py <= tif["bounds"].top:
+                    rows, cols = rasterio.transform.rowcol(tif["transform"], xs=[px], ys=[py])
+                    row, col = rows[0], cols[0]
+                    if 0 <= row < tif["height"] and 0 <= col < tif["width"]:
+                        colors.append(tif["image_data"][:, row, col])
+                        found_color = True
+                        break
+            if not found_color:
+                colors.append([128, 128, 128])
+        colors_np = np.array(colors, dtype=np.uint8).reshape(-1, 3)
+
+        with open(output_path, "wb") as bf:
+            bf.write(positions.tobytes())
+            bf.write(colors_np.tobytes())
+    finally:
+        for tif in tif_datasets:
+            tif["dataset"].close()
+
+
+def check_correctness(data_dir, num_tiles, workers):
+    """各変換方式の出力が従来の実装とバイト単位で同じかを調べ、違った方式の名前を返す"""
+    las_path, tif_paths = prepare_data(data_dir, CHECK_POINTS, num_tiles)
+    reference_path = os.path.join(data_dir, f"reference_{CHECK_POINTS}_{num_tiles}.bin")
+    if not os.path.exists(reference_path):
+        print(f"従来の実装で基準の出力を作っています (写真 {num_tiles} 枚)...")
+        reference_convert(las_path, tif_paths, reference_path)
+    with open(reference_path, "rb") as f:
+        expected = f.read()
+
+    output_path = os.path.join(data_dir, "check_output.bin")
+    methods = {
+        "in_memory": lambda colorizer: convert_in_memory(las_path, colorizer, output_path, THINNING_RATE),
+        "streaming": lambda colorizer: convert_streaming(las_path, colorizer, output_path,
+                                                         THINNING_RATE, CHECK_POINTS // 7),
+    }
+    failures = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        tif_datasets = load_tif_datasets(tif_paths)
+    try:
+        for tif in tif_datasets:
+            tif["image_data"] = tif["dataset"].read()
+        for method_workers in sorted({1, workers}):
+            for name, method in methods.items():
+                label = f"{name} (workers={method_workers})"
+                with contextlib.redirect_stdout(io.StringIO()):
+                    with Colorizer(tif_datasets, method_workers) as colorizer:
+                        method(colorizer)
+                with open(output_path, "rb") as f:
+                    ok = f.read() == expected
+                print(f"  {label}: {'OK' if ok else '不一致'}")
+                if not ok:
+                    failures.append(label)
+    finally:
+        for tif in tif_datasets:
+            tif["dataset"].close()
+        if os.path.exists(output_path):
+            os.remove(output_path)
+    return failures
+
+
+def check_pointfile_roundtrip(data_dir):
+    """write_points → read_points / read_normals で元に戻るかを圧縮形式ごとに調べ、違った形式の名前を返す
+
+    位置は量子化の半ステップ（scale / 2）以内、色は完全一致、法線は int8 の半ステップ（0.5 / 127）以内なら OK。
+    ヘッダーのない points_textured.bin と別ファイルの法線 (*_normals.bin) も調べる。
+    """
+    rng = np.random.default_rng(0)
+    positions = (rng.random((ROUNDTRIP_POINTS, 3)) * [AREA_SIZE, 50.0, AREA_SIZE]).astype(np.float32)
+    colors = rng.integers(0, 256, (ROUNDTRIP_POINTS, 3), dtype=np.uint8)
+    normals = rng.normal(size=(ROUNDTRIP_POINTS, 3))
+    normals = (normals / np.linalg.norm(normals, axis=1, keepdims=True)).astype(np.float32)
+
+    def within(actual, expected, bound):
+        # float32 に戻すときの丸め分だけ余裕を持たせる
+        tolerance = bound + np.abs(expected) * np.finfo(np.float32).eps * 2
+        return actual.shape == expected.shape and bool(np.all(np.abs(actual - expected) <= tolerance))
+
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, "roundtrip_check.tgpc")
+    compressions = ["none", "deflate"] + (["zstd"] if zstandard is not None else [])
+    failures = []
+    try:
+        for compression in compressions:
+            for with_normals in (False, True):
+                label = f"{compression}{' + normals' if with_normals else ''}"
+                header = write_points(path, positions, colors, compression,
+                                      ROUNDTRIP_BLOCK_POINTS, normals if with_normals else None)
+                read_positions, read_colors = read_points(path)
+                read_back_normals = read_normals(path)
+                ok = (within(read_positions, positions, np.array(header["scale"]) / 2)
+                      and np.array_equal(read_colors, colors))
+                if with_normals:
+                    ok = ok and read_back_normals is not None and within(read_back_normals, normals, 0.5 / 127)
+                else:
+                    ok = ok and read_back_normals is None
+                print(f"  {label}: {'OK' if ok else '不一致'}")
+                if not ok:
+                    failures.append(label)
+        if zstandard is None:
+            print("  zstd: zstandard がないので調べません")
+
+        # ヘッダーのないフォーマットはそのままの値で戻る
+        raw_path = os.path.join(data_dir, "roundtrip_check.bin")
+        raw_positions, raw_colors = create_raw_points(raw_path, ROUNDTRIP_POINTS)
+        raw_positions[:] = positions
+        raw_colors[:] = colors
+        raw_positions.flush()
+        del raw_positions, raw_colors
+        normals.tofile(normals_path_for(raw_path))
+        read_positions, read_colors = read_points(raw_path)
+        ok = (np.array_equal(read_positions, positions) and np.array_equal(read_colors, colors)
+              and np.array_equal(read_normals(raw_path), normals))
+        del read_positions, read_colors
+        print(f"  raw + normals: {'OK' if ok else '不一致'}")
+        if not ok:
+            failures.append("raw + normals")
+    finally:
+        for leftover in [path, os.path.join(data_dir, "roundtrip_check.bin"),
+                         normals_path_for(os.path.join(data_dir, "roundtrip_check.bin"))]:
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return failures
+
+
+def compare_with_baseline(results, baseline, threshold):
+    """基準より threshold 以上遅くなった (ケース, 段階, 基準の秒, 今回の秒) のリストを返す"""
+    regressions = []
+    for case, stages in results.items():
+        if case not in baseline:
+            continue
+        for stage, measured in stages.items():
+            base = baseline[case].get(stage)
+            if base is None or base["seconds"] < MIN_COMPARE_SECONDS:
+                continue
+            if measured["seconds"] > base["seconds"] * (1 + threshold):
+                regressions.append((case, stage, base["seconds"], measured["seconds"]))
+    return regressions
+
+
+def print_table(case, stages):
+    print(f"\n[{case}]")
+    traced = any("traced_peak_mb" in result for result in stages.values())
+    print(f"  {'段階':<14}{'秒':>10}{'CPU/経過':>10}{'点/秒':>16}{'ピークRSS(MB)':>16}"
+          + (f"{'tracemalloc(MB)':>18}" if traced else ""))
+    for stage, result in stages.items():
+        seconds = result["seconds"]
+        cpu_ratio = f"{result['cpu_seconds'] / seconds:.2f}" if seconds > 0 else "-"
+        rate = f"{result['points'] / seconds:,.0f}" if result["points"] and seconds > 0 else "-"
+        peak = f"{result['peak_rss_mb']:,.1f}" if result["peak_rss_mb"] is not None else "-"
+        line = f"  {stage:<14}{seconds:>10.3f}{cpu_ratio:>10}{rate:>16}{peak:>16}"
+        if traced:
+            line += f"{result.get('traced_peak_mb', 0):>18,.1f}"
+        print(line)
+    total = sum(result["seconds"] for result in stages.values())
+    print(f"  {'合計':<10}{total:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="converter.py のベンチマークと回帰チェック")
+    parser.add_argument("--points", type=int, nargs="+", default=BENCH_POINTS, help="計測する点の数")
+    parser.add_argument("--tiles", type=int, nargs="+", default=BENCH_TILES, help="計測する写真の枚数（平方数）")
+    parser.add_argument("--data-dir", default=BENCH_DATA_DIR, help="合成データの置き場所")
+    parser.add_argument("--workers", type=int, default=1, help="色付けのプロセス数")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="基準の計測結果 (JSON)")
+    parser.add_argument("--save-baseline", action="store_true", help="今回の結果を基準として保存する")
+    parser.add_argument("--threshold", type=float, default=SLOWDOWN_THRESHOLD,
+                        help="この割合以上遅くなったら失敗にする (0.2 = 20%%)")
+    parser.add_argument("--skip-check", action="store_true", help="出力が従来の実装と同じかを調べない")
+    parser.add_argument("--check", action="store_true", help="出力の確認だけを行い、計測はしない")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="tracemalloc で段階ごとに Python のメモリ確保のピークも測る（計測が遅くなる）")
+    args = parser.parse_args()
+
+    failed = False
+    if not args.skip_check:
+        print("--- 出力の確認 ---")
+        print("点群ファイルの読み書きの往復:")
+        if check_pointfile_roundtrip(args.data_dir):
+            failed = True
+        for num_tiles in args.tiles:
+            print(f"写真 {num_tiles} 枚, {CHECK_POINTS:,} 点:")
+            if check_correctness(args.data_dir, num_tiles, args.workers):
+                failed = True
+
+    if args.check:
+        print("\n--- 失敗 ---" if failed else "\n--- 成功 ---")
+        sys.exit(1 if failed else 0)
+
+    print("\n--- 計測 ---")
+    results = {}
+    output_path = os.path.join(args.data_dir, "bench_output.bin")
+    for num_points in args.points:
+        for num_tiles in args.tiles:
+            las_path, tif_paths = prepare_data(args.data_dir, num_points, num_tiles)
+            case = f"{num_points}pts_{num_tiles}tiles"
+            results[case] = run_case(las_path, tif_paths, output_path, args.workers, args.trace_memory)
+            print_table(case, results[case])
+    if os.path.exists(output_path):
+        os.remove(output_path)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=1)
+        print(f"\n基準を '{args.baseline}' に保存しました。")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        for case, stage, base, measured in regressions:
+            print(f"遅くなりました: {case} の {stage}: {base:.3f} 秒 → {measured:.3f} 秒")
+        if regressions:
+            failed = True
+        else:
+            print(f"\n基準 '{args.baseline}' と比べて {args.threshold:.0%} 以上遅くなった段階はありません。")
+    else:
+        print(f"\n基準 '{args.baseline}' がないので比べません（--save-baseline で作れます）。")
+
+    if failed:
+        print("\n--- 失敗 ---")
+        sys.exit(1)
+    print("\n--- 成功 ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+# --- 設定 ---
+# 計測に使うポート（従来のサーバー / asyncio 版）
+THREADED_PORT = 5511
+ASYNC_PORT = 5512
+# 同時接続数と、1接続あたりのリクエスト数
+CONCURRENCY = 50
+REQUESTS_PER_CONNECTION = 40
+# リクエストするパス（順番に使う）
+BENCH_PATHS = ["/index.html", "/main.js", "/worker.js", "/kdTree.js"]
+# --- ここまで ---
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+async def _read_response(reader):
+    """レスポンスを1つ読み、(ステータス, 本文の長さ) を返す"""
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    length = 0
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value.strip())
+    if length:
+        await reader.readexactly(length)
+    return status, length
+
+
+async def _client(port, paths, num_requests, latencies, errors):
+    """keep-alive の接続1本で num_requests 回リクエストし、1回ごとの所要時間を記録する"""
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        errors.append("connect")
+        return
+    try:
+        for i in range(num_requests):
+            path = paths[i % len(paths)]
+            request = f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept-Encoding: identity\r\n\r\n"
+            start = time.perf_counter()
+            writer.write(request.encode("latin-1"))
+            status, _ = await _read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    except (OSError, asyncio.IncompleteReadError) as e:
+        errors.append(type(e).__name__)
+    finally:
+        writer.close()
+
+
+async def run_load(port, concurrency, requests_per_connection, paths):
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        _client(port, paths, requests_per_connection, latencies, errors) for _ in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def start_server(port, use_async, directory):
+    command = [sys.executable, os.path.join(TOOLS_DIR, "app.py"), "--port", str(port)]
+    if use_async:
+        command.append("--async")
+    env = dict(os.environ, PYTHONPATH=TOOLS_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    process = subprocess.Popen(command, cwd=directory, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # 待ち受けを始めるまで待つ
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            asyncio.run(_probe(port))
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"サーバーが起動しませんでした (ポート {port})")
+
+
+async def _probe(port):
+    _, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="app.py の従来のサーバーと asyncio 版の負荷比較")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="同時接続数")
+    parser.add_argument("--requests", type=int, default=REQUESTS_PER_CONNECTION, help="1接続あたりのリクエスト数")
+    parser.add_argument("--paths", nargs="+", default=BENCH_PATHS, help="リクエストするパス")
+    parser.add_argument("--directory", default=TOOLS_DIR, help="サーバーが配信するディレクトリ")
+    args = parser.parse_args()
+
+    print(f"同時接続数 {args.concurrency}, 1接続あたり {args.requests} リクエスト, パス: {' '.join(args.paths)}")
+    print(f"\n{'サーバー':<14}{'リクエスト/秒':>16}{'p50(ms)':>12}{'p99(ms)':>12}{'エラー':>10}")
+    for name, port, use_async in [("threading", THREADED_PORT, False), ("asyncio", ASYNC_PORT, True)]:
+        process = start_server(port, use_async, args.directory)
+        try:
+            latencies, errors, elapsed = asyncio.run(
+                run_load(port, args.concurrency, args.requests, args.paths)
+            )
+        finally:
+            process.terminate()
+            process.wait()
+        rate = len(latencies) / elapsed if elapsed > 0 else 0
+        print(f"{name:<14}{rate:>16,.0f}{percentile(latencies, 50) * 1000:>12.2f}"
+              f"{percentile(latencies, 99) * 1000:>12.2f}{len(errors):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+class ConversionCache:
+    """変換の途中結果を入力ファイルの内容ハッシュをキーにして保存するキャッシュ
+
+    cache_dir/
+      fingerprints.json   ファイルパス → (サイズ, 更新時刻, 内容ハッシュ)
+      points/<key>.npz    間引き後の点（LASのハッシュ + 間引きの設定がキー）
+      colors/<key>.npz    写真1枚分の色（TIFのハッシュ + 点のキーがキー）
+    入力が変わっていない段階はキャッシュを読むだけで済む。
+    内容ハッシュはサイズと更新時刻が同じ間は計算し直さない。
+    複数のプロセスが同じ cache_dir を使ってもよい（一時ファイルはプロセスごとに別の名前にし、
+    fingerprints.json はロックを取ってから読み直して書き足す）。
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._fingerprints_path = os.path.join(cache_dir, "fingerprints.json")
+        self._lock_path = os.path.join(cache_dir, "fingerprints.lock")
+        self._fingerprints = self._read_fingerprints()
+
+    def _read_fingerprints(self):
+        if not os.path.exists(self._fingerprints_path):
+            return {}
+        try:
+            with open(self._fingerprints_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """fingerprints.json を読み書きする間、ほかのプロセスを待たせる（ロックできない環境ではそのまま進む）"""
+        with open(self._lock_path, "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                elif msvcrt is not None:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def file_hash(self, path):
+        """ファイルの内容ハッシュ（BLAKE2b）を返す"""
+        stat = os.stat(path)
+        abs_path = os.path.abspath(path)
+        memo = self._fingerprints.get(abs_path)
+        if memo and memo["size"] == stat.st_size and memo["mtime_ns"] == stat.st_mtime_ns:
+            return memo["hash"]
+
+        digest = hashlib.blake2b(digest_size=20)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(8 * 1024 * 1024), b""):
+                digest.update(block)
+        file_hash = digest.hexdigest()
+
+        memo = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": file_hash}
+        with self._locked():
+            # ほかのプロセスが書き足した分を消さないよう、読み直してから書き足す
+            self._fingerprints = self._read_fingerprints()
+            self._fingerprints[abs_path] = memo
+            with self._temp_file(self._fingerprints_path, "w", encoding="utf-8") as f:
+                json.dump(self._fingerprints, f, ensure_ascii=False, indent=1)
+        return file_hash
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _temp_file(path, mode, **kwargs):
+        """path と同じディレクトリにプロセスごとに別名の一時ファイルを作って書き、最後に path と置き換える"""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".",
+                                        suffix=".tmp")
+        try:
+            with os.fdopen(fd, mode, **kwargs) as f:
+                yield f
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def key(*parts):
+        """パラメータの組からキャッシュのキーを作る"""
+        return hashlib.blake2b(json.dumps(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+    def _path(self, kind, key):
+        return os.path.join(self.cache_dir, kind, f"{key}.npz")
+
+    def load(self, kind, key):
+        """保存済みの配列を dict で返す。なければ None"""
+        path = self._path(kind, key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+
+    def save(self, kind, key, **arrays):
+        path = self._path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 途中で止まっても壊れたキャッシュが残らないよう、一時ファイルに書いてから置き換える
+        with self._temp_file(path, "wb") as f:
+            np.savez(f, **arrays)
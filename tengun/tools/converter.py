@@ -1,13 +1,31 @@
+import argparse
+import glob
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
 import laspy
 import numpy as np
 import rasterio
+from rasterio.windows import Window
 from PIL import Image
 
+import instrument
+from convcache import ConversionCache
+from normals import compute_normals
+from octree import build_octree
+from pointfile import create_raw_points, normals_path_for, read_raw_points, write_points
+from spatialindex import index_path_for, sort_raw_points_by_grid, sort_raw_points_by_morton
+from thinning import poisson_disk_indices, voxel_grid_indices, voxel_size_for_target
+
 # --- 設定 ---
 # ★★★ ファイル名を自分の環境に合わせて変更してください ★★★
 INPUT_LAS_FILE = "downloaded_file.las"
 
 # ★★★ 4つのTIFファイル名をリストとしてすべて記述します ★★★
+# （ディレクトリ名や "tiles/*.tif" のようなワイルドカードも指定できます）
 INPUT_TIF_FILES = [
     "09LD0750.tif",
     "09LD0761.tif",
@@ -17,14 +35,473 @@ INPUT_TIF_FILES = [
 
 OUTPUT_BINARY_FILE = "points_textured.bin"
 THINNING_RATE = 2
+# 間引き方: "stride"（THINNING_RATE 点おき） / "voxel"（ボクセル格子で1セル1点） / "poisson"（近似ポアソンディスク）
+THINNING_MODE = "stride"
+# voxel モードの格子の大きさ、poisson モードの点の最小間隔（LASの座標単位）
+THINNING_SPACING = 0.5
+# voxel モードで、残したい点の数から格子の大きさを自動で決める（None なら THINNING_SPACING を使う）
+TARGET_POINTS = None
+# ストリーミングモードで一度に読み込む点の数
+CHUNK_SIZE = 1_000_000
+# 色付けを並列に行うプロセス数（1なら並列化しない）
+WORKERS = 1
+# 写真をブロック単位で必要な分だけ読み込むときのキャッシュ上限(MB)
+# 0 のときは従来どおり写真全体を最初に読み込む
+RASTER_CACHE_MB = 0
+# 写真を読み込むブロックの大きさ(ピクセル)
+RASTER_BLOCK_SIZE = 512
+# viewer で段階的に読み込むためのオクツリーの出力先（None なら作らない）
+OUTPUT_OCTREE_DIR = None
+# 出力フォーマット: "raw"（従来のヘッダーなし） / "tgpc"（ヘッダー付き・16bit量子化）
+OUTPUT_FORMAT = "raw"
+# tgpc フォーマットのブロック圧縮: "none" / "deflate" / "zstd"
+OUTPUT_COMPRESSION = "deflate"
+# 法線を計算するときの近傍点の数（None なら法線を計算しない）
+NORMALS_K = None
+# 法線の向きの揃え方: "propagate"（近傍をたどって揃える） / "viewpoint"（真上の視点に向ける）
+NORMALS_ORIENTATION = "propagate"
+# 途中結果のキャッシュを置くディレクトリ（None ならキャッシュしない）
+CACHE_DIR = None
+# 色の取り方: "nearest"（一番近いピクセル） / "bilinear"（周囲4ピクセルの補間）
+# / "area"（点の担当範囲 SAMPLE_FOOTPRINT 四方を SUPERSAMPLES x SUPERSAMPLES 点で平均）
+SAMPLING = "nearest"
+SAMPLE_FOOTPRINT = 0.5
+SUPERSAMPLES = 4
+# bilinear / area で一度にまとめて処理する点の数（1点あたり複数回写真を参照するので分けて計算する）
+SAMPLE_BATCH = 250_000
+# 出力する点の並べ方: "none"（LASの順のまま） / "grid"（水平方向の格子セルごと。app.py の /points 用）
+# / "morton"（3次元の Morton 符号の順）。none 以外は索引 (*_index.json) も書き出す
+SORT_ORDER = "none"
+# まとめて変換するときに同時に処理するLASファイルの数（プロセス数）
+BATCH_JOBS = 1
+# まとめて変換するときの写真のブロックキャッシュ上限(MB, 1プロセスあたり)
+BATCH_RASTER_CACHE_MB = 1024
 # --- ここまで ---
 
-print("--- 点群テクスチャリング処理開始 ---")
 
-try:
-    # 1. 4つの航空写真(GeoTIFF)をすべて読み込む
+class TileIndex:
+    """写真の範囲(bounds)から、点が含まれる写真を素早く探すための格子インデックス
+
+    全写真を覆う範囲を等間隔の格子に区切り、各セルに「重なっている写真の番号」を
+    リスト順に登録しておく。点はセル番号を計算するだけで候補の写真が分かるので、
+    写真が何百枚あっても、1点あたりに調べる写真は境界付近でも数枚で済む。
+    """
+
+    def __init__(self, tif_datasets):
+        self.num_tiles = len(tif_datasets)
+        if self.num_tiles == 0:
+            self.cell_tiles = np.full((1, 1), -1, dtype=np.int32)
+            self.x0 = self.y0 = 0.0
+            self.cell_size = 1.0
+            self.nx = self.ny = 1
+            return
+
+        lefts = np.array([tif["bounds"].left for tif in tif_datasets], dtype=np.float64)
+        rights = np.array([tif["bounds"].right for tif in tif_datasets], dtype=np.float64)
+        bottoms = np.array([tif["bounds"].bottom for tif in tif_datasets], dtype=np.float64)
+        tops = np.array([tif["bounds"].top for tif in tif_datasets], dtype=np.float64)
+
+        # セルの大きさは写真の大きさの半分程度にする
+        tile_size = np.median(np.maximum(rights - lefts, tops - bottoms))
+        self.cell_size = float(tile_size / 2) if tile_size > 0 else 1.0
+        self.x0 = float(lefts.min())
+        self.y0 = float(bottoms.min())
+        self.nx = int(np.floor((rights.max() - self.x0) / self.cell_size)) + 1
+        self.ny = int(np.floor((tops.max() - self.y0) / self.cell_size)) + 1
+
+        # 点のセル番号と同じ式で写真の範囲をセル番号に変換するので、
+        # 範囲内（境界を含む）の点のセルには必ずその写真が登録される
+        col_lo, row_lo = self._cell_xy(lefts, bottoms)
+        col_hi, row_hi = self._cell_xy(rights, tops)
+        cells = [[] for _ in range(self.nx * self.ny)]
+        for tile in range(self.num_tiles):
+            for row in range(row_lo[tile], row_hi[tile] + 1):
+                for col in range(col_lo[tile], col_hi[tile] + 1):
+                    cells[row * self.nx + col].append(tile)
+
+        max_tiles = max(1, max(len(c) for c in cells))
+        self.cell_tiles = np.full((len(cells), max_tiles), -1, dtype=np.int32)
+        for cell, tiles in enumerate(cells):
+            self.cell_tiles[cell, :len(tiles)] = tiles
+
+    def _cell_xy(self, xs, ys):
+        cols = np.floor((xs - self.x0) / self.cell_size)
+        rows = np.floor((ys - self.y0) / self.cell_size)
+        return (np.clip(cols, 0, self.nx - 1).astype(np.int64),
+                np.clip(rows, 0, self.ny - 1).astype(np.int64))
+
+    def candidates(self, point_coords_x, point_coords_y):
+        """各点の候補となる写真番号を (点数, 最大候補数) で返す（-1 は候補なし）"""
+        cols, rows = self._cell_xy(point_coords_x, point_coords_y)
+        return self.cell_tiles[rows * self.nx + cols]
+
+
+def colorize_points(point_coords_x, point_coords_y, tif_datasets, tile_index=None):
+    """全点の色を写真からまとめて取得する（NumPyによる一括処理）
+
+    点ごとにループする代わりに、写真1枚ごとに「範囲内の点」をマスクで選び、
+    rowcol をまとめて計算してから image_data をファンシーインデックスで参照する。
+    写真はリスト順に判定し、先に見つかった写真の色を採用する（従来と同じ結果）。
+    調べる写真は TileIndex で各点の候補に絞り込む。
+    """
+    colors, _ = _lookup_colors(point_coords_x, point_coords_y, tif_datasets, tile_index)
+    return colors
+
+
+def _lookup_colors(point_coords_x, point_coords_y, tif_datasets, tile_index=None):
+    """colorize_points と同じ方法で色を取り、各点の色を取った写真の番号（なければ -1）も返す"""
+    if tile_index is None:
+        tile_index = TileIndex(tif_datasets)
+    point_coords_x = np.asarray(point_coords_x)
+    point_coords_y = np.asarray(point_coords_y)
+    num_points = len(point_coords_x)
+
+    # どの写真にも属さない点は灰色
+    colors = np.full((num_points, 3), 128, dtype=np.uint8)
+    # 色を取った写真の番号（-1 はまだ色が決まっていない点）
+    found_tiles = np.full(num_points, -1, dtype=np.int32)
+
+    candidates = tile_index.candidates(point_coords_x, point_coords_y)
+    # 候補は写真のリスト順に並んでいるので、1番目の候補から順に試す
+    for rank in range(candidates.shape[1]):
+        point_indices = np.flatnonzero((found_tiles < 0) & (candidates[:, rank] >= 0))
+        if point_indices.size == 0:
+            continue
+        tiles = candidates[point_indices, rank]
+        order = np.argsort(tiles, kind="stable")
+        unique_tiles, starts = np.unique(tiles[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for tile, start, end in zip(unique_tiles, starts, ends):
+            indices, tile_colors = tile_pixels(tif_datasets[tile], point_indices[order[start:end]],
+                                               point_coords_x, point_coords_y)
+            colors[indices] = tile_colors
+            found_tiles[indices] = tile
+
+    return colors, found_tiles
+
+
+def sample_colors(point_coords_x, point_coords_y, tif_datasets, tile_index=None, sampling=SAMPLING,
+                  footprint=SAMPLE_FOOTPRINT, supersamples=SUPERSAMPLES):
+    """sampling の方法で全点の色を取得する
+
+    nearest は colorize_points と同じ。bilinear / area は1点につき複数の位置
+    （タップ）の色を最寄りのピクセルから取り、重み付きで平均する。
+    タップは地図上の座標で表し、それぞれが含まれる写真から色を取るので、
+    写真の継ぎ目ではとなりの写真のピクセルと混ざる。どの写真にもないタップは除いて平均し、
+    全部ないときは灰色にする。
+    """
+    if sampling == "nearest":
+        return colorize_points(point_coords_x, point_coords_y, tif_datasets, tile_index)
+    if sampling not in ("bilinear", "area"):
+        raise ValueError(f"未対応の色の取り方です: {sampling}")
+    if tile_index is None:
+        tile_index = TileIndex(tif_datasets)
+    point_coords_x = np.asarray(point_coords_x, dtype=np.float64)
+    point_coords_y = np.asarray(point_coords_y, dtype=np.float64)
+
+    colors = np.empty((len(point_coords_x), 3), dtype=np.uint8)
+    for start in range(0, len(point_coords_x), SAMPLE_BATCH):
+        end = min(start + SAMPLE_BATCH, len(point_coords_x))
+        px = point_coords_x[start:end]
+        py = point_coords_y[start:end]
+        if sampling == "bilinear":
+            tap_x, tap_y, weights = _bilinear_taps(px, py, tif_datasets, tile_index)
+        else:
+            tap_x, tap_y, weights = _area_taps(px, py, footprint, supersamples)
+
+        # 全タップの色をまとめて取り、どの写真にもないタップの重みは0にする
+        tap_colors, tap_tiles = _lookup_colors(tap_x.ravel(), tap_y.ravel(), tif_datasets, tile_index)
+        weights = weights * (tap_tiles.reshape(weights.shape) >= 0)
+        total = weights.sum(axis=1)
+        blended = np.einsum("nt,ntc->nc", weights, tap_colors.reshape(*weights.shape, 3).astype(np.float64))
+        has_color = total > 0
+        blended[has_color] /= total[has_color, None]
+        blended[~has_color] = 128
+        colors[start:end] = np.clip(np.rint(blended), 0, 255).astype(np.uint8)
+    return colors
+
+
+def _bilinear_taps(px, py, tif_datasets, tile_index):
+    """点を囲む4つのピクセルの中心をタップにし、双線形補間の重みを付ける
+
+    ピクセルの格子は、nearest でその点の色を取る写真のものを使う。
+    """
+    tap_x = np.repeat(px[:, None], 4, axis=1)
+    tap_y = np.repeat(py[:, None], 4, axis=1)
+    weights = np.zeros((len(px), 4))
+    weights[:, 0] = 1.0  # どの写真にもない点は自分の位置だけ（結果は灰色）
+
+    _, tiles = _lookup_colors(px, py, tif_datasets, tile_index)
+    order = np.argsort(tiles, kind="stable")
+    unique_tiles, starts = np.unique(tiles[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    for tile, start, end in zip(unique_tiles, starts, ends):
+        if tile < 0:
+            continue
+        indices = order[start:end]
+        transform = tif_datasets[tile]["transform"]
+        inverse = ~transform
+        # ピクセルの中心を 0 とした小数のピクセル座標
+        u = inverse.a * px[indices] + inverse.b * py[indices] + inverse.c - 0.5
+        v = inverse.d * px[indices] + inverse.e * py[indices] + inverse.f - 0.5
+        col0 = np.floor(u)
+        row0 = np.floor(v)
+        fu = u - col0
+        fv = v - row0
+        for tap, (dc, dr) in enumerate([(0, 0), (1, 0), (0, 1), (1, 1)]):
+            cols = col0 + dc + 0.5
+            rows = row0 + dr + 0.5
+            tap_x[indices, tap] = transform.a * cols + transform.b * rows + transform.c
+            tap_y[indices, tap] = transform.d * cols + transform.e * rows + transform.f
+            weights[indices, tap] = (fu if dc else 1 - fu) * (fv if dr else 1 - fv)
+    return tap_x, tap_y, weights
+
+
+def _area_taps(px, py, footprint, supersamples):
+    """点を中心とする footprint 四方に supersamples x supersamples 個のタップを均等に置く"""
+    steps = ((np.arange(supersamples) + 0.5) / supersamples - 0.5) * footprint
+    offset_x, offset_y = np.meshgrid(steps, steps)
+    tap_x = px[:, None] + offset_x.ravel()[None, :]
+    tap_y = py[:, None] + offset_y.ravel()[None, :]
+    weights = np.ones(tap_x.shape)
+    return tap_x, tap_y, weights
+
+
+def tile_pixels(tif, indices, point_coords_x, point_coords_y):
+    """indices の点のうち写真 tif の画像内にある点の番号と、その色を返す"""
+    px = point_coords_x[indices]
+    py = point_coords_y[indices]
+    # bounds -> (左, 下, 右, 上)
+    bounds = tif["bounds"]
+    in_tile = (bounds.left <= px) & (px <= bounds.right) & \
+        (bounds.bottom <= py) & (py <= bounds.top)
+    indices = indices[in_tile]
+    if indices.size == 0:
+        return indices, np.zeros((0, 3), dtype=np.uint8)
+
+    # ピクセル座標にまとめて変換
+    rows, cols = rasterio.transform.rowcol(
+        tif["transform"], xs=px[in_tile], ys=py[in_tile]
+    )
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+
+    # 範囲の境界ちょうどの点は画像外になるので、次の写真に回す
+    valid = (0 <= rows) & (rows < tif["height"]) & (0 <= cols) & (cols < tif["width"])
+    return indices[valid], read_pixels(tif, rows[valid], cols[valid]).astype(np.uint8)
+
+
+def read_pixels(tif, rows, cols):
+    """写真のピクセル (rows, cols) の RGB を (点数, 3) の配列で返す"""
+    if "image_data" in tif:
+        return tif["image_data"][:3, rows, cols].T
+    return tif["block_cache"].read_pixels(tif, rows, cols)
+
+
+class RasterBlockCache:
+    """写真をブロック単位で遅延読み込みする LRU キャッシュ
+
+    写真全体をデコードする代わりに、点が含まれるブロックだけを rasterio の
+    window で読み込み、(写真, ブロック) をキーに保持する。
+    合計サイズが memory_budget を超えたら、最近使っていないブロックから捨てる。
+    """
+
+    def __init__(self, memory_budget, block_size=RASTER_BLOCK_SIZE):
+        self.memory_budget = memory_budget
+        self.block_size = block_size
+        self._blocks = OrderedDict()
+        self._nbytes = 0
+
+    def get_block(self, tif, block_row, block_col):
+        key = (tif["path"], block_row, block_col)
+        block = self._blocks.get(key)
+        if block is not None:
+            self._blocks.move_to_end(key)
+            return block
+
+        row_off = block_row * self.block_size
+        col_off = block_col * self.block_size
+        window = Window(
+            col_off, row_off,
+            min(self.block_size, tif["width"] - col_off),
+            min(self.block_size, tif["height"] - row_off),
+        )
+        block = tif["dataset"].read(indexes=[1, 2, 3], window=window)
+        self._blocks[key] = block
+        self._nbytes += block.nbytes
+
+        # 予算を超えたら古いブロックから捨てる（今読んだブロックは残す）
+        while self._nbytes > self.memory_budget and len(self._blocks) > 1:
+            _, old_block = self._blocks.popitem(last=False)
+            self._nbytes -= old_block.nbytes
+        return block
+
+    def read_pixels(self, tif, rows, cols):
+        pixels = np.empty((len(rows), 3), dtype=tif["dataset"].dtypes[0])
+        # 点をブロックごとにまとめ、点が当たったブロックだけを読み込む
+        # （点群の範囲外のブロックはデコードしない）
+        num_block_cols = (tif["width"] + self.block_size - 1) // self.block_size
+        block_ids = (rows // self.block_size).astype(np.int64) * num_block_cols + cols // self.block_size
+        order = np.argsort(block_ids, kind="stable")
+        unique_ids, starts = np.unique(block_ids[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for block_id, start, end in zip(unique_ids, starts, ends):
+            in_block = order[start:end]
+            block_row, block_col = divmod(int(block_id), num_block_cols)
+            block = self.get_block(tif, block_row, block_col)
+            pixels[in_block] = block[
+                :, rows[in_block] - block_row * self.block_size, cols[in_block] - block_col * self.block_size
+            ].T
+        return pixels
+
+# --- 並列色付け用 ---
+# ワーカープロセス側で共有メモリから復元した写真データ
+_worker_tif_datasets = None
+_worker_tile_index = None
+_worker_shms = None
+
+
+def _init_colorize_worker(tif_descriptors, cache_budget):
+    """ワーカープロセスの初期化: 共有メモリ上の画像データに接続する（コピーしない）
+
+    遅延読み込みモードでは、ワーカーごとに写真を開き直して専用のキャッシュを持つ。
+    """
+    global _worker_tif_datasets, _worker_tile_index, _worker_shms
+    _worker_tif_datasets = []
+    _worker_shms = []
+    block_cache = RasterBlockCache(cache_budget) if cache_budget else None
+    for desc in tif_descriptors:
+        tif = dict(desc)
+        if "shm_name" in desc:
+            shm = shared_memory.SharedMemory(name=desc["shm_name"])
+            _worker_shms.append(shm)
+            tif["image_data"] = np.ndarray(desc["shape"], dtype=desc["dtype"], buffer=shm.buf)
+        else:
+            tif["dataset"] = rasterio.open(desc["path"])
+            tif["block_cache"] = block_cache
+        _worker_tif_datasets.append(tif)
+    _worker_tile_index = TileIndex(_worker_tif_datasets)
+
+
+def _colorize_shard(shard):
+    """ワーカーでの色付け。(色, 使用量) を返す（使用量は親で instrument.add_worker_usage に渡す）"""
+    point_coords_x, point_coords_y, sampling, footprint, supersamples = shard
+    return instrument.measure_worker(sample_colors, point_coords_x, point_coords_y, _worker_tif_datasets,
+                                     _worker_tile_index, sampling, footprint, supersamples)
+
+
+class Colorizer:
+    """点の色付けを行う。workers > 1 のときは ProcessPoolExecutor で分割して並列処理する
+
+    画像データは各ワーカーに pickle して送らず、共有メモリに一度だけコピーして
+    ワーカーからはそのバッファを参照する。結果は元の点の順番で返す。
+    写真を遅延読み込みしている場合は、キャッシュの上限をワーカー数で分け合う。
+    色の取り方は sample_colors の sampling / footprint / supersamples で選ぶ。
+    """
+
+    def __init__(self, tif_datasets, workers=1, tile_index=None, sampling=SAMPLING,
+                 footprint=SAMPLE_FOOTPRINT, supersamples=SUPERSAMPLES):
+        self.tif_datasets = tif_datasets
+        self.tile_index = tile_index if tile_index is not None else TileIndex(tif_datasets)
+        self.workers = workers
+        self.sampling = sampling
+        self.footprint = footprint
+        self.supersamples = supersamples
+        self._executor = None
+        self._shms = []
+
+    def __enter__(self):
+        if self.workers > 1:
+            tif_descriptors = []
+            cache_budget = 0
+            for tif in self.tif_datasets:
+                if "image_data" not in tif:
+                    cache_budget = tif["block_cache"].memory_budget // self.workers
+                    tif_descriptors.append({
+                        "path": tif["path"],
+                        "transform": tif["transform"],
+                        "width": tif["width"],
+                        "height": tif["height"],
+                        "bounds": tif["bounds"],
+                    })
+                    continue
+                image_data = tif["image_data"]
+                shm = shared_memory.SharedMemory(create=True, size=max(image_data.nbytes, 1))
+                self._shms.append(shm)
+                np.ndarray(image_data.shape, dtype=image_data.dtype, buffer=shm.buf)[...] = image_data
+                tif_descriptors.append({
+                    "path": tif["path"],
+                    "transform": tif["transform"],
+                    "width": tif["width"],
+                    "height": tif["height"],
+                    "bounds": tif["bounds"],
+                    "shm_name": shm.name,
+                    "shape": image_data.shape,
+                    "dtype": image_data.dtype.str,
+                })
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_colorize_worker,
+                initargs=(tif_descriptors, cache_budget),
+            )
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for shm in self._shms:
+            shm.close()
+            shm.unlink()
+        self._shms = []
+
+    def colorize(self, point_coords_x, point_coords_y):
+        if self._executor is None:
+            return sample_colors(point_coords_x, point_coords_y, self.tif_datasets, self.tile_index,
+                                 self.sampling, self.footprint, self.supersamples)
+
+        point_coords_x = np.asarray(point_coords_x)
+        point_coords_y = np.asarray(point_coords_y)
+        # ワーカー数より多めに分割して、処理の偏りをならす
+        num_shards = min(self.workers * 4, max(len(point_coords_x), 1))
+        shards = [
+            (shard_x, shard_y, self.sampling, self.footprint, self.supersamples)
+            for shard_x, shard_y in zip(np.array_split(point_coords_x, num_shards),
+                                        np.array_split(point_coords_y, num_shards))
+        ]
+        # map は投入した順に結果を返すので、点の順番は保たれる
+        results = list(self._executor.map(_colorize_shard, shards))
+        for _, usage in results:
+            instrument.add_worker_usage(usage)
+        return np.concatenate([colors for colors, _ in results])
+
+
+
+def expand_paths(paths, extensions):
+    """ディレクトリやワイルドカードを含む指定を、ファイルのリストに展開する"""
+    expanded = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = []
+            for extension in extensions:
+                matches += glob.glob(os.path.join(path, f"*{extension}"))
+            expanded.extend(sorted(matches))
+        elif any(c in path for c in "*?["):
+            expanded.extend(sorted(glob.glob(path)))
+        else:
+            expanded.append(path)
+    return expanded
+
+
+def expand_tif_paths(tif_paths):
+    """ディレクトリやワイルドカードを含む指定を、GeoTIFFファイルのリストに展開する"""
+    return expand_paths(tif_paths, [".tif", ".tiff"])
+
+
+def load_tif_datasets(tif_paths):
+    """航空写真(GeoTIFF)をすべて開き、位置合わせに必要な情報をまとめる"""
     tif_datasets = []
-    for tif_path in INPUT_TIF_FILES:
+    for tif_path in expand_tif_paths(tif_paths):
         print(f"航空写真 '{tif_path}' を読み込んでいます...")
         dataset = rasterio.open(tif_path)
         tif_datasets.append({
@@ -36,76 +513,557 @@ try:
             "bounds": dataset.bounds # 写真がカバーする座標範囲
         })
         print(f" -> 読み込み完了 (解像度: {dataset.width}x{dataset.height})")
+    return tif_datasets
 
-    # 2. 点群(LAS)ファイルを読み込む
-    print(f"\n点群 '{INPUT_LAS_FILE}' を読み込んでいます...")
-    with laspy.open(INPUT_LAS_FILE) as las_file:
-        las = las_file.read()
 
-        # 3. 点群を間引く
-        print(f"元の点群数: {len(las.points)}")
-        thinned_points = las.points[::THINNING_RATE]
-        print(f"間引き後の点群数: {len(thinned_points)}")
+def to_positions(points, out=None):
+    """LASの点を viewer 用の (x, z, y) float32 配列に変換する（Y軸が上）
+
+    out を渡すと、新しい配列を作らずに out（出力ファイルの memmap など）へ直接書き込む。
+    """
+    if out is None:
+        out = np.empty((len(points), 3), dtype=np.float32)
+    out[:, 0] = points.x
+    out[:, 1] = points.z
+    out[:, 2] = points.y
+    return out
+
+
+def thin_points(points, thinning_rate, mode="stride", spacing=THINNING_SPACING, target_points=None):
+    """点群を間引く
+
+    stride は THINNING_RATE 点おきに取るだけなので、密な場所は密なまま残る。
+    voxel / poisson は空間的に間引くので、同じ見た目をより少ない点で表せる。
+    """
+    if mode == "stride":
+        return points[::thinning_rate]
 
-        # 4. 座標変換と地面合わせ
-        positions = np.vstack((
-            thinned_points.x, thinned_points.z, thinned_points.y
-        )).transpose().astype(np.float32)
+    xyz = np.vstack((points.x, points.y, points.z)).transpose()
+    if mode == "voxel":
+        if target_points is not None:
+            spacing = voxel_size_for_target(xyz, target_points)
+            if spacing is None:
+                return points
+            print(f"目標 {target_points} 点に合わせたボクセルの大きさ: {spacing:.4f}")
+        indices = voxel_grid_indices(xyz, spacing)
+    elif mode == "poisson":
+        indices = poisson_disk_indices(xyz, spacing)
+    else:
+        raise ValueError(f"未対応の間引き方です: {mode}")
+    return points[indices]
+
+
+def _flush(*views):
+    """create_raw_points で作ったビューの内容をファイルに書き出す"""
+    for view in views:
+        if isinstance(view, np.memmap):
+            view.flush()
+
+
+def convert_in_memory(las_path, colorizer, output_path, thinning_rate,
+                      thinning_mode="stride", spacing=THINNING_SPACING, target_points=None):
+    """LAS全体を一度にメモリへ読み込んで変換する（従来の方式）"""
+    print(f"\n点群 '{las_path}' を読み込んでいます...")
+    with instrument.stage("read") as record:
+        with laspy.open(las_path) as las_file:
+            las = las_file.read()
+        record["points"] = len(las.points)
+
+    # 3. 点群を間引く
+    print(f"元の点群数: {len(las.points)}")
+    with instrument.stage("thin", points=len(las.points)):
+        thinned_points = thin_points(las.points, thinning_rate, thinning_mode, spacing, target_points)
+    num_points = len(thinned_points)
+    print(f"間引き後の点群数: {num_points}")
+
+    # 4. 座標変換と地面合わせ
+    # 出力ファイルを先に確保し、位置と色を memmap のビューへ直接書き込む
+    with instrument.stage("transform", points=num_points):
+        positions, colors = create_raw_points(output_path, num_points)
+        to_positions(thinned_points, out=positions)
         if positions.size > 0:
             min_y = np.min(positions[:, 1])
             positions[:, 1] -= min_y
 
-        # 5. 各点の色を、対応する写真から取得する
+    # 5. 各点の色を、対応する写真から取得する
+    print("\n各点に対応する色を写真から抽出中...")
+    with instrument.stage("colorize", points=num_points):
+        colors[:] = colorizer.colorize(thinned_points.x, thinned_points.y)
+
+    # 6. ファイルに書き出す
+    with instrument.stage("write", points=num_points):
+        _flush(positions, colors)
+
+
+def convert_cached(las_path, tif_datasets, output_path, cache, thinning_rate,
+                   thinning_mode="stride", spacing=THINNING_SPACING, target_points=None, tile_index=None):
+    """途中結果をキャッシュしながら変換する（入力が変わった段階だけ計算し直す）
+
+    - 間引き後の点: LASの内容ハッシュ + 間引きの設定 をキーに保存
+    - 写真ごとの色: TIFの内容ハッシュ + 点のキー をキーに、その写真に入る全点の色を保存
+    写真ごとの色を写真のリスト順に重ねるので、結果は convert_in_memory と同じになる。
+    写真を1枚足しただけなら、その写真の色だけを計算する。
+    """
+    # 3, 4. 間引きと座標変換（キャッシュがあれば LAS を読まない）
+    # キャッシュを探す時間は LAS の読み込み (read) と分けて記録する
+    with instrument.stage("cache_load") as record:
+        las_hash = cache.file_hash(las_path)
+        point_key = cache.key("points", las_hash, thinning_mode, thinning_rate,
+                              None if thinning_mode == "stride" else spacing, target_points)
+        cached_points = cache.load("points", point_key)
+        if cached_points is not None:
+            record["points"] = len(cached_points["positions"])
+    if cached_points is not None:
+        print(f"\n点群 '{las_path}' の間引き結果をキャッシュから読み込みました。")
+        point_coords_x = cached_points["x"]
+        point_coords_y = cached_points["y"]
+        positions = cached_points["positions"]
+    else:
+        print(f"\n点群 '{las_path}' を読み込んでいます...")
+        with instrument.stage("read") as record:
+            with laspy.open(las_path) as las_file:
+                las = las_file.read()
+            record["points"] = len(las.points)
+        print(f"元の点群数: {len(las.points)}")
+        with instrument.stage("thin", points=len(las.points)):
+            thinned_points = thin_points(las.points, thinning_rate, thinning_mode, spacing, target_points)
+        with instrument.stage("transform", points=len(thinned_points)):
+            point_coords_x = np.asarray(thinned_points.x)
+            point_coords_y = np.asarray(thinned_points.y)
+            positions = to_positions(thinned_points)
+            if positions.size > 0:
+                min_y = np.min(positions[:, 1])
+                positions[:, 1] -= min_y
+        del las, thinned_points
+        cache.save("points", point_key, x=point_coords_x, y=point_coords_y, positions=positions)
+    num_points = len(positions)
+    print(f"間引き後の点群数: {num_points}")
+
+    # 5. 写真ごとの色（キャッシュにない写真だけ計算する）
+    print("\n各点に対応する色を写真から抽出中...")
+    with instrument.stage("colorize", points=num_points):
+        if tile_index is None:
+            tile_index = TileIndex(tif_datasets)
+        candidates = tile_index.candidates(point_coords_x, point_coords_y)
+        candidate_points = np.repeat(np.arange(num_points), candidates.shape[1])
+        candidate_tiles = candidates.ravel()
+        order = np.argsort(candidate_tiles, kind="stable")
+        tile_starts = np.searchsorted(candidate_tiles[order], np.arange(len(tif_datasets) + 1))
+
+        colors = np.full((num_points, 3), 128, dtype=np.uint8)
+        assigned = np.zeros(num_points, dtype=bool)
+        num_computed = 0
+        for tile, tif in enumerate(tif_datasets):
+            tile_key = cache.key("colors", cache.file_hash(tif["path"]), point_key)
+            cached_colors = cache.load("colors", tile_key)
+            if cached_colors is not None:
+                indices, tile_colors = cached_colors["indices"], cached_colors["colors"]
+            else:
+                num_computed += 1
+                loaded_here = "image_data" not in tif and "block_cache" not in tif
+                if loaded_here:
+                    tif["image_data"] = tif["dataset"].read()
+                tile_points = candidate_points[order[tile_starts[tile]:tile_starts[tile + 1]]]
+                indices, tile_colors = tile_pixels(tif, tile_points, point_coords_x, point_coords_y)
+                if loaded_here:
+                    del tif["image_data"]
+                cache.save("colors", tile_key, indices=indices, colors=tile_colors)
+
+            # リストの前にある写真を優先する（従来と同じ）
+            new = ~assigned[indices]
+            colors[indices[new]] = tile_colors[new]
+            assigned[indices[new]] = True
+    print(f" -> 写真 {len(tif_datasets)} 枚のうち {num_computed} 枚分を計算しました（残りはキャッシュ）")
+
+    # 6. 最終的なバイナリファイルとして書き出す
+    with instrument.stage("write", points=num_points):
+        output_positions, output_colors = create_raw_points(output_path, num_points)
+        output_positions[:] = positions
+        output_colors[:] = colors
+        _flush(output_positions, output_colors)
+
+
+def convert_streaming(las_path, colorizer, output_path, thinning_rate, chunk_size):
+    """LASをチャンクごとに読み込み、間引き・色付け・書き出しを逐次行う
+
+    出力ファイルは「全点の位置 → 全点の色」の順に並んでいるため、
+    ヘッダーの点数から出力サイズを先に決めて、各チャンクを所定の位置へ直接書き込む。
+    地面合わせ（Yの最小値を引く）は全点を見ないと決まらないので、
+    最後に位置ブロックだけをもう一度チャンクごとに読み直して補正する（2パス）。
+    メモリ使用量はチャンクサイズ分に収まる。
+    """
+    print(f"\n点群 '{las_path}' をストリーミングで読み込んでいます...")
+    with laspy.open(las_path) as las_file:
+        total_points = las_file.header.point_count
+        num_points = (total_points + thinning_rate - 1) // thinning_rate
+        print(f"元の点群数: {total_points}")
+        print(f"間引き後の点群数: {num_points}")
+
+        min_y = None
+        read_points = 0
+        written_points = 0
+
         print("\n各点に対応する色を写真から抽出中...")
-        colors = []
-        point_coords_x = thinned_points.x
-        point_coords_y = thinned_points.y
+        positions, colors = create_raw_points(output_path, num_points)
+
+        chunks = las_file.chunk_iterator(chunk_size)
+        while True:
+            with instrument.stage("read") as record:
+                chunk = next(chunks, None)
+                record["points"] = 0 if chunk is None else len(chunk)
+            if chunk is None:
+                break
+
+            # 3. ファイル全体で見て THINNING_RATE 個おきになるように間引く
+            with instrument.stage("thin", points=len(chunk)):
+                first = (-read_points) % thinning_rate
+                read_points += len(chunk)
+                thinned_points = chunk[first::thinning_rate]
+            count = len(thinned_points)
+            if count == 0:
+                continue
+            if written_points + count > num_points:
+                raise ValueError(
+                    f"LASヘッダーの点数と実際の点数が一致しません ({written_points + count} > {num_points})"
+                )
+
+            # 4. 座標変換（地面合わせは最後にまとめて行う）
+            with instrument.stage("transform", points=count):
+                chunk_positions = to_positions(thinned_points, out=positions[written_points:written_points + count])
+                chunk_min_y = np.min(chunk_positions[:, 1])
+                min_y = chunk_min_y if min_y is None else min(min_y, chunk_min_y)
+
+            # 5. 色付け
+            with instrument.stage("colorize", points=count):
+                colors[written_points:written_points + count] = colorizer.colorize(thinned_points.x, thinned_points.y)
+            written_points += count
+            print(f" -> {read_points} / {total_points} 点を処理しました")
+
+        if written_points != num_points:
+            raise ValueError(
+                f"LASヘッダーの点数と実際の点数が一致しません ({written_points} != {num_points})"
+            )
+
+        # 6. 2パス目: 位置ブロックをチャンクごとに地面合わせする
+        with instrument.stage("write", points=num_points):
+            if min_y is not None:
+                for start in range(0, num_points, chunk_size):
+                    positions[start:start + chunk_size, 1] -= min_y
+            _flush(positions, colors)
 
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="LAS点群に航空写真の色を付けて viewer 用バイナリに変換する")
+    parser.add_argument("--las", nargs="+", default=[INPUT_LAS_FILE],
+                        help="入力LASファイル（複数・ディレクトリ・ワイルドカードならまとめて変換）")
+    parser.add_argument("--tif", nargs="+", default=INPUT_TIF_FILES, help="入力GeoTIFFファイル（ディレクトリやワイルドカードも可）")
+    parser.add_argument("--output", default=OUTPUT_BINARY_FILE, help="出力バイナリファイル")
+    parser.add_argument("--out-dir", default=None,
+                        help="まとめて変換するときの出力先ディレクトリ（LASごとに <名前>.bin を作る）")
+    parser.add_argument("--jobs", type=int, default=BATCH_JOBS,
+                        help="まとめて変換するときに同時に処理するLASファイルの数（プロセス数）")
+    parser.add_argument("--force", action="store_true",
+                        help="まとめて変換するとき、出力が最新でも変換し直す")
+    parser.add_argument("--thinning-rate", type=int, default=THINNING_RATE, help="何点おきに残すか")
+    parser.add_argument("--thinning", choices=["stride", "voxel", "poisson"], default=THINNING_MODE,
+                        help="間引き方（voxel / poisson は空間的に均等に間引く）")
+    parser.add_argument("--spacing", type=float, default=THINNING_SPACING,
+                        help="voxel の格子の大きさ / poisson の点の最小間隔")
+    parser.add_argument("--target-points", type=int, default=TARGET_POINTS,
+                        help="voxel モードで残したい点の数（格子の大きさを自動で決める）")
+    parser.add_argument("--stream", action="store_true",
+                        help="LASをチャンクごとに読み込む（巨大な点群向け）")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="ストリーミング時に一度に読み込む点の数")
+    parser.add_argument("--sampling", choices=["nearest", "bilinear", "area"], default=SAMPLING,
+                        help="色の取り方（bilinear / area は補間・平均するので、間引いてもちらつきにくい）")
+    parser.add_argument("--footprint", type=float, default=SAMPLE_FOOTPRINT,
+                        help="area で平均する範囲の一辺（メートル、点の間隔くらいにする）")
+    parser.add_argument("--supersamples", type=int, default=SUPERSAMPLES,
+                        help="area で1辺あたりに取るタップの数")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="色付けを並列に行うプロセス数")
+    parser.add_argument("--raster-cache-mb", type=int, default=RASTER_CACHE_MB,
+                        help="写真を必要なブロックだけ読み込むときのキャッシュ上限(MB)。0なら全体を読み込む")
+    parser.add_argument("--octree", default=OUTPUT_OCTREE_DIR,
+                        help="LOD用オクツリー（ノードごとのバイナリと index.json）の出力先ディレクトリ")
+    parser.add_argument("--format", choices=["raw", "tgpc"], default=OUTPUT_FORMAT,
+                        help="出力フォーマット（tgpc はヘッダー付き・16bit量子化）")
+    parser.add_argument("--compression", choices=["none", "deflate", "zstd"], default=OUTPUT_COMPRESSION,
+                        help="tgpc フォーマットのブロック圧縮方式")
+    parser.add_argument("--normals", type=int, default=NORMALS_K, metavar="K",
+                        help="K近傍のPCAで法線を計算して書き出す（raw なら *_normals.bin に、tgpc ならファイル内に）")
+    parser.add_argument("--normals-orient", choices=["propagate", "viewpoint"], default=NORMALS_ORIENTATION,
+                        help="法線の向きの揃え方")
+    parser.add_argument("--sort", choices=["none", "grid", "morton"], default=SORT_ORDER,
+                        help="点の並べ方（grid は app.py の /points 用、morton は3次元の Morton 順）。索引 (*_index.json) も書き出す")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help="途中結果のキャッシュ先。入力や設定が変わった段階だけ計算し直す")
+    parser.add_argument("--timings", action="store_true",
+                        help="段階ごとの経過時間・CPU時間・点/秒・ピークRSSを最後に表にして表示する")
+    parser.add_argument("--metrics", default=None,
+                        help="段階ごとの計測結果を JSON Lines で追記するファイル")
+    parser.add_argument("--profile", default=None, metavar="DIR",
+                        help="段階ごとのプロファイルを書き出すディレクトリ")
+    parser.add_argument("--profiler", choices=["cprofile", "pyinstrument"], default="cprofile",
+                        help="--profile で使うプロファイラー")
+    return parser
+
+
+def prepare_rasters(tif_datasets, options):
+    """写真の画像データの持ち方を決める（ブロックキャッシュ / 全体を先に読み込む）"""
+    if options.raster_cache_mb > 0:
+        # 点が当たる部分だけをブロック単位で読み込む
+        block_cache = RasterBlockCache(options.raster_cache_mb * 1024 * 1024)
+        for tif in tif_datasets:
+            tif["block_cache"] = block_cache
+    elif not options.cache_dir:
         # 各TIF画像の画像データを一度だけ読み込む（高速化のため）
+        # （キャッシュを使うときは、計算が必要な写真だけをその時に読み込む）
         for tif in tif_datasets:
             tif["image_data"] = tif["dataset"].read()
 
-        for i in range(len(point_coords_x)):
-            px, py = point_coords_x[i], point_coords_y[i]
-            
-            found_color = False
-            # どの写真の範囲にこの点が含まれるか探す
-            for tif in tif_datasets:
-                # bounds -> (左, 下, 右, 上)
-                if tif["bounds"].left <= px <= tif["bounds"].right and \
-                   tif["bounds"].bottom <= py <= tif["bounds"].top:
-                    
-                    # ピクセル座標に変換
-                    rows, cols = rasterio.transform.rowcol(tif["transform"], xs=[px], ys=[py])
-                    row, col = rows[0], cols[0]
-
-                    if 0 <= row < tif["height"] and 0 <= col < tif["width"]:
-                        r = tif["image_data"][0, row, col]
-                        g = tif["image_data"][1, row, col]
-                        b = tif["image_data"][2, row, col]
-                        colors.append([r, g, b])
-                        found_color = True
-                        break # 対応する写真を見つけたらループを抜ける
-            
-            if not found_color:
-                colors.append([128, 128, 128]) # どの写真にも属さない点は灰色
-
-        colors_np = np.array(colors, dtype=np.uint8)
-
-        # 6. 最終的なバイナリファイルとして書き出す
-        with open(OUTPUT_BINARY_FILE, "wb") as bf:
-            bf.write(positions.tobytes())
-            bf.write(colors_np.tobytes())
-            
+
+def convert_file(las_path, tif_datasets, output_path, options, tile_index=None, octree_dir=None, cache=None):
+    """LASファイル1つを変換して書き出し、出力した点の数を返す
+
+    cache を省略して options.cache_dir があるときは、ここで ConversionCache を作る。
+    """
+    # 2. 点群(LAS)ファイルを読み込んで変換する
+    # tgpc で出力するときも、いったん従来のフォーマットで書き出してから変換する
+    raw_output = output_path if options.format == "raw" else output_path + ".raw.tmp"
+    if options.cache_dir:
+        if options.sampling != "nearest":
+            raise ValueError("キャッシュを使うときは sampling は nearest にしてください")
+        if cache is None:
+            cache = ConversionCache(options.cache_dir)
+        convert_cached(las_path, tif_datasets, raw_output, cache, options.thinning_rate,
+                       options.thinning, options.spacing, options.target_points, tile_index)
+    else:
+        with Colorizer(tif_datasets, options.workers, tile_index,
+                       options.sampling, options.footprint, options.supersamples) as colorizer:
+            if options.stream:
+                convert_streaming(las_path, colorizer, raw_output, options.thinning_rate, options.chunk_size)
+            else:
+                convert_in_memory(las_path, colorizer, raw_output, options.thinning_rate,
+                                  options.thinning, options.spacing, options.target_points)
+
+    if options.sort == "grid":
+        print("\n点を格子セルごとに並べ替えています...")
+        with instrument.stage("sort") as record:
+            index = sort_raw_points_by_grid(raw_output)
+            record["points"] = index["points"]
+        print(f" -> セル数: {len(index['cells'])}, 索引: '{index_path_for(raw_output)}'")
+    elif options.sort == "morton":
+        print("\n点を Morton 符号の順に並べ替えています...")
+        with instrument.stage("sort") as record:
+            index = sort_raw_points_by_morton(raw_output)
+            record["points"] = index["points"]
+        print(f" -> チャンク数: {len(index['chunks'])}, 索引: '{index_path_for(raw_output)}'")
+
+    positions, colors = read_raw_points(raw_output)
+    num_points = len(positions)
+
+    # 3. 必要ならオクツリーも作る
+    if octree_dir:
+        print(f"\nオクツリーを '{octree_dir}' に書き出しています...")
+        with instrument.stage("octree", points=num_points):
+            index = build_octree(positions, colors, octree_dir)
+        print(f" -> ノード数: {len(index['nodes'])}, 深さ: {index['depth']}")
+
+    # 4. 必要なら法線を計算する（viewer の normal-worker.js の代わり）
+    normals = None
+    if options.normals:
+        print(f"\n法線を計算しています (k={options.normals}, 向き: {options.normals_orient})...")
+        with instrument.stage("normals", points=num_points):
+            normals = compute_normals(positions, options.normals, options.normals_orient)
+        if options.format == "raw":
+            normals.astype(np.float32).tofile(normals_path_for(output_path))
+            print(f" -> '{normals_path_for(output_path)}' に保存しました。")
+
+    # 5. ヘッダー付きフォーマットに変換する
+    if options.format == "tgpc":
+        print(f"\nヘッダー付きフォーマット(圧縮: {options.compression})に変換しています...")
+        with instrument.stage("encode", points=num_points):
+            write_points(output_path, positions, colors, compression=options.compression, normals=normals)
+        raw_size = os.path.getsize(raw_output)
+        print(f" -> {raw_size:,} バイト → {os.path.getsize(output_path):,} バイト")
+    # memmap を閉じてから一時ファイルを消す
+    del positions, colors
+    if raw_output != output_path:
+        os.remove(raw_output)
+    return num_points
+
+
+# --- まとめて変換する用 ---
+# 各プロセスで一度だけ開いて、ジョブの間で使い回す写真と格子インデックスとキャッシュ
+_batch_tif_datasets = None
+_batch_tile_index = None
+_batch_cache = None
+
+
+def _init_batch_worker(tif_paths, options):
+    global _batch_tif_datasets, _batch_tile_index, _batch_cache
+    _batch_tif_datasets = load_tif_datasets(tif_paths)
+    prepare_rasters(_batch_tif_datasets, options)
+    _batch_tile_index = TileIndex(_batch_tif_datasets)
+    _batch_cache = ConversionCache(options.cache_dir) if options.cache_dir else None
+
+
+def _init_batch_process(tif_paths, options):
+    # 別プロセスでは JSON Lines への書き出しだけ行う（プロファイルは --jobs 1 のときだけ）
+    if options.metrics:
+        instrument.configure(metrics_path=options.metrics)
+    _init_batch_worker(tif_paths, options)
+
+
+def _run_batch_job(job):
+    las_path, output_path, octree_dir, options = job
+    instrument.set_label(las_path)
+    start = time.perf_counter()
+    try:
+        num_points = convert_file(las_path, _batch_tif_datasets, output_path, options,
+                                  _batch_tile_index, octree_dir, _batch_cache)
+        return las_path, num_points, time.perf_counter() - start, None
+    except Exception as e:
+        return las_path, 0, time.perf_counter() - start, str(e)
+
+
+def is_up_to_date(output_path, input_paths):
+    """出力が存在し、どの入力ファイルよりも新しければ True"""
+    if not os.path.exists(output_path):
+        return False
+    output_mtime = os.path.getmtime(output_path)
+    return all(os.path.getmtime(path) <= output_mtime for path in input_paths)
+
+
+def convert(las_paths, tif_paths, out_dir, options=None, jobs=BATCH_JOBS, force=False):
+    """複数のLASファイルをまとめて変換する
+
+    LASごとに out_dir/<名前>.bin を書き出す。LASファイルをジョブとして
+    jobs 個のプロセスに配り、写真と格子インデックスは各プロセスで一度だけ開いて
+    ジョブの間で使い回す（写真はブロックキャッシュで必要な部分だけ読む）。
+    出力がLASと写真より新しいものは飛ばす。戻り値は結果のリスト
+    [(LASのパス, 点の数, 秒, エラー or None), ...]。
+    """
+    if options is None:
+        options = build_parser().parse_args([])
+    # 1プロセスで全写真をデコードしないよう、まとめて変換するときはブロックキャッシュを使う
+    options = argparse.Namespace(**vars(options))
+    if options.raster_cache_mb <= 0:
+        options.raster_cache_mb = BATCH_RASTER_CACHE_MB
+    options.workers = 1
+
+    las_paths = expand_paths(las_paths, [".las", ".laz"])
+    tif_paths = expand_tif_paths(tif_paths)
+    os.makedirs(out_dir, exist_ok=True)
+
+    jobs_to_run = []
+    for las_path in las_paths:
+        name = os.path.splitext(os.path.basename(las_path))[0]
+        output_path = os.path.join(out_dir, f"{name}.bin")
+        octree_dir = os.path.join(options.octree, name) if options.octree else None
+        if not force and is_up_to_date(output_path, [las_path] + tif_paths):
+            print(f"[スキップ] '{output_path}' は最新です")
+            continue
+        jobs_to_run.append((las_path, output_path, octree_dir, options))
+    print(f"\n{len(las_paths)} 個のLASのうち {len(jobs_to_run)} 個を変換します（{jobs} プロセス）")
+
+    results = []
+    batch_start = time.perf_counter()
+
+    def report(result):
+        las_path, num_points, seconds, error = result
+        results.append(result)
+        done = f"[{len(results)}/{len(jobs_to_run)}]"
+        if error:
+            print(f"{done} エラー: '{las_path}' -> {error}")
+        else:
+            rate = num_points / seconds if seconds > 0 else 0
+            print(f"{done} '{las_path}': {num_points:,} 点, {seconds:.1f} 秒 ({rate:,.0f} 点/秒)")
+
+    if jobs <= 1:
+        _init_batch_worker(tif_paths, options)
+        for job in jobs_to_run:
+            report(_run_batch_job(job))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_process,
+                                 initargs=(tif_paths, options)) as executor:
+            for result in executor.map(_run_batch_job, jobs_to_run):
+                report(result)
+
+    total_points = sum(r[1] for r in results)
+    total_seconds = time.perf_counter() - batch_start
+    num_errors = sum(1 for r in results if r[3])
+    print(f"\n合計: {len(results) - num_errors} 個成功, {num_errors} 個失敗, {total_points:,} 点, "
+          f"{total_seconds:.1f} 秒 ({total_points / max(total_seconds, 1e-9):,.0f} 点/秒)")
+    return results
+
+
+def report_instrumentation(args):
+    """計測結果の表示とプロファイルの書き出し"""
+    instrument.finish()
+    if args.timings:
+        instrument.print_summary()
+    if args.metrics:
+        print(f"段階ごとの計測結果を '{args.metrics}' に追記しました。")
+    if args.profile:
+        print(f"段階ごとのプロファイルを '{args.profile}' に書き出しました。")
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.stream and args.thinning != "stride":
+        parser.error("--stream では --thinning stride のみ使えます（空間的な間引きには全点が必要です）")
+    if args.target_points is not None and args.thinning != "voxel":
+        parser.error("--target-points は --thinning voxel と一緒に指定してください")
+    if args.cache_dir and args.stream:
+        parser.error("--cache-dir と --stream は同時に使えません")
+    if args.sort != "none" and args.format != "raw":
+        parser.error("--sort は --format raw のときだけ使えます")
+    if args.cache_dir and args.sampling != "nearest":
+        parser.error("--cache-dir は --sampling nearest のときだけ使えます")
+    if args.normals is not None and args.normals < 3:
+        parser.error("--normals の K は3以上にしてください（面を決めるには自分を含めて3点以上必要です）")
+    if args.timings or args.metrics or args.profile:
+        try:
+            instrument.configure(args.metrics, args.profile, args.profiler)
+        except RuntimeError as e:
+            parser.error(str(e))
+
+    print("--- 点群テクスチャリング処理開始 ---")
+
+    las_paths = expand_paths(args.las, [".las", ".laz"])
+    if args.out_dir or len(las_paths) > 1:
+        convert(las_paths, args.tif, args.out_dir or ".", args, jobs=args.jobs, force=args.force)
+        report_instrumentation(args)
+        return
+
+    tif_datasets = []
+    try:
+        # 1. 航空写真(GeoTIFF)をすべて読み込む
+        with instrument.stage("load_rasters"):
+            tif_datasets = load_tif_datasets(args.tif)
+            prepare_rasters(tif_datasets, args)
+
+        # 2〜5. 変換して書き出す
+        convert_file(las_paths[0], tif_datasets, args.output, args, octree_dir=args.octree)
+
         print(f"\n--- 処理完了！ ---")
-        print(f"テクスチャ付き点群データを '{OUTPUT_BINARY_FILE}' に保存しました。")
+        print(f"テクスチャ付き点群データを '{args.output}' に保存しました。")
+
+    except FileNotFoundError as e:
+        print(f"\nエラー: ファイルが見つかりません。-> {e.filename}")
+        print("LASファイル名や、TIFファイル名・パスが正しいか確認してください。")
+    except Exception as e:
+        print(f"\nエラーが発生しました: {e}")
+    finally:
+        # 開いたデータセットをすべて閉じる
+        for tif in tif_datasets:
+            tif["dataset"].close()
+        report_instrumentation(args)
 
-    # 開いたデータセットをすべて閉じる
-    for tif in tif_datasets:
-        tif["dataset"].close()
 
-except FileNotFoundError as e:
-    print(f"\nエラー: ファイルが見つかりません。-> {e.filename}")
-    print("LASファイル名や、TIFファイル名・パスが正しいか確認してください。")
-except Exception as e:
-    print(f"\nエラーが発生しました: {e}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# 段階ごとの計測結果を記録する。configure() を呼ぶまでは何もしない。
+# 段階ごとに 経過時間 / CPU時間 / 点/秒 / ピークRSS を測り、
+# JSON Lines で書き出したり、最後に表にまとめて表示したりする。
+# CPU時間が経過時間よりずっと短い段階は、CPUではなく読み書きを待っている。
+#
+# 色付けのワーカープロセス（動いたままのプロセス）の分は、ワーカーが measure_worker() で測って
+# 結果と一緒に返し、add_worker_usage() でその時の段階に足す。
+# - cpu_seconds: このプロセスとワーカーのCPU時間の合計
+# - peak_rss_mb: このプロセスだけのピークRSS
+# - worker_peak_rss_mb: ワーカーごとのピークRSSの合計（同時にピークになったとは限らないので上限の目安）
+# - traced_peak_mb: tracemalloc を動かしているときだけ、Python が確保したメモリのピーク
+#   （GDAL などのネイティブの確保は入らない。tracemalloc は遅いので既定では使わない）
+
+_enabled = False
+_metrics_path = None
+_profile_dir = None
+_profiler_name = "cprofile"
+_label = None
+_records = []
+_profiles = {}
+_profile_counts = {}
+# 計測中の段階ごとのワーカーの使用量（入れ子になったときは一番内側に足す）
+_active = []
+
+
+def configure(metrics_path=None, profile_dir=None, profiler="cprofile", enabled=True):
+    """計測を有効にする
+
+    metrics_path: 段階ごとの結果を JSON Lines で追記するファイル
+    profile_dir: 段階ごとのプロファイルの出力先（cprofile なら <段階>.prof、
+                 pyinstrument なら <段階>_<回数>.html）
+    """
+    global _enabled, _metrics_path, _profile_dir, _profiler_name
+    if profiler == "pyinstrument" and pyinstrument is None:
+        raise RuntimeError("pyinstrument でのプロファイルには pyinstrument が必要です (pip install pyinstrument)")
+    _enabled = enabled
+    _metrics_path = metrics_path
+    _profile_dir = profile_dir
+    _profiler_name = profiler
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+
+
+def set_label(label):
+    """以降の記録に付ける名前（まとめて変換するときのLASファイル名など）"""
+    global _label
+    _label = label
+
+
+def reset():
+    """これまでの記録を捨てる（ベンチマークでケースごとに測り直すとき）"""
+    _records.clear()
+
+
+def _read_peak_rss():
+    """プロセスのピークRSS(バイト)。測れなければ None"""
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/self/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux は KB 単位、macOS はバイト単位
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+
+def _reset_peak_rss():
+    """段階ごとのピークを測るため、Linux ではピークRSSをリセットする（できなければプロセス全体のピークになる）"""
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+
+
+def measure_worker(func, *args):
+    """ワーカープロセスで func(*args) を実行し、(結果, 使用量) を返す
+
+    使用量はこの呼び出しのCPU時間とピークRSSで、親プロセスで add_worker_usage() に渡す。
+    終了していない子プロセスは RUSAGE_CHILDREN に入らないので、ワーカー自身が測る。
+    """
+    _reset_peak_rss()
+    start_cpu = time.process_time()
+    result = func(*args)
+    usage = {"pid": os.getpid(), "cpu_seconds": time.process_time() - start_cpu, "peak_rss": _read_peak_rss()}
+    return result, usage
+
+
+def add_worker_usage(usage):
+    """measure_worker() が返した使用量を、計測中の段階に足す"""
+    if not _enabled or not _active:
+        return
+    current = _active[-1]
+    current["cpu_seconds"] += usage["cpu_seconds"]
+    if usage["peak_rss"] is not None:
+        peaks = current["peak_rss"]
+        peaks[usage["pid"]] = max(peaks.get(usage["pid"], 0), usage["peak_rss"])
+
+
+@contextlib.contextmanager
+def stage(name, points=None):
+    """段階 name の計測を行う
+
+    with stage("colorize", points=n): ... のように使う。点の数が後で分かるときは
+    with stage("read") as record: ...; record["points"] = n のように設定する。
+    """
+    record = {"stage": name, "points": points}
+    if not _enabled:
+        yield record
+        return
+
+    profiler = None
+    if _profile_dir:
+        if _profiler_name == "pyinstrument":
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+        else:
+            profiler = _profiles.setdefault(name, cProfile.Profile())
+            profiler.enable()
+
+    workers = {"cpu_seconds": 0.0, "peak_rss": {}}
+    _active.append(workers)
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    _reset_peak_rss()
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        wall = time.perf_counter() - start_wall
+        cpu = time.process_time() - start_cpu + workers["cpu_seconds"]
+        peak_rss = _read_peak_rss()
+        worker_peak_rss = sum(workers["peak_rss"].values()) if workers["peak_rss"] else None
+        _active.pop()
+
+        if profiler is not None:
+            if _profiler_name == "pyinstrument":
+                profiler.stop()
+                count = _profile_counts.get(name, 0)
+                _profile_counts[name] = count + 1
+                with open(os.path.join(_profile_dir, f"{name}_{count}.html"), "w", encoding="utf-8") as f:
+                    f.write(profiler.output_html())
+            else:
+                profiler.disable()
+
+        points = record["points"]
+        record.update({
+            "label": _label,
+            "wall_seconds": round(wall, 6),
+            "cpu_seconds": round(cpu, 6),
+            "points_per_second": round(points / wall, 1) if points and wall > 0 else None,
+            "peak_rss_mb": round(peak_rss / (1024 * 1024), 1) if peak_rss is not None else None,
+            "worker_peak_rss_mb": round(worker_peak_rss / (1024 * 1024), 1) if worker_peak_rss is not None else None,
+        })
+        if tracing:
+            record["traced_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        _records.append(record)
+        if _metrics_path:
+            with open(_metrics_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def finish():
+    """cProfile の結果を段階ごとに <段階>.prof に書き出す（pstats や snakeviz で開ける）"""
+    if _profile_dir and _profiler_name == "cprofile":
+        for name, profiler in _profiles.items():
+            profiler.dump_stats(os.path.join(_profile_dir, f"{name}.prof"))
+    _profiles.clear()
+
+
+def summary():
+    """段階ごとに合計した結果を、最初に現れた順のリストで返す"""
+    totals = {}
+    for record in _records:
+        total = totals.setdefault(record["stage"], {
+            "stage": record["stage"], "calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+            "points": 0, "peak_rss_mb": None, "worker_peak_rss_mb": None,
+        })
+        total["calls"] += 1
+        total["wall_seconds"] += record["wall_seconds"]
+        total["cpu_seconds"] += record["cpu_seconds"]
+        total["points"] += record["points"] or 0
+        if record["peak_rss_mb"] is not None:
+            total["peak_rss_mb"] = max(total["peak_rss_mb"] or 0, record["peak_rss_mb"])
+        if record.get("worker_peak_rss_mb") is not None:
+            total["worker_peak_rss_mb"] = max(total["worker_peak_rss_mb"] or 0, record["worker_peak_rss_mb"])
+        if "traced_peak_mb" in record:
+            total["traced_peak_mb"] = max(total.get("traced_peak_mb", 0), record["traced_peak_mb"])
+    return list(totals.values())
+
+
+def print_summary():
+    """段階ごとの計測結果を表にして表示する"""
+    rows = summary()
+    if not rows:
+        return
+    print(f"\n{'段階':<12}{'回数':>6}{'経過(秒)':>12}{'CPU(秒)':>12}{'CPU/経過':>10}{'点/秒':>16}{'ピークRSS(MB)':>16}{'ワーカーRSS(MB)':>18}")
+    for row in rows:
+        wall = row["wall_seconds"]
+        cpu_ratio = f"{row['cpu_seconds'] / wall:.2f}" if wall > 0 else "-"
+        rate = f"{row['points'] / wall:,.0f}" if row["points"] and wall > 0 else "-"
+        peak = f"{row['peak_rss_mb']:,.1f}" if row["peak_rss_mb"] is not None else "-"
+        worker_peak = f"{row['worker_peak_rss_mb']:,.1f}" if row["worker_peak_rss_mb"] is not None else "-"
+        print(f"{row['stage']:<12}{row['calls']:>6}{wall:>12.3f}{row['cpu_seconds']:>12.3f}"
+              f"{cpu_ratio:>10}{rate:>16}{peak:>16}{worker_peak:>18}")
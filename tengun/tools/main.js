@@ -6,6 +6,13 @@ let scene, camera, renderer, controls;
 let fullPointCloud = null;
 let lastCalculatedNormals = null;
 
+// --- オクツリー(LOD)読み込み用 ---
+// index.html?octree=./octree/index.json のように指定すると、converter.py --octree で作った
+// ノードのうち、見えている範囲を必要な細かさの分だけ段階的に読み込む
+let octree = null;
+const OCTREE_MIN_NODE_PIXELS = 150;  // ノードが画面上でこれより大きく見えたら子ノードを読み込む
+const OCTREE_MAX_CONCURRENT_LOADS = 4;
+
 // --- UI要素 ---
 const statusDiv = document.getElementById('status');
 const calculateNormalsButton = document.getElementById('calculateNormalsButton');
@@ -102,24 +109,116 @@ normalWorker.onmessage = function (event) {
 
 // --- メインロジック ---
 
+// 「全点の位置(float32) → 全点の色(uint8)」の並びのバイナリからジオメトリを作る
+function createPointGeometry(arrayBuffer) {
+    const numPoints = arrayBuffer.byteLength / 15;
+    const positions = new Float32Array(arrayBuffer, 0, numPoints * 3);
+    const colors = new Uint8Array(arrayBuffer, numPoints * 12, numPoints * 3);
+    return createGeometryFromArrays(positions, colors);
+}
+
+function createGeometryFromArrays(positions, colors) {
+    const geometry = new THREE.BufferGeometry();
+    geometry.setAttribute('position', new THREE.BufferAttribute(positions, 3));
+    geometry.setAttribute('color', new THREE.BufferAttribute(colors, 3, true));
+    return geometry;
+}
+
+// converter.py --format tgpc で書き出したヘッダー付きファイルかどうか
+function isTgpc(arrayBuffer) {
+    const magic = new Uint8Array(arrayBuffer, 0, Math.min(4, arrayBuffer.byteLength));
+    return String.fromCharCode(...magic) === 'TGPC';
+}
+
+async function inflateBlock(bytes, compression) {
+    if (compression === 'none') return bytes;
+    if (compression !== 'deflate') throw new Error(`ブラウザでは未対応の圧縮形式です: ${compression}`);
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('deflate'));
+    return new Uint8Array(await new Response(stream).arrayBuffer());
+}
+
+// tgpc フォーマット（pointfile.py の read_points と同じ手順）を位置・色の配列に戻す
+async function decodeTgpc(arrayBuffer) {
+    const view = new DataView(arrayBuffer);
+    const version = view.getUint16(4, true);
+    if (version > 1) throw new Error(`未対応のバージョンです: ${version}`);
+    const headerLength = view.getUint32(6, true);
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(arrayBuffer, 10, headerLength)));
+
+    const numPoints = header.count;
+    const positions = new Float32Array(numPoints * 3);
+    const colors = new Uint8Array(numPoints * 3);
+    const hasNormals = header.attributes.some(attr => attr.name === 'normal');
+    const normals = hasNormals ? new Float32Array(numPoints * 3) : null;
+    const filtered = header.filters && header.filters.length > 0;
+    let offset = 10 + headerLength;
+    let start = 0;
+
+    for (const block of header.blocks) {
+        const count = block.points;
+        const raw = await inflateBlock(new Uint8Array(arrayBuffer, offset, block.bytes), header.compression);
+        offset += block.bytes;
+        const q = [0, 0, 0];
+        for (let i = 0; i < count; i++) {
+            for (let axis = 0; axis < 3; axis++) {
+                let value;
+                if (filtered) {
+                    // バイト面に分けた前の点との差分を足し戻す
+                    const delta = raw[axis * count + i] | (raw[(3 + axis) * count + i] << 8);
+                    value = q[axis] = (q[axis] + delta) & 0xffff;
+                    colors[(start + i) * 3 + axis] = raw[count * 6 + axis * count + i];
+                    // 法線は int8 (×127)
+                    if (hasNormals) normals[(start + i) * 3 + axis] = ((raw[count * 9 + axis * count + i] << 24) >> 24) / 127;
+                } else {
+                    const j = (i * 3 + axis) * 2;
+                    value = raw[j] | (raw[j + 1] << 8);
+                    colors[(start + i) * 3 + axis] = raw[count * 6 + i * 3 + axis];
+                    if (hasNormals) normals[(start + i) * 3 + axis] = ((raw[count * 9 + i * 3 + axis] << 24) >> 24) / 127;
+                }
+                positions[(start + i) * 3 + axis] = value * header.scale[axis] + header.offset[axis];
+            }
+        }
+        start += count;
+    }
+    return { positions, colors, normals };
+}
+
+// converter.py --normals で計算済みの法線があれば、ステップ1を飛ばしてポアソン法に使う
+function usePrecomputedNormals(positions, normals) {
+    lastCalculatedNormals = { positions, normals };
+    statusDiv.textContent = "準備完了。（法線は計算済みなので、ステップ2から実行できます）";
+}
+
+function createPointMaterial() {
+    //return new THREE.PointsMaterial({ size: 0.5, vertexColors: true });
+    return new THREE.PointsMaterial({
+        size: 3,          // この基本サイズを調整
+        vertexColors: true,
+        sizeAttenuation: true // ★★★ これが「遠近法を有効にする」スイッチです ★★★
+    });
+}
+
 async function loadInitialPointCloud(filePath) {
     statusDiv.textContent = "点群データを読み込み中...";
     try {
         const response = await fetch(filePath);
         if (!response.ok) throw new Error(`ファイル読込失敗`);
         const arrayBuffer = await response.arrayBuffer();
-        const numPoints = arrayBuffer.byteLength / 15;
-        const positions = new Float32Array(arrayBuffer, 0, numPoints * 3);
-        const colors = new Uint8Array(arrayBuffer, numPoints * 12, numPoints * 3);
-        const geometry = new THREE.BufferGeometry();
-        geometry.setAttribute('position', new THREE.BufferAttribute(positions, 3));
-        geometry.setAttribute('color', new THREE.BufferAttribute(colors, 3, true));
-        //const material = new THREE.PointsMaterial({ size: 0.5, vertexColors: true });
-        const material = new THREE.PointsMaterial({
-            size: 3,          // この基本サイズを調整
-            vertexColors: true,
-            sizeAttenuation: true // ★★★ これが「遠近法を有効にする」スイッチです ★★★
-        });
+        let geometry;
+        let normals = null;
+        if (isTgpc(arrayBuffer)) {
+            const decoded = await decodeTgpc(arrayBuffer);
+            geometry = createGeometryFromArrays(decoded.positions, decoded.colors);
+            normals = decoded.normals;
+        } else {
+            geometry = createPointGeometry(arrayBuffer);
+            // ヘッダーのないフォーマットでは法線は *_normals.bin に別に保存されている
+            if (filePath.endsWith('.bin')) {
+                const normalsResponse = await fetch(filePath.replace(/\.bin$/, '_normals.bin'));
+                if (normalsResponse.ok) normals = new Float32Array(await normalsResponse.arrayBuffer());
+            }
+        }
+        const material = createPointMaterial();
         fullPointCloud = new THREE.Points(geometry, material);
         geometry.computeBoundingBox();
         const center = geometry.boundingBox.getCenter(new THREE.Vector3());
@@ -127,11 +226,111 @@ async function loadInitialPointCloud(filePath) {
         fullPointCloud.position.z = -center.z;
         scene.add(fullPointCloud);
         statusDiv.textContent = "準備完了。";
+        if (normals && normals.length === geometry.attributes.position.array.length) {
+            usePrecomputedNormals(geometry.attributes.position.array, normals);
+        }
     } catch (error) {
         statusDiv.textContent = `エラー: ${error.message}`;
     }
 }
 
+async function loadOctree(indexPath) {
+    statusDiv.textContent = "オクツリーの目次を読み込み中...";
+    try {
+        const response = await fetch(indexPath);
+        if (!response.ok) throw new Error(`ファイル読込失敗`);
+        const index = await response.json();
+
+        const nodes = new Map();
+        for (const node of index.nodes) {
+            node.box = new THREE.Box3(
+                new THREE.Vector3(node.bounds[0], node.bounds[1], node.bounds[2]),
+                new THREE.Vector3(node.bounds[3], node.bounds[4], node.bounds[5])
+            );
+            node.state = 'unloaded';
+            node.points = null;
+            nodes.set(node.name, node);
+        }
+
+        const group = new THREE.Group();
+        group.name = "octree";
+        // 1枚のバイナリのときと同じく、XZ平面の中心を原点に合わせる
+        const root = nodes.get('r');
+        const center = root.box.getCenter(new THREE.Vector3());
+        group.position.x = -center.x;
+        group.position.z = -center.z;
+        scene.add(group);
+
+        octree = {
+            baseUrl: new URL('.', new URL(indexPath, window.location.href)),
+            nodes,
+            group,
+            material: createPointMaterial(),
+            loading: 0,
+            loadedPoints: 0,
+            totalPoints: index.points,
+        };
+        await loadOctreeNode(root);
+    } catch (error) {
+        statusDiv.textContent = `エラー: ${error.message}`;
+    }
+}
+
+async function loadOctreeNode(node) {
+    node.state = 'loading';
+    octree.loading++;
+    try {
+        const response = await fetch(new URL(node.file, octree.baseUrl));
+        if (!response.ok) throw new Error(`ノード ${node.name} の読込失敗`);
+        const geometry = createPointGeometry(await response.arrayBuffer());
+        node.points = new THREE.Points(geometry, octree.material);
+        node.points.name = node.name;
+        octree.group.add(node.points);
+        node.state = 'loaded';
+        octree.loadedPoints += node.count;
+        statusDiv.textContent = `点群を表示中: ${octree.loadedPoints.toLocaleString()} / ${octree.totalPoints.toLocaleString()} 点`;
+    } catch (error) {
+        node.state = 'error';
+        statusDiv.textContent = `エラー: ${error.message}`;
+    } finally {
+        octree.loading--;
+    }
+}
+
+// 毎フレーム呼ばれ、視野外のノードを隠し、大きく見えているノードの子を読み込む
+function updateOctree() {
+    const frustum = new THREE.Frustum().setFromProjectionMatrix(
+        new THREE.Matrix4().multiplyMatrices(camera.projectionMatrix, camera.matrixWorldInverse)
+    );
+    const pixelsPerUnit = (window.innerHeight / 2) / Math.tan(THREE.MathUtils.degToRad(camera.fov / 2));
+    const candidates = [];
+
+    for (const node of octree.nodes.values()) {
+        if (node.state !== 'loaded') continue;
+        const worldBox = node.box.clone().translate(octree.group.position);
+        node.points.visible = frustum.intersectsBox(worldBox);
+        if (!node.points.visible) continue;
+
+        for (const childName of node.children) {
+            const child = octree.nodes.get(childName);
+            if (child.state !== 'unloaded') continue;
+            const childBox = child.box.clone().translate(octree.group.position);
+            if (!frustum.intersectsBox(childBox)) continue;
+            const sphere = childBox.getBoundingSphere(new THREE.Sphere());
+            const distance = Math.max(camera.position.distanceTo(sphere.center) - sphere.radius, 1e-3);
+            const pixels = sphere.radius / distance * pixelsPerUnit;
+            if (pixels > OCTREE_MIN_NODE_PIXELS) candidates.push({ child, pixels });
+        }
+    }
+
+    // 画面上で大きく見えるノードから優先して読み込む
+    candidates.sort((a, b) => b.pixels - a.pixels);
+    for (const { child } of candidates) {
+        if (octree.loading >= OCTREE_MAX_CONCURRENT_LOADS) break;
+        loadOctreeNode(child);
+    }
+}
+
 function displayPoissonMesh({ vertices, faces }) {
     const existingMesh = scene.getObjectByName("poisson_mesh");
     if (existingMesh) scene.remove(existingMesh);
@@ -236,7 +435,21 @@ function init() {
     document.body.appendChild(renderer.domElement);
     controls = new OrbitControls(camera, renderer.domElement);
 
-    loadInitialPointCloud('./points_textured.bin');
+    const params = new URLSearchParams(window.location.search);
+    const octreeIndexPath = params.get('octree');
+    if (octreeIndexPath) {
+        loadOctree(octreeIndexPath);
+    } else if (params.has('bbox') || params.has('lod')) {
+        // index.html?bbox=xmin,zmin,xmax,zmax&lod=1 のように指定すると、
+        // app.py の /points から範囲内の点だけを必要な細かさで読み込む
+        const query = new URLSearchParams();
+        for (const key of ['bbox', 'lod', 'file']) {
+            if (params.has(key)) query.set(key, params.get(key));
+        }
+        loadInitialPointCloud(`/points?${query}`);
+    } else {
+        loadInitialPointCloud('./points_textured.bin');
+    }
 
     calculateNormalsButton.addEventListener('click', handleCalculateNormals);
     poissonReconButton.addEventListener('click', handlePoissonReconstruct);
@@ -262,6 +475,7 @@ function onWindowResize() {
 function animate() {
     requestAnimationFrame(animate);
     controls.update();
+    if (octree) updateOctree();
     renderer.render(scene, camera);
 }
 
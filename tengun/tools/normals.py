@@ -0,0 +1,125 @@
+import numpy as np
+
+try:
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import breadth_first_order, minimum_spanning_tree
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# --- 設定 ---
+# 一度に PCA する点の数（近傍点の配列が 点数 × k × 3 になるので分けて計算する）
+PCA_BATCH = 200_000
+# --- ここまで ---
+
+
+def _require_scipy():
+    if cKDTree is None:
+        raise RuntimeError("法線の計算には scipy が必要です (pip install scipy)")
+
+
+def estimate_normals(positions, k=20):
+    """k近傍の PCA で各点の法線の「軸」を求める（向きはまだバラバラ）
+
+    normal-worker.js のステップAと同じ処理を、cKDTree と一括の固有値分解で行う。
+    戻り値は (法線, 近傍点の番号) 。近傍点は向きを揃えるときにも使う。
+    """
+    if k < 3:
+        raise ValueError(f"法線の計算には k を3以上にしてください: {k}")
+    _require_scipy()
+    xyz = np.asarray(positions, dtype=np.float64)
+    num_points = len(xyz)
+    k = min(k, num_points)
+    tree = cKDTree(xyz)
+    _, neighbors = tree.query(xyz, k=k, workers=-1)
+    neighbors = neighbors.reshape(num_points, k)
+
+    normals = np.empty((num_points, 3), dtype=np.float32)
+    for start in range(0, num_points, PCA_BATCH):
+        end = min(start + PCA_BATCH, num_points)
+        local = xyz[neighbors[start:end]]
+        local -= local.mean(axis=1, keepdims=True)
+        covariance = np.einsum("nki,nkj->nij", local, local)
+        # eigh は固有値の小さい順に並べるので、最初の固有ベクトルが法線になる
+        _, eigenvectors = np.linalg.eigh(covariance)
+        normals[start:end] = eigenvectors[:, :, 0]
+    return normals, neighbors
+
+
+def orient_toward(positions, normals, viewpoint):
+    """各点の法線を viewpoint の方へ向ける"""
+    view = np.asarray(viewpoint, dtype=np.float64) - positions
+    flip = np.einsum("ij,ij->i", normals, view) < 0
+    normals[flip] *= -1
+    return normals
+
+
+def orient_by_propagation(positions, normals, neighbors, viewpoint):
+    """近傍グラフの最小全域木に沿って法線の向きを伝播させて揃える
+
+    normal-worker.js のステップB（隣の法線と逆向きならひっくり返す）と同じ考え方で、
+    辺の重みを 1 - |n_i・n_j| にした最小全域木（Hoppe らの方法）をたどるので、
+    向きの判断が難しい辺は後回しになる。木ごとの親からの反転の累積は
+    ポインタジャンプでまとめて計算する。最後に、連結成分ごとに
+    全体として viewpoint の方を向くように反転する（ステップCに相当）。
+    """
+    _require_scipy()
+    num_points, k = neighbors.shape
+    rows = np.repeat(np.arange(num_points), k)
+    cols = neighbors.ravel()
+    keep = rows != cols
+    rows, cols = rows[keep], cols[keep]
+    weights = 1.0 - np.abs(np.einsum("ij,ij->i", normals[rows], normals[cols])) + 1e-6
+
+    # 連結成分ごとに根を持たせるため、全点につながる仮想の根 (番号 num_points) を足す
+    virtual = num_points
+    rows = np.concatenate([rows, np.full(num_points, virtual)])
+    cols = np.concatenate([cols, np.arange(num_points)])
+    weights = np.concatenate([weights, np.full(num_points, 10.0)])
+    graph = coo_matrix((weights, (rows, cols)), shape=(num_points + 1, num_points + 1)).tocsr()
+    tree = minimum_spanning_tree(graph)
+    tree = tree + tree.T
+    _, predecessors = breadth_first_order(tree, virtual, directed=False, return_predecessors=True)
+
+    parent = predecessors[:num_points].astype(np.int64)
+    is_root = parent == virtual
+    parent[is_root] = np.flatnonzero(is_root)
+    # 親の法線と逆向きなら -1（根は +1）
+    sign = np.where(np.einsum("ij,ij->i", normals, normals[parent]) < 0, -1, 1).astype(np.int8)
+    sign[is_root] = 1
+
+    # ポインタジャンプ: 根までの反転の累積をまとめて求める
+    ancestor = parent
+    while not np.all(is_root[ancestor]):
+        sign = sign * sign[ancestor]
+        ancestor = ancestor[ancestor]
+    normals *= sign[:, None]
+
+    # 各点の根を求め、成分ごとに viewpoint の方を向いているかを多数決で決める
+    roots = ancestor
+    view = np.asarray(viewpoint, dtype=np.float64) - positions
+    facing = np.einsum("ij,ij->i", normals, view)
+    votes = np.bincount(roots, weights=np.sign(facing), minlength=num_points)
+    normals[votes[roots] < 0] *= -1
+    return normals
+
+
+def compute_normals(positions, k=20, orientation="propagate", viewpoint=None):
+    """法線を計算し、向きを揃えて (点数, 3) の float32 で返す
+
+    viewpoint を省略すると点群の真上（Y軸が上）の遠くの点を使う。
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    if len(positions) == 0:
+        return np.zeros((0, 3), dtype=np.float32)
+    if viewpoint is None:
+        center = (positions.min(axis=0) + positions.max(axis=0)) / 2
+        extent = float(np.max(positions.max(axis=0) - positions.min(axis=0)))
+        viewpoint = center + np.array([0.0, max(extent, 1.0) * 10, 0.0])
+
+    normals, neighbors = estimate_normals(positions, k)
+    if orientation == "viewpoint":
+        return orient_toward(positions, normals, viewpoint)
+    if orientation == "propagate":
+        return orient_by_propagation(positions, normals, neighbors, viewpoint)
+    raise ValueError(f"未対応の向きの揃え方です: {orientation}")
@@ -0,0 +1,124 @@
+import json
+import os
+
+import numpy as np
+
+# --- 設定 ---
+# 1ノードを何分割した格子で間引くか（格子の1セルにつき1点だけそのノードに残す）
+NODE_GRID = 128
+# これ以下の点数になったノードはそれ以上分割せず、全点を持たせる
+MAX_LEAF_POINTS = 20_000
+# 分割の最大深さ
+MAX_DEPTH = 12
+# --- ここまで ---
+
+
+def node_name(level, nx, ny, nz):
+    """ノード座標から Potree 形式の名前 ("r", "r0", "r07", ...) を作る"""
+    name = "r"
+    for i in range(level - 1, -1, -1):
+        child = (((nx >> i) & 1) << 2) | (((ny >> i) & 1) << 1) | ((nz >> i) & 1)
+        name += str(child)
+    return name
+
+
+def build_octree(positions, colors, output_dir, grid=NODE_GRID,
+                 max_leaf_points=MAX_LEAF_POINTS, max_depth=MAX_DEPTH, seed=0):
+    """点群を LOD 用のオクツリーに分割し、ノードごとのバイナリと index.json を書き出す
+
+    各ノードは自分の範囲を grid^3 の格子で区切り、1セルにつき1点だけを持つ
+    （ランダムな順で最初に来た点）。残った点は子ノードへ回すので、
+    浅いノードほど粗く、深いノードほど細かい、一様に間引かれた点群になる。
+    ノードのバイナリは points_textured.bin と同じ「全点の位置 → 全点の色」の並び。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    num_points = len(positions)
+
+    if num_points > 0:
+        bbox_min = positions.min(axis=0).astype(np.float64)
+        bbox_max = positions.max(axis=0).astype(np.float64)
+    else:
+        bbox_min = bbox_max = np.zeros(3)
+    # ノードを立方体にするため、一番長い辺に合わせる
+    size = float(np.max(bbox_max - bbox_min))
+    if size <= 0:
+        size = 1.0
+
+    # 点をランダムな順に並べておき、各セルで「最初の点」を選ぶと一様な間引きになる
+    rng = np.random.default_rng(seed)
+    pending = rng.permutation(num_points)
+
+    nodes = {}
+    level = 0
+    while pending.size > 0:
+        nodes_per_axis = 1 << level
+        cells_per_axis = grid * nodes_per_axis
+
+        cells = np.floor((positions[pending] - bbox_min) / size * cells_per_axis).astype(np.int64)
+        np.clip(cells, 0, cells_per_axis - 1, out=cells)
+        node_xyz = cells // grid
+        node_keys = (node_xyz[:, 0] * nodes_per_axis + node_xyz[:, 1]) * nodes_per_axis + node_xyz[:, 2]
+
+        # 点数が少ないノード（または最深部）は全点を持つ葉にする
+        _, node_inverse, node_counts = np.unique(node_keys, return_inverse=True, return_counts=True)
+        keep = node_counts[node_inverse] <= max_leaf_points
+        if level == max_depth:
+            keep[:] = True
+        else:
+            # それ以外のノードは格子の1セルにつき1点だけ残す
+            local = cells % grid
+            cell_keys = node_keys * grid ** 3 + (local[:, 0] * grid + local[:, 1]) * grid + local[:, 2]
+            split = np.flatnonzero(~keep)
+            _, first = np.unique(cell_keys[split], return_index=True)
+            keep[split[first]] = True
+
+        kept = pending[keep]
+        kept_keys = node_keys[keep]
+        order = np.argsort(kept_keys, kind="stable")
+        unique_keys, starts = np.unique(kept_keys[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        node_size = size / nodes_per_axis
+        for key, start, end in zip(unique_keys, starts, ends):
+            key = int(key)
+            nz = key % nodes_per_axis
+            ny = (key // nodes_per_axis) % nodes_per_axis
+            nx = key // (nodes_per_axis * nodes_per_axis)
+            name = node_name(level, nx, ny, nz)
+            indices = np.sort(kept[order[start:end]])
+
+            with open(os.path.join(output_dir, f"{name}.bin"), "wb") as bf:
+                bf.write(np.ascontiguousarray(positions[indices], dtype=np.float32).tobytes())
+                bf.write(np.ascontiguousarray(colors[indices], dtype=np.uint8).tobytes())
+
+            node_min = bbox_min + np.array([nx, ny, nz]) * node_size
+            nodes[name] = {
+                "name": name,
+                "level": level,
+                "count": int(len(indices)),
+                "file": f"{name}.bin",
+                "bounds": node_min.tolist() + (node_min + node_size).tolist(),
+                "children": [],
+            }
+
+        pending = pending[~keep]
+        level += 1
+
+    # 親子関係をつなぐ（親の名前は子の名前の末尾1文字を取ったもの）
+    for name in sorted(nodes):
+        if len(name) > 1:
+            nodes[name[:-1]]["children"].append(name)
+
+    index = {
+        "version": 1,
+        "format": "positions_f32_then_colors_u8",
+        "points": int(num_points),
+        "bounds": bbox_min.tolist() + (bbox_min + size).tolist(),
+        "grid": grid,
+        # 深さ0のノードの点間隔（深さが1つ増えるごとに半分になる）
+        "spacing": size / grid,
+        "depth": max(level - 1, 0),
+        "nodes": [nodes[name] for name in sorted(nodes, key=lambda n: (len(n), n))],
+    }
+    with open(os.path.join(output_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=1)
+    return index
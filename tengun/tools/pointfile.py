@@ -0,0 +1,256 @@
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# --- 設定 ---
+# ヘッダー付きフォーマットの識別子とバージョン
+MAGIC = b"TGPC"
+VERSION = 1
+# 圧縮の単位（この点数ごとにブロックに分けて圧縮する）
+BLOCK_POINTS = 65_536
+# --- ここまで ---
+
+# MAGIC(4) + バージョン(uint16) + ヘッダーJSONの長さ(uint32)
+_PREAMBLE = struct.Struct("<4sHI")
+
+
+def read_raw_points(path):
+    """points_textured.bin（位置float32 → 色uint8、ヘッダーなし）をコピーせずに開く"""
+    num_points = os.path.getsize(path) // 15
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    positions = data[:num_points * 12].view(np.float32).reshape(-1, 3)
+    colors = data[num_points * 12:num_points * 15].reshape(-1, 3)
+    return positions, colors
+
+
+def create_raw_points(path, num_points):
+    """points_textured.bin を num_points 点分の大きさで作り、書き込み用の (位置, 色) ビューを返す
+
+    どちらも np.memmap なので、配列に代入するとそのままファイルに書かれる
+    （tobytes() で全体をコピーしない）。書き終えたら flush() して手放す。
+    """
+    if num_points == 0:
+        # 大きさ0のファイルは memmap できないので、空のファイルだけ作る
+        open(path, "wb").close()
+        return np.zeros((0, 3), dtype=np.float32), np.zeros((0, 3), dtype=np.uint8)
+    data = np.memmap(path, dtype=np.uint8, mode="w+", shape=(num_points * 15,))
+    positions = data[:num_points * 12].view(np.float32).reshape(-1, 3)
+    colors = data[num_points * 12:num_points * 15].reshape(-1, 3)
+    return positions, colors
+
+
+def _compress(data, compression):
+    if compression == "none":
+        return data
+    if compression == "deflate":
+        return zlib.compress(data, 6)
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd 圧縮には zstandard パッケージが必要です (pip install zstandard)")
+        return zstandard.ZstdCompressor(level=9).compress(data)
+    raise ValueError(f"未対応の圧縮形式です: {compression}")
+
+
+def _decompress(data, compression):
+    if compression == "none":
+        return data
+    if compression == "deflate":
+        return zlib.decompress(data)
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd 圧縮には zstandard パッケージが必要です (pip install zstandard)")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"未対応の圧縮形式です: {compression}")
+
+
+def _encode_block(quantized, colors, normals=None):
+    """圧縮が効きやすいように、位置は前の点との差分に、各値はバイトごとの面に並べ替える"""
+    deltas = quantized.copy()
+    deltas[1:] -= quantized[:-1]  # uint16 のまま桁あふれさせる（復号時に cumsum で戻る）
+    num_points = len(quantized)
+    position_planes = deltas.astype("<u2").view(np.uint8).reshape(num_points, 3, 2).transpose(2, 1, 0)
+    raw = position_planes.tobytes() + colors.T.tobytes()
+    if normals is not None:
+        raw += normals.T.tobytes()
+    return raw
+
+
+def _decode_block(raw, num_points, has_normals=False):
+    position_planes = np.frombuffer(raw, dtype=np.uint8, count=num_points * 6).reshape(2, 3, num_points)
+    deltas = np.ascontiguousarray(position_planes.transpose(2, 1, 0)).view("<u2").reshape(num_points, 3)
+    quantized = np.cumsum(deltas, axis=0, dtype=np.uint16)
+    colors = np.frombuffer(raw, dtype=np.uint8, count=num_points * 3, offset=num_points * 6).reshape(3, num_points).T
+    normals = None
+    if has_normals:
+        normals = np.frombuffer(raw, dtype=np.int8, count=num_points * 3, offset=num_points * 9).reshape(3, num_points).T
+    return quantized, colors, normals
+
+
+def quantize_normals(normals):
+    """単位法線を int8 (×127) に量子化する"""
+    return np.clip(np.rint(np.asarray(normals, dtype=np.float32) * 127), -127, 127).astype(np.int8)
+
+
+def write_points(path, positions, colors, compression="none", block_points=BLOCK_POINTS, normals=None):
+    """ヘッダー付きの量子化フォーマットで点群を書き出す
+
+    ファイルの並び:
+      MAGIC "TGPC" / バージョン(uint16) / ヘッダーJSONの長さ(uint32) / ヘッダーJSON / ブロック...
+    位置はバウンディングボックスを基準に16bitへ量子化する（元の座標 = q * scale + offset）。
+    各ブロックは「ブロック内の全点の位置(uint16) → 全点の色(uint8)」の並びで、
+    ブロックごとに圧縮する。ブロックの点数とバイト数はヘッダーに記録する。
+    normals を渡すと、色の後ろに int8 (×127) に量子化した法線のブロックが続く。
+    圧縮するときは、位置を前の点との差分にしてバイト面ごとに並べ替え（filters: delta, shuffle）、
+    色も R, G, B の面ごとに並べてから圧縮する。
+    positions / colors は np.memmap でもよく、ブロック単位で読むのでメモリを使い切らない。
+    """
+    num_points = len(positions)
+    if num_points > 0:
+        bbox_min = positions.min(axis=0).astype(np.float64)
+        bbox_max = positions.max(axis=0).astype(np.float64)
+    else:
+        bbox_min = bbox_max = np.zeros(3)
+    scale = (bbox_max - bbox_min) / 65535.0
+    # 幅が0の軸は0で割らないようにする（全点が同じ値になる）
+    scale[scale == 0] = 1.0
+
+    blocks = []
+    payloads = []
+    for start in range(0, num_points, block_points):
+        end = min(start + block_points, num_points)
+        block_positions = np.asarray(positions[start:end], dtype=np.float64)
+        quantized = np.rint((block_positions - bbox_min) / scale)
+        np.clip(quantized, 0, 65535, out=quantized)
+        quantized = quantized.astype(np.uint16)
+        block_colors = np.asarray(colors[start:end], dtype=np.uint8)
+        block_normals = None if normals is None else quantize_normals(normals[start:end])
+        if compression == "none":
+            raw = quantized.astype("<u2").tobytes() + block_colors.tobytes()
+            if block_normals is not None:
+                raw += block_normals.tobytes()
+        else:
+            raw = _encode_block(quantized, block_colors, block_normals)
+        payload = _compress(raw, compression)
+        payloads.append(payload)
+        blocks.append({"points": end - start, "bytes": len(payload)})
+
+    attributes = [
+        {"name": "position", "type": "uint16", "components": 3},
+        {"name": "color", "type": "uint8", "components": 3},
+    ]
+    if normals is not None:
+        attributes.append({"name": "normal", "type": "int8", "components": 3, "scale": 1 / 127})
+
+    header = {
+        "count": num_points,
+        "bbox": bbox_min.tolist() + bbox_max.tolist(),
+        "scale": scale.tolist(),
+        "offset": bbox_min.tolist(),
+        "attributes": attributes,
+        "compression": compression,
+        "filters": [] if compression == "none" else ["delta", "shuffle"],
+        "blocks": blocks,
+    }
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+
+    with open(path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for payload in payloads:
+            f.write(payload)
+    return header
+
+
+def read_header(path):
+    """ヘッダー付きフォーマットならヘッダーを、そうでなければ None を返す"""
+    with open(path, "rb") as f:
+        preamble = f.read(_PREAMBLE.size)
+        if len(preamble) < _PREAMBLE.size or preamble[:4] != MAGIC:
+            return None
+        _, version, header_length = _PREAMBLE.unpack(preamble)
+        if version > VERSION:
+            raise ValueError(f"未対応のバージョンです: {version}")
+        header = json.loads(f.read(header_length).decode("utf-8"))
+    header["version"] = version
+    header["data_offset"] = _PREAMBLE.size + header_length
+    return header
+
+
+def _has_normals(header):
+    return any(attr["name"] == "normal" for attr in header["attributes"])
+
+
+def _read_blocks(path, header):
+    """ヘッダー付きフォーマットの全ブロックを復号して (位置, 色, 法線) を返す"""
+    num_points = header["count"]
+    has_normals = _has_normals(header)
+    scale = np.array(header["scale"])
+    offset = np.array(header["offset"])
+    positions = np.empty((num_points, 3), dtype=np.float32)
+    colors = np.empty((num_points, 3), dtype=np.uint8)
+    normals = np.empty((num_points, 3), dtype=np.float32) if has_normals else None
+
+    with open(path, "rb") as f:
+        f.seek(header["data_offset"])
+        start = 0
+        for block in header["blocks"]:
+            count = block["points"]
+            raw = _decompress(f.read(block["bytes"]), header["compression"])
+            if header.get("filters"):
+                quantized, block_colors, block_normals = _decode_block(raw, count, has_normals)
+            else:
+                quantized = np.frombuffer(raw, dtype="<u2", count=count * 3).reshape(-1, 3)
+                block_colors = np.frombuffer(raw, dtype=np.uint8, count=count * 3, offset=count * 6).reshape(-1, 3)
+                if has_normals:
+                    block_normals = np.frombuffer(raw, dtype=np.int8, count=count * 3, offset=count * 9).reshape(-1, 3)
+            positions[start:start + count] = quantized * scale + offset
+            colors[start:start + count] = block_colors
+            if has_normals:
+                normals[start:start + count] = block_normals / 127.0
+            start += count
+    return positions, colors, normals
+
+
+def read_points(path):
+    """点群ファイルを (位置 float32 (N,3), 色 uint8 (N,3)) として読み込む
+
+    ヘッダー付きフォーマットは復号・逆量子化し、ヘッダーのない
+    points_textured.bin はそのまま開く。
+    """
+    header = read_header(path)
+    if header is None:
+        return read_raw_points(path)
+    positions, colors, _ = _read_blocks(path, header)
+    return positions, colors
+
+
+def normals_path_for(path):
+    """ヘッダーのないフォーマットで法線を書き出す別ファイルの名前"""
+    root, _ = os.path.splitext(path)
+    return root + "_normals.bin"
+
+
+def read_normals(path):
+    """点群ファイルの法線 (N,3) float32 を読み込む。法線がなければ None
+
+    ヘッダー付きフォーマットはファイル内の法線ブロックを、
+    ヘッダーのない points_textured.bin は別ファイル (*_normals.bin, float32) を読む。
+    """
+    header = read_header(path)
+    if header is None:
+        normals_path = normals_path_for(path)
+        if not os.path.exists(normals_path):
+            return None
+        return np.fromfile(normals_path, dtype=np.float32).reshape(-1, 3)
+    if not _has_normals(header):
+        return None
+    _, _, normals = _read_blocks(path, header)
+    return normals
@@ -0,0 +1,236 @@
+import json
+import os
+
+import numpy as np
+
+from pointfile import create_raw_points, read_raw_points
+
+# --- 設定 ---
+# 水平方向の格子の1セルに平均で入る点の数（セルの大きさはこれに合わせて決める）
+GRID_CELL_POINTS = 4096
+# 並べ替えたデータを書き出すときに一度に扱う点の数
+SORT_CHUNK_POINTS = 1_000_000
+# 3次元の Morton 符号で並べるときの1軸あたりのビット数（3軸で63bit）
+MORTON_BITS = 21
+# Morton 順で並べたとき、索引に符号の範囲を記録する単位（点の数）
+MORTON_CHUNK_POINTS = 65_536
+# --- ここまで ---
+
+
+def _part1by1(values):
+    """各ビットの間に0を1つずつ挟む（2次元の Morton 符号用、32bit まで）"""
+    v = values.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x3333333333333333)
+    v = (v | (v << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return v
+
+
+def morton_encode_2d(ix, iy):
+    """整数の格子座標 (ix, iy) を Morton 符号（Zオーダー）にする"""
+    return _part1by1(ix) | (_part1by1(iy) << np.uint64(1))
+
+
+def _part1by2(values):
+    """各ビットの間に0を2つずつ挟む（3次元の Morton 符号用、21bit まで）"""
+    v = values.astype(np.uint64) & np.uint64(0x1FFFFF)
+    v = (v | (v << np.uint64(32))) & np.uint64(0x1F00000000FFFF)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x1F0000FF0000FF)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x100F00F00F00F00F)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x10C30C30C30C30C3)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x1249249249249249)
+    return v
+
+
+def morton_encode_3d(ix, iy, iz):
+    """整数の格子座標 (ix, iy, iz) を3次元の Morton 符号にする"""
+    return _part1by2(ix) | (_part1by2(iy) << np.uint64(1)) | (_part1by2(iz) << np.uint64(2))
+
+
+def morton_codes(positions, bits=MORTON_BITS):
+    """点の位置をバウンディングボックスの立方体で 2^bits 段階に量子化し、Morton 符号を返す
+
+    戻り値は (符号, 原点, 1段階の大きさ)。
+    """
+    xyz = np.asarray(positions, dtype=np.float64)
+    if len(xyz) == 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(3), 1.0
+    origin = xyz.min(axis=0)
+    size = float(np.max(xyz.max(axis=0) - origin))
+    steps = (1 << bits) - 1
+    step_size = size / steps if size > 0 else 1.0
+    quantized = np.clip(np.floor((xyz - origin) / step_size), 0, steps).astype(np.uint64)
+    return morton_encode_3d(quantized[:, 0], quantized[:, 1], quantized[:, 2]), origin, step_size
+
+
+def _rewrite_in_order(path, positions, colors, order):
+    """points_textured.bin を order の順に並べ替えて書き直す（チャンクごとにコピーする）"""
+    num_points = len(order)
+    tmp_path = path + ".sort.tmp"
+    sorted_positions, sorted_colors = create_raw_points(tmp_path, num_points)
+    for start in range(0, num_points, SORT_CHUNK_POINTS):
+        chunk = order[start:start + SORT_CHUNK_POINTS]
+        sorted_positions[start:start + len(chunk)] = positions[chunk]
+        sorted_colors[start:start + len(chunk)] = colors[chunk]
+    for view in (sorted_positions, sorted_colors):
+        if isinstance(view, np.memmap):
+            view.flush()
+    # 置き換える前に並べ替えた側の memmap を手放す（元の側は呼び出し元で手放す）
+    del sorted_positions, sorted_colors
+    return tmp_path
+
+
+def index_path_for(path):
+    """並べ替えた点群ファイルの索引（JSON）の名前"""
+    root, _ = os.path.splitext(path)
+    return root + "_index.json"
+
+
+def sort_raw_points_by_grid(path, cell_points=GRID_CELL_POINTS, seed=0):
+    """points_textured.bin を水平方向の格子セルごとに並べ替え、索引を書き出す
+
+    点は (x, z) 平面の格子セルの Morton 符号の順に並ぶので、近いセルの点はファイル上でも近い。
+    各セルの中の点はランダムな順に並べておくので、セルの先頭から一部だけ取ると
+    そのセルを一様に間引いた点になる（LOD）。
+    並べ替えた後も「全点の位置 → 全点の色」の並びのままなので、viewer でそのまま開ける。
+    索引には各セルの格子座標と、ファイル内の開始位置（点の番号）と点の数を記録する。
+    """
+    positions, colors = read_raw_points(path)
+    num_points = len(positions)
+    horizontal = np.asarray(positions[:, [0, 2]], dtype=np.float64)
+
+    if num_points > 0:
+        origin = horizontal.min(axis=0)
+        extent = horizontal.max(axis=0) - origin
+    else:
+        origin = extent = np.zeros(2)
+    num_cells = max(1, -(-num_points // cell_points))
+    area = float(max(extent[0], 1e-9) * max(extent[1], 1e-9))
+    cell_size = float(np.sqrt(area / num_cells))
+    if cell_size <= 0:
+        cell_size = 1.0
+    cells = np.floor((horizontal - origin) / cell_size).astype(np.int64)
+    grid_size = cells.max(axis=0) + 1 if num_points > 0 else np.ones(2, dtype=np.int64)
+    codes = morton_encode_2d(cells[:, 0], cells[:, 1])
+    del horizontal
+
+    # セルの順 → セル内はランダムな順
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(num_points), codes))
+    sorted_codes = codes[order]
+    unique_codes, starts, counts = np.unique(sorted_codes, return_index=True, return_counts=True)
+    first_points = order[starts]
+    del codes, sorted_codes
+
+    tmp_path = _rewrite_in_order(path, positions, colors, order)
+    del positions, colors
+    os.replace(tmp_path, path)
+
+    index = {
+        "version": 1,
+        "order": "grid",
+        "points": int(num_points),
+        "origin": origin.tolist(),
+        "cell_size": cell_size,
+        "grid_size": [int(n) for n in grid_size],
+        # [セルのx, セルのz, 開始位置, 点の数]（Morton 符号の順）
+        "cells": [
+            [int(cx), int(cz), int(start), int(count)]
+            for (cx, cz), start, count in zip(cells[first_points].tolist(), starts, counts)
+        ],
+    }
+    with open(index_path_for(path), "w", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"))
+    return index
+
+
+def sort_raw_points_by_morton(path, bits=MORTON_BITS, chunk_points=MORTON_CHUNK_POINTS):
+    """points_textured.bin を3次元の Morton 符号の順に並べ替え、符号の範囲の索引を書き出す
+
+    空間的に近い点がファイル上でも近くに並ぶので、GPU の頂点キャッシュや
+    k近傍の探索（normal-worker.js）でメモリを飛び回らずに済む。
+    索引には chunk_points 点ごとに、最初と最後の符号・開始位置・点の数・範囲 (min, max) を記録する。
+    チャンクごとに読み込めば、空間的にまとまった塊として順に送れる。
+    """
+    positions, colors = read_raw_points(path)
+    num_points = len(positions)
+    codes, origin, step_size = morton_codes(positions, bits)
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+
+    tmp_path = _rewrite_in_order(path, positions, colors, order)
+    del positions, colors
+    os.replace(tmp_path, path)
+
+    positions, _ = read_raw_points(path)
+    chunks = []
+    for start in range(0, num_points, chunk_points):
+        end = min(start + chunk_points, num_points)
+        chunk_positions = np.asarray(positions[start:end])
+        chunks.append([
+            int(codes[start]), int(codes[end - 1]), start, end - start,
+            *chunk_positions.min(axis=0).tolist(), *chunk_positions.max(axis=0).tolist(),
+        ])
+    del positions
+
+    index = {
+        "version": 1,
+        "order": "morton",
+        "points": int(num_points),
+        "origin": origin.tolist(),
+        "step_size": step_size,
+        "bits": bits,
+        # [最初の符号, 最後の符号, 開始位置, 点の数, xmin, ymin, zmin, xmax, ymax, zmax]
+        "chunks": chunks,
+    }
+    with open(index_path_for(path), "w", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"))
+    return index
+
+
+def load_index(path):
+    """索引を読み込み、検索しやすいように NumPy 配列を付け足して返す。索引がなければ None"""
+    index_path = index_path_for(path)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    if index.get("order") != "grid":
+        return index
+    cells = np.array(index["cells"], dtype=np.int64).reshape(-1, 4)
+    index["cell_x"], index["cell_z"], index["starts"], index["counts"] = cells.T
+    return index
+
+
+def query_ranges(index, bbox=None, lod=0):
+    """bbox (xmin, zmin, xmax, zmax) に重なるセルの点の範囲を [(開始位置, 点の数), ...] で返す
+
+    lod が1増えるごとに、各セルから取る点を 1/4 にする（点の間隔が約2倍になる）。
+    bbox が None なら全体。隣り合った範囲はつなげて返す。
+    """
+    selected = np.ones(len(index["starts"]), dtype=bool)
+    if bbox is not None:
+        xmin, zmin, xmax, zmax = bbox
+        origin_x, origin_z = index["origin"]
+        cell_size = index["cell_size"]
+        cx0 = np.floor((xmin - origin_x) / cell_size)
+        cx1 = np.floor((xmax - origin_x) / cell_size)
+        cz0 = np.floor((zmin - origin_z) / cell_size)
+        cz1 = np.floor((zmax - origin_z) / cell_size)
+        selected = (cx0 <= index["cell_x"]) & (index["cell_x"] <= cx1) & \
+            (cz0 <= index["cell_z"]) & (index["cell_z"] <= cz1)
+
+    starts = index["starts"][selected]
+    counts = index["counts"][selected]
+    if lod > 0:
+        counts = np.maximum(1, -(-counts // (4 ** int(lod))))
+
+    ranges = []
+    for start, count in zip(starts.tolist(), counts.tolist()):
+        if ranges and ranges[-1][0] + ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + count)
+        else:
+            ranges.append((start, count))
+    return ranges
@@ -0,0 +1,133 @@
+import numpy as np
+
+
+def _voxel_keys(xyz, voxel_size, origin):
+    """各点が入る格子セルの番号を1つの int64 にまとめる"""
+    cells = np.floor((xyz - origin) / voxel_size).astype(np.int64)
+    dims = cells.max(axis=0) + 1
+    return (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2], cells
+
+
+def voxel_grid_indices(xyz, voxel_size):
+    """ボクセル格子で間引く: 1セルにつき、セルの中心に一番近い点を1つだけ残す
+
+    戻り値は残す点の番号（元の並び順）。密な場所も疎な場所も同じ間隔になる。
+    """
+    xyz = np.asarray(xyz, dtype=np.float64)
+    if len(xyz) == 0:
+        return np.zeros(0, dtype=np.int64)
+    origin = xyz.min(axis=0)
+    keys, cells = _voxel_keys(xyz, voxel_size, origin)
+    centers = origin + (cells + 0.5) * voxel_size
+    distances = np.sum((xyz - centers) ** 2, axis=1)
+    # セル番号 → 中心からの距離 の順に並べ、各セルの先頭を選ぶ
+    order = np.lexsort((distances, keys))
+    _, first = np.unique(keys[order], return_index=True)
+    return np.sort(order[first])
+
+
+def count_voxels(xyz, voxel_size):
+    """ボクセル格子で間引いたときに残る点の数"""
+    if len(xyz) == 0:
+        return 0
+    keys, _ = _voxel_keys(xyz, voxel_size, xyz.min(axis=0))
+    return len(np.unique(keys))
+
+
+def voxel_size_for_target(xyz, target_points, tolerance=0.02, max_iterations=30):
+    """残る点の数が target_points に近くなるボクセルの大きさを二分探索で求める"""
+    xyz = np.asarray(xyz, dtype=np.float64)
+    if len(xyz) <= target_points:
+        return None
+    extent = float(np.max(xyz.max(axis=0) - xyz.min(axis=0)))
+    if extent <= 0:
+        return None
+    # 対数スケールで探す（小さいほど点が多く残る）
+    low, high = extent * 1e-7, extent
+    voxel_size = high
+    for _ in range(max_iterations):
+        voxel_size = float(np.sqrt(low * high))
+        count = count_voxels(xyz, voxel_size)
+        if abs(count - target_points) <= target_points * tolerance:
+            break
+        if count > target_points:
+            low = voxel_size
+        else:
+            high = voxel_size
+    return voxel_size
+
+
+def poisson_disk_indices(xyz, radius, seed=0, trials=3):
+    """近似ポアソンディスク間引き: どの2点も radius 以上離れるように点を選ぶ
+
+    一辺 radius/√3 の格子を使うと、1セルに入る採用点は高々1つになる。
+    セル番号を3で割った余りが同じセル同士は互いに影響しないので、
+    27グループに分けて、グループごとに候補点（各セルからランダムに1点）と
+    周囲のセルの採用済みの点との距離を NumPy でまとめて調べる。
+    候補が却下されたセルは、別の点で trials 回まで試す。
+    """
+    xyz = np.asarray(xyz, dtype=np.float64)
+    num_points = len(xyz)
+    if num_points == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    cell_size = radius / np.sqrt(3)
+    origin = xyz.min(axis=0)
+    cells = np.floor((xyz - origin) / cell_size).astype(np.int64)
+    # 隣接セルの番号計算で範囲外に出ないよう、周囲に2セルずつ余白を取る
+    cells += 2
+    dims = cells.max(axis=0) + 3
+
+    def cell_key(c):
+        return (c[..., 0] * dims[1] + c[..., 1]) * dims[2] + c[..., 2]
+
+    keys = cell_key(cells)
+    phases = (cells[:, 0] % 3) * 9 + (cells[:, 1] % 3) * 3 + (cells[:, 2] % 3)
+    phase_order = np.argsort(phases, kind="stable")
+    phase_groups = np.split(phase_order, np.searchsorted(phases[phase_order], np.arange(1, 27)))
+    offsets = np.array([(dx, dy, dz) for dx in range(-2, 3) for dy in range(-2, 3) for dz in range(-2, 3)
+                        if (dx, dy, dz) != (0, 0, 0)])
+
+    rng = np.random.default_rng(seed)
+    priority = rng.permutation(num_points)
+    # 採用済みの点: セル番号 → 点番号（セル番号でソートして二分探索する）
+    accepted_keys = np.zeros(0, dtype=np.int64)
+    accepted_points = np.zeros(0, dtype=np.int64)
+    available = np.ones(num_points, dtype=bool)
+
+    for _ in range(trials):
+        for group in phase_groups:
+            group = group[available[group]]
+            candidates = group
+            if candidates.size == 0:
+                continue
+            # 各セルからランダムに1点を候補にする
+            order = np.lexsort((priority[candidates], keys[candidates]))
+            _, first = np.unique(keys[candidates][order], return_index=True)
+            candidates = candidates[order[first]]
+
+            ok = np.ones(candidates.size, dtype=bool)
+            if accepted_keys.size > 0:
+                candidate_cells = cells[candidates]
+                for offset in offsets:
+                    neighbor_keys = cell_key(candidate_cells + offset)
+                    pos = np.searchsorted(accepted_keys, neighbor_keys)
+                    pos[pos == accepted_keys.size] = 0
+                    hit = accepted_keys[pos] == neighbor_keys
+                    if not hit.any():
+                        continue
+                    neighbors = accepted_points[pos[hit]]
+                    too_close = np.sum((xyz[candidates[hit]] - xyz[neighbors]) ** 2, axis=1) < radius ** 2
+                    ok[np.flatnonzero(hit)[too_close]] = False
+
+            new_points = candidates[ok]
+            available[candidates[~ok]] = False
+            # 採用したセルの残りの点はもう候補にならない（同じセルの点は同じグループにいる）
+            available[group[np.isin(keys[group], keys[new_points])]] = False
+            accepted_keys = np.concatenate([accepted_keys, keys[new_points]])
+            accepted_points = np.concatenate([accepted_points, new_points])
+            sort = np.argsort(accepted_keys, kind="stable")
+            accepted_keys = accepted_keys[sort]
+            accepted_points = accepted_points[sort]
+
+    return np.sort(accepted_points)
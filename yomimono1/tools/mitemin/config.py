@@ -28,6 +28,25 @@ CACHE_FOLDER = os.path.join(BASE_DATA_DIR, 'static', 'cache')
 CACHE_FILE = os.path.join(CACHE_FOLDER, 'image_list.json')
 USER_DATA_DIR = os.path.join(BASE_DATA_DIR, 'playwright_profile')
 
+# ブラウザを画面に表示せずに動かすか（False にするとブラウザが動く様子が見えます）
+# ブラウザはアップロード・削除・一覧の同期で1つを使い回すので、すべてに効く。
+# 既定は一覧の同期と同じく表示しない（以前はアップロードと削除のときだけウィンドウが開いていた）
+HEADLESS = bool(config_data.get('HEADLESS', True))
+
+# サーバー負荷対策: mitemin.net へのページ遷移・フォーム送信を1分間に何回までにするか（0 で無制限）と、
+# まとめて続けて送ってよい回数。
+# 数えるのは画像の枚数ではなくページの数。アップロード1枚はおよそ4回、削除1枚はおよそ3回なので、
+# 既定の90回/分は「削除なら約30枚/分、アップロードなら約22枚/分」になる。
+# 以前の DELETE_RATE_PER_MINUTE（削除の枚数/分）が config.json にあれば、その3倍を使う
+_legacy_delete_rate = config_data.get('DELETE_RATE_PER_MINUTE')
+MITEMIN_REQUESTS_PER_MINUTE = float(config_data.get(
+    'MITEMIN_REQUESTS_PER_MINUTE', float(_legacy_delete_rate) * 3 if _legacy_delete_rate is not None else 90))
+MITEMIN_BURST = int(config_data.get('MITEMIN_BURST', 6))
+
+# サムネイル画像を同時にダウンロードする数と、失敗したときのリトライ回数
+THUMBNAIL_WORKERS = int(config_data.get('THUMBNAIL_WORKERS', 8))
+THUMBNAIL_RETRIES = int(config_data.get('THUMBNAIL_RETRIES', 3))
+
 # ディレクトリの自動生成（存在しない場合は作成）
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(CACHE_FOLDER, exist_ok=True)
@@ -0,0 +1,34 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """トークンバケット方式のレート制限（複数のスレッドから共有できる）
+
+    1分間に rate_per_minute 個のトークンが貯まり、最大 burst 個まで貯めておける。
+    acquire() はトークンが1つ貯まるまで待ってから消費する。rate_per_minute が0以下なら制限しない。
+    """
+
+    def __init__(self, rate_per_minute, burst=1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, float(burst))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1.0):
+        """トークンを消費する。足りなければ貯まるまで待つ。待った秒数を返す"""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
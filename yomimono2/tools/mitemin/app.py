@@ -1,17 +1,56 @@
+import atexit
+import json
 import os
 import re
-import time
+import tempfile
+import threading
+import urllib.parse
+import uuid
+from concurrent.futures import wait
 from flask import Flask, request, render_template, jsonify
-from playwright.sync_api import sync_playwright
 
 app = Flask(__name__)
-from config import UPLOAD_FOLDER, CACHE_FOLDER, USER_DATA_DIR, CACHE_FILE
+from config import UPLOAD_FOLDER, CACHE_FILE
+from browser_session import BrowserSession, LoginError, limiter, login_if_needed, navigate, submit
+from jobs import JobQueue
+from thumbnails import ThumbnailFetcher
+
+# ブラウザは最初のリクエストで1度だけ起動し、サーバーが止まるまで使い回す
+browser = BrowserSession()
+atexit.register(browser.close)
+# サムネイル画像は一覧ページの解析とは別に、並列にダウンロードする
+thumbnails = ThumbnailFetcher()
+# image_list.json は一覧の同期と削除のジョブが別々のスレッドから書き換えるので、
+# 読んでから書くまでをこのロックの中で行う
+cache_lock = threading.Lock()
+
+def _read_cache():
+    """image_list.json の中身を返す（ないときや読めないときは空の dict）"""
+    if not os.path.exists(CACHE_FILE):
+        return {}
+    try:
+        with open(CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[CACHE ERROR] キャッシュの読み込みに失敗: {e}")
+        return {}
+
+def _write_cache(data):
+    """一時ファイルに書いてから名前を変える（書きかけのファイルを読まれたり残したりしない）"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(CACHE_FILE)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, CACHE_FILE)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 @app.route('/get_cached_list', methods=['GET'])
 def get_cached_list():
     if os.path.exists(CACHE_FILE):
         try:
-            import json
             with open(CACHE_FILE, 'r', encoding='utf-8') as f:
                 data = json.load(f)
                 return jsonify({'status': 'success', 'user_id': data.get('user_id', ''), 'images': data.get('images', [])})
@@ -45,119 +84,131 @@ def upload_file():
          os.remove(filepath)
          return jsonify({'status': 'error', 'message': 'ログインIDとパスワードを入力してください'})
 
-    # Playwrightで自動アップロード処理
-    try:
-        with sync_playwright() as p:
-            # headless=False にするとブラウザが動く様子が見えます
-            browser = p.chromium.launch_persistent_context(
-                user_data_dir=USER_DATA_DIR,
-                headless=False 
-            )
-            page = browser.new_page()
-
-            # --- STEP 1: ファイル選択画面 ---
-            target_url = "https://mitemin.net/imageupload/input/"
-            print(f"[DEBUG] アクセス先: {target_url}")
-            page.goto(target_url)
-            page.wait_for_load_state("networkidle")
-            
-            current_url = page.url
-            print(f"[DEBUG] 現在のURL: {current_url}")
-            
-            # ※ログイン画面に飛ばされた場合は自動ログインを試みる
-            if "login" in current_url:
-                print(f"[DEBUG] ログイン画面にリダイレクトされました。自動ログインを実行します。")
-                print(f"[DEBUG] 送信されたID: {login_id}, パスワード文字数: {len(login_password)}")
-                
-                page.locator('input[name="miteminid"]').click()
-                page.locator('input[name="miteminid"]').fill(login_id)
-                time.sleep(0.5)
-                
-                page.locator('input[name="pass"]').click()
-                page.locator('input[name="pass"]').fill(login_password)
-                time.sleep(0.5)
-                
-                # 次回から自動的にログインにチェックを入れておく
-                if page.locator('input[name="skip"]').is_visible():
-                     page.locator('input[name="skip"]').check()
-                     
-                page.get_by_role("button", name="LOGIN").click()
-                page.wait_for_load_state("networkidle")
-                time.sleep(1)
-                
-                # ログイン成功後、再度アップロード画面へ遷移
-                page.goto(target_url)
-                page.wait_for_load_state("networkidle")
-                
-                # それでもloginページにいるならID/PASS間違いなど
-                if "login" in page.url:
-                    browser.close()
-                    os.remove(filepath)
-                    return jsonify({'status': 'error', 'message': '自動ログインに失敗しました。IDとパスワードを確認してください。'})
-            
-            print("[DEBUG] ログイン済みを確認。アップロード処理を開始します。")
-
-            page.locator('input[type="file"]').set_input_files(filepath)
-            page.get_by_role("button", name="画像情報入力へ").click()
-            page.wait_for_load_state("networkidle")
-
-            # --- エラーチェック (二重アップロード等) ---
-            # 「画像情報入力へ」を押した段階で重複しているとエラー画面(input2/)に飛ばされる
-            error_text = "この画像はすでにアップロードされています"
-            if error_text in page.content():
-                browser.close()
-                os.remove(filepath)
-                return jsonify({'status': 'error', 'message': '過去に同じ画像がアップロードされています'})
-
-            # --- STEP 2: 画像情報入力画面 ---
-            # タイトル（前は検索バーに入力されてしまっていたため、ID指定に修正）
-            page.locator('#imagetitle').fill(file_name_without_ext) 
-            
-            # AI生成画像のラジオボタン
-            page.locator('input[name="image_type"][value="2"]').check()
-            
-            # ジャンル（1=イラスト）
-            page.locator('select[name="genre"]').select_option("1")
-            
-            # 確認ボタン
-            page.get_by_role("button", name="アップロード[確認]").click()
-            page.wait_for_load_state("networkidle")
+    return jsonify(_upload_one(filepath, file_name_without_ext, login_id, login_password))
 
-            # --- STEP 3: 確認・実行画面 ---
-            page.get_by_role("button", name=re.compile("アップロード")).click()
-            page.wait_for_load_state("networkidle")
+@app.route('/upload_batch', methods=['POST'])
+def upload_batch():
+    """複数のファイルをまとめて受け取り、バックグラウンドのジョブとしてアップロードする（進み具合は /jobs/<id>）"""
+    files = [f for f in request.files.getlist('files') if f.filename]
+    if not files:
+        return jsonify({'status': 'error', 'message': 'ファイルがありません'})
 
-            # --- STEP 4: URL(ID)とユーザーIDの抽出 ---
-            content = page.content()
-            
-            # 画像ID ("i" + 数字) を探す
-            image_match = re.search(r'(i\d{5,8})', content)
-            
-            # ページ内のURL (例: https://50198.mitemin.net/i1110175/) からユーザーID（サブドメインの数字）を探す
-            user_id_match = re.search(r'https?://(\d{4,8})\.mitemin\.net', content)
-            if not user_id_match:
-                 # 念のため、他のパターンも探す
-                 user_id_match = re.search(r'mitemin\.net/user(?:page)?/(?:top/)?(\d{4,8})', content)
-            
-            user_id = user_id_match.group(1) if user_id_match else "ユーザーID取得失敗"
+    login_id = request.form.get('login_id', '')
+    login_password = request.form.get('login_password', '')
+    if not login_id or not login_password:
+         return jsonify({'status': 'error', 'message': 'ログインIDとパスワードを入力してください'})
 
-            if image_match:
-                image_id = image_match.group(1)
-                result = {'status': 'success', 'image_id': image_id, 'user_id': user_id}
-            else:
-                result = {'status': 'error', 'message': '画像IDが抽出できませんでした'}
+    # 同じ名前のファイルが別のジョブと重ならないよう、一時保存の名前には接頭辞を付ける
+    batch = {'login_failed': False}
+    items = []
+    labels = []
+    for file in files:
+        filename = os.path.basename(file.filename)
+        filepath = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex}_{filename}")
+        file.save(filepath)
+        items.append({
+            'filepath': filepath,
+            'title': os.path.splitext(filename)[0],
+            'login_id': login_id,
+            'login_password': login_password,
+            'batch': batch,
+        })
+        labels.append(filename)
 
-            # サーバー負荷対策の待機時間（超重要）
-            time.sleep(5)
-            
-            browser.close()
-            # 終わったら一時ファイルを削除
-            os.remove(filepath)
-            
-            return jsonify(result)
+    job_id = upload_jobs.submit(items, labels)
+    return jsonify({'status': 'success', 'job_id': job_id, 'total': len(items)})
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = upload_jobs.get(job_id) or delete_jobs.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'ジョブが見つかりません'}), 404
+    return jsonify({'status': 'success', 'job': job})
+
+def _upload_one(filepath, title, login_id, login_password):
+    """1枚アップロードして結果の dict を返す。一時ファイルは最後に削除する"""
+    # Playwrightで自動アップロード処理（ブラウザはサーバー起動中ずっと使い回す）
+    try:
+        return browser.run(_upload_steps, filepath, title, login_id, login_password)
+    except LoginError:
+        return {'status': 'error', 'message': '自動ログインに失敗しました。IDとパスワードを確認してください。', 'login_failed': True}
     except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+        return {'status': 'error', 'message': str(e)}
+    finally:
+        # 終わったら一時ファイルを削除
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+def _upload_job_item(item):
+    """ジョブの1項目をアップロードする。ログインに失敗したら、同じジョブの残りはブラウザを動かさずに失敗にする"""
+    batch = item['batch']
+    if batch['login_failed']:
+        os.remove(item['filepath'])
+        return {'status': 'error', 'message': 'ログインに失敗したためスキップしました'}
+    result = _upload_one(item['filepath'], item['title'], item['login_id'], item['login_password'])
+    if result.get('login_failed'):
+        batch['login_failed'] = True
+    return result
+
+# 一括アップロードのジョブ（1件ずつ順にブラウザで処理する）
+upload_jobs = JobQueue(_upload_job_item)
+
+def _upload_steps(page, filepath, title, login_id, login_password):
+    # --- STEP 1: ファイル選択画面 ---
+    target_url = "https://mitemin.net/imageupload/input/"
+    print(f"[DEBUG] アクセス先: {target_url}")
+    # ※ログイン画面に飛ばされた場合は自動ログインを試みる
+    login_if_needed(page, target_url, login_id, login_password)
+    print(f"[DEBUG] 現在のURL: {page.url}")
+    print("[DEBUG] ログイン済みを確認。アップロード処理を開始します。")
+
+    page.locator('input[type="file"]').set_input_files(filepath)
+    submit(page, page.get_by_role("button", name="画像情報入力へ"))
+
+    # --- エラーチェック (二重アップロード等) ---
+    # 「画像情報入力へ」を押した段階で重複しているとエラー画面(input2/)に飛ばされる
+    error_text = "この画像はすでにアップロードされています"
+    if error_text in page.content():
+        return {'status': 'error', 'message': '過去に同じ画像がアップロードされています'}
+
+    # --- STEP 2: 画像情報入力画面 ---
+    # タイトル（前は検索バーに入力されてしまっていたため、ID指定に修正）
+    page.locator('#imagetitle').fill(title)
+
+    # AI生成画像のラジオボタン
+    page.locator('input[name="image_type"][value="2"]').check()
+
+    # ジャンル（1=イラスト）
+    page.locator('select[name="genre"]').select_option("1")
+
+    # 確認ボタン
+    submit(page, page.get_by_role("button", name="アップロード[確認]"))
+
+    # --- STEP 3: 確認・実行画面 ---
+    submit(page, page.get_by_role("button", name=re.compile("アップロード")))
+
+    # --- STEP 4: URL(ID)とユーザーIDの抽出 ---
+    content = page.content()
+
+    # 画像ID ("i" + 数字) を探す
+    image_match = re.search(r'(i\d{5,8})', content)
+
+    # ページ内のURL (例: https://50198.mitemin.net/i1110175/) からユーザーID（サブドメインの数字）を探す
+    user_id_match = re.search(r'https?://(\d{4,8})\.mitemin\.net', content)
+    if not user_id_match:
+         # 念のため、他のパターンも探す
+         user_id_match = re.search(r'mitemin\.net/user(?:page)?/(?:top/)?(\d{4,8})', content)
+
+    user_id = user_id_match.group(1) if user_id_match else "ユーザーID取得失敗"
+
+    if image_match:
+        image_id = image_match.group(1)
+        result = {'status': 'success', 'image_id': image_id, 'user_id': user_id}
+    else:
+        result = {'status': 'error', 'message': '画像IDが抽出できませんでした'}
+
+    # サーバー負荷対策の待機は、次のページ遷移の前に limiter（config の MITEMIN_REQUESTS_PER_MINUTE）が行う
+    return result
 
 @app.route('/sync_list', methods=['POST'])
 def sync_image_list():
@@ -167,158 +218,134 @@ def sync_image_list():
     if not login_id or not login_password:
         return jsonify({'status': 'error', 'message': 'ログインIDとパスワードが必要です。'})
         
-    # 既存のキャッシュを読み込む
-    existing_cache = []
-    cached_user_id = "unknown"
-    if os.path.exists(CACHE_FILE):
-        try:
-            import json
-            with open(CACHE_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                existing_cache = data.get('images', [])
-                cached_user_id = data.get('user_id', 'unknown')
-        except:
-            pass
-            
+    # 既存のキャッシュを読み込む（どこまで新しい画像を探すかを決めるためだけに使う）
+    with cache_lock:
+        existing_cache = _read_cache().get('images', [])
     existing_ids = set([img['image_id'] for img in existing_cache])
-    new_images = []
-    user_id = cached_user_id
         
     try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch_persistent_context(
-                user_data_dir=USER_DATA_DIR,
-                headless=True
-            )
-            page = browser.new_page()
+        user_id, new_images, downloads = browser.run(_sync_steps, login_id, login_password, existing_ids)
+    except LoginError:
+        return jsonify({'status': 'error', 'message': 'ログインに失敗したようです。'})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)})
+
+    # ブラウザを手放してから、残りのサムネイルのダウンロードを待つ
+    wait([future for _, future in downloads])
+    for image_id, future in downloads:
+        if future.exception() is not None:
+            print(f"[CACHE ERROR] {image_id} のサムネイル取得に失敗: {future.exception()}")
+
+    # キャッシュデータを更新して保存
+    # 同期の間に削除のジョブがキャッシュを書き換えているかもしれないので、読み直してから足す
+    with cache_lock:
+        data = _read_cache()
+        current_cache = data.get('images', [])
+        current_ids = set(img['image_id'] for img in current_cache)
+        if user_id is None:
+            user_id = data.get('user_id', 'unknown')
+        updated_cache = [img for img in new_images if img['image_id'] not in current_ids] + current_cache
+        _write_cache({'user_id': user_id, 'images': updated_cache})
+        
+    return jsonify({
+        'status': 'success', 
+        'user_id': user_id, 
+        'images': updated_cache,
+        'new_count': len(new_images)
+    })
+
+def _sync_steps(page, login_id, login_password, existing_ids):
+    """一覧ページを新しい順にたどり、キャッシュにない画像を集める
+
+    (ユーザーID, 新規画像のリスト, [(画像ID, サムネイルのダウンロードの Future), ...]) を返す。
+    サムネイルは thumbnails に積むだけで、ダウンロードの終わりは待たない。
+    """
+    new_images = []
+    downloads = []
+    user_id = None
+    current_page = 1
+    while True:
+        # 指定されたページのURLを組み立ててアクセス
+        target_url = f'https://mitemin.net/userimagesearch/search/index.php?p={current_page}'
+        if current_page == 1:
+            # 未ログインの場合はログイン処理を実施する (1ページ目アクセス時のみ)
+            login_if_needed(page, target_url, login_id, login_password)
+        else:
+            navigate(page, target_url)
+        
+        # --- 画像一覧とユーザーIDの取得処理 ---
+        content = page.content()
+        
+        if current_page == 1:
+            user_id_match = re.search(r'mitemin\.net/user(?:page)?/(?:top/)?(\d{4,8})', content)
+            if not user_id_match:
+                 user_id_match = re.search(r'https?://(\d{4,8})\.mitemin\.net', content)
+            if user_id_match:
+                 user_id = user_id_match.group(1)
+        
+        # 画像のブロック要素 (<div class="image_box">...</div> 等) を正規表現で抽出
+        box_matches = list(re.finditer(r'<div class="image_box">(.*?)</div><!-- search_box -->', content, re.IGNORECASE | re.DOTALL))
+        
+        if not box_matches:
+            break # このページに画像が1枚もなければ終了
+            
+        page_has_new = False
+        for box in box_matches:
+            box_html = box.group(1)
+            
+            # 画像IDの抽出 (HTML上のリンクは i 抜きになっている)
+            id_match = re.search(r'/imagemanage/top/icode/(\d+)/', box_html)
+            if not id_match:
+                continue
+            image_id = "i" + id_match.group(1)
+            
+            # すでにキャッシュされていればスキップ
+            if image_id in existing_ids:
+                continue
+            
+            # サムネイル画像のURLとタイトル(alt)の抽出
+            img_match = re.search(r'<img\s+src=["\']([^"\']+)["\']\s+alt=["\']([^"\']*)["\']', box_html, re.IGNORECASE)
+            if not img_match:
+                # 属性の順番が逆のパターン
+                img_match = re.search(r'<img\s+alt=["\']([^"\']*)["\']\s+src=["\']([^"\']+)["\']', box_html, re.IGNORECASE)
+                if img_match:
+                    title, src = img_match.group(1), img_match.group(2)
+                else:
+                    continue
+            else:
+                src, title = img_match.group(1), img_match.group(2)
             
-            import urllib.request
-            import urllib.parse
-            import json
+            # キャッシュ処理: サムネイル画像をローカルに保存する
+            ext = os.path.splitext(urllib.parse.urlparse(src).path)[1]
+            if not ext: ext = ".jpg"
             
-            current_page = 1
-            while True:
-                # 指定されたページのURLを組み立ててアクセス
-                target_url = f'https://mitemin.net/userimagesearch/search/index.php?p={current_page}'
-                page.goto(target_url)
-                page.wait_for_load_state("networkidle")
-
-                # 未ログインの場合はログイン処理を実施する (1ページ目アクセス時のみ)
-                if current_page == 1 and ("login/input" in page.url or "login" in page.url):
-                    print(f"[DEBUG Sync] ログイン画面にリダイレクトされました。ログインを試みます。")
-                    page.locator('input[name="miteminid"]').click()
-                    page.locator('input[name="miteminid"]').fill(login_id)
-                    time.sleep(0.5)
-                    page.locator('input[name="pass"]').click()
-                    page.locator('input[name="pass"]').fill(login_password)
-                    time.sleep(0.5)
-                    if page.locator('input[name="skip"]').is_visible():
-                         page.locator('input[name="skip"]').check()
-                    page.get_by_role("button", name="LOGIN").click()
-                    page.wait_for_load_state("networkidle")
-                    
-                    # 最初に見ようとした一覧ページに再度アクセス
-                    page.goto(target_url)
-                    page.wait_for_load_state("networkidle")
-                    
-                    if "login" in page.url:
-                        browser.close()
-                        return jsonify({'status': 'error', 'message': 'ログインに失敗したようです。'})
-                
-                # --- 画像一覧とユーザーIDの取得処理 ---
-                content = page.content()
-                
-                if current_page == 1:
-                    user_id_match = re.search(r'mitemin\.net/user(?:page)?/(?:top/)?(\d{4,8})', content)
-                    if not user_id_match:
-                         user_id_match = re.search(r'https?://(\d{4,8})\.mitemin\.net', content)
-                    if user_id_match:
-                         user_id = user_id_match.group(1)
-                
-                # 画像のブロック要素 (<div class="image_box">...</div> 等) を正規表現で抽出
-                box_matches = list(re.finditer(r'<div class="image_box">(.*?)</div><!-- search_box -->', content, re.IGNORECASE | re.DOTALL))
-                
-                if not box_matches:
-                    break # このページに画像が1枚もなければ終了
-                    
-                page_has_new = False
-                for box in box_matches:
-                    box_html = box.group(1)
-                    
-                    # 画像IDの抽出 (HTML上のリンクは i 抜きになっている)
-                    id_match = re.search(r'/imagemanage/top/icode/(\d+)/', box_html)
-                    if not id_match:
-                        continue
-                    image_id = "i" + id_match.group(1)
-                    
-                    # すでにキャッシュされていればスキップ
-                    if image_id in existing_ids:
-                        continue
-                    
-                    # サムネイル画像のURLとタイトル(alt)の抽出
-                    img_match = re.search(r'<img\s+src=["\']([^"\']+)["\']\s+alt=["\']([^"\']*)["\']', box_html, re.IGNORECASE)
-                    if not img_match:
-                        # 属性の順番が逆のパターン
-                        img_match = re.search(r'<img\s+alt=["\']([^"\']*)["\']\s+src=["\']([^"\']+)["\']', box_html, re.IGNORECASE)
-                        if img_match:
-                            title, src = img_match.group(1), img_match.group(2)
-                        else:
-                            continue
-                    else:
-                        src, title = img_match.group(1), img_match.group(2)
-                    
-                    # キャッシュ処理: サムネイル画像をローカルに保存する
-                    ext = os.path.splitext(urllib.parse.urlparse(src).path)[1]
-                    if not ext: ext = ".jpg"
-                    
-                    cache_filename = f"{image_id}{ext}"
-                    cache_filepath = os.path.join(CACHE_FOLDER, cache_filename)
-                    
-                    # キャッシュが存在しなければダウンロード
-                    if not os.path.exists(cache_filepath):
-                        try:
-                            req = urllib.request.Request(src, headers={'User-Agent': 'Mozilla/5.0'})
-                            with urllib.request.urlopen(req) as response, open(cache_filepath, 'wb') as out_file:
-                                out_file.write(response.read())
-                        except Exception as e:
-                            print(f"[CACHE ERROR] {image_id} のサムネイル取得に失敗: {e}")
-                    
-                    local_src = f"/static/cache/{cache_filename}"
-                    
-                    # 新規画像として追加
-                    new_images.append({
-                        'image_id': image_id,
-                        'src': local_src,
-                        'original_src': src, # フォールバック用
-                        'title': title
-                    })
-                    existing_ids.add(image_id)
-                    page_has_new = True
-                
-                if not page_has_new:
-                    # このページの画像がすべてキャッシュ済みだったので、これ以上古いページを見る必要はない
-                    break
-                    
-                # 次のページへ
-                current_page += 1
-                time.sleep(1) # サーバー負荷のために1秒待つ
-
-            browser.close()
+            cache_filename = f"{image_id}{ext}"
             
-            # キャッシュデータを更新して保存
-            updated_cache = new_images + existing_cache
-            with open(CACHE_FILE, 'w', encoding='utf-8') as f:
-                json.dump({'user_id': user_id, 'images': updated_cache}, f, ensure_ascii=False, indent=2)
-                
-            return jsonify({
-                'status': 'success', 
-                'user_id': user_id, 
-                'images': updated_cache,
-                'new_count': len(new_images)
+            # キャッシュが存在しなければダウンロード（別スレッドで行う）
+            future = thumbnails.submit(src, cache_filename)
+            if future is not None:
+                downloads.append((image_id, future))
+            
+            local_src = f"/static/cache/{cache_filename}"
+            
+            # 新規画像として追加
+            new_images.append({
+                'image_id': image_id,
+                'src': local_src,
+                'original_src': src, # フォールバック用
+                'title': title
             })
+            existing_ids.add(image_id)
+            page_has_new = True
+        
+        if not page_has_new:
+            # このページの画像がすべてキャッシュ済みだったので、これ以上古いページを見る必要はない
+            break
+            
+        # 次のページへ（サーバー負荷対策の待機は navigate の limiter が行う）
+        current_page += 1
 
-    except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
+    return user_id, new_images, downloads
 
 @app.route('/delete', methods=['POST'])
 def delete_image():
@@ -337,68 +364,106 @@ def delete_image():
     image_icode = match.group(0)
 
     try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch_persistent_context(
-                user_data_dir=USER_DATA_DIR,
-                headless=False
-            )
-            page = browser.new_page()
-            
-            # --- STEP 1: Delete input page ---
-            target_url = f"https://mitemin.net/imagemanage/imagedeleteinput/icode/{image_icode}/"
-            print(f"[DEBUG Delete] アクセス先: {target_url}")
-            page.goto(target_url)
-            page.wait_for_load_state("networkidle")
-            
-            # Login check
-            if "login/input" in page.url or "login" in page.url:
-                page.locator('input[name="miteminid"]').fill(login_id)
-                time.sleep(0.5)
-                page.locator('input[name="pass"]').fill(login_password)
-                time.sleep(0.5)
-                if page.locator('input[name="skip"]').is_visible():
-                     page.locator('input[name="skip"]').check()
-                page.get_by_role("button", name="LOGIN").click()
-                page.wait_for_load_state("networkidle")
-                
-                page.goto(target_url)
-                page.wait_for_load_state("networkidle")
-                
-                if "login" in page.url:
-                    browser.close()
-                    return jsonify({'status': 'error', 'message': 'ログインに失敗しました'})
-
-            # --- STEP 2: Fill delete reason and Confirm ---
-            try:
-                page.locator('textarea[name="deletemes"]').fill(deletemes)
-                page.locator('#deleteconf, input[value="削除[確認]"]').click()
-                page.wait_for_load_state("networkidle")
-            except Exception as inner_e:
-                browser.close()
-                return jsonify({'status': 'error', 'message': f'削除画面の操作に失敗しました: {str(inner_e)}'})
-
-            # --- STEP 3: Execute Delete ---
-            try:
-                # Based on mitemin UI logic, usually execution buttons contain '実行' or '削除'
-                btn = page.locator('input[value*="削除"], button:has-text("実行"), button:has-text("削除")').first
-                if btn.is_visible():
-                    btn.click()
-                    page.wait_for_load_state("networkidle")
-                else:
-                    # Fallback
-                    page.evaluate('document.forms[0].submit()')
-                    page.wait_for_load_state("networkidle")
-            except Exception as inner_e:
-                browser.close()
-                return jsonify({'status': 'error', 'message': f'削除の最終確定に失敗しました: {str(inner_e)}'})
-
-            time.sleep(2) # Throttle to prevent server hammering
-            browser.close()
-            return jsonify({'status': 'success'})
-
+        return jsonify(browser.run(_delete_image, image_icode, deletemes, login_id, login_password))
+    except LoginError:
+        return jsonify({'status': 'error', 'message': 'ログインに失敗しました'})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
 
+@app.route('/delete_batch', methods=['POST'])
+def delete_batch():
+    """複数の画像の削除をバックグラウンドのジョブに積む（進み具合と画像ごとの結果は /jobs/<id>）"""
+    login_id = request.form.get('login_id')
+    login_password = request.form.get('login_password')
+    image_ids = request.form.getlist('image_ids')  # e.g., ["i1109910", "i1109911"]
+    deletemes = request.form.get('deletemes')
+
+    if not login_id or not login_password or not image_ids or not deletemes:
+        return jsonify({'status': 'error', 'message': '必須パラメータが不足しています'})
+
+    batch = {'login_failed': False}
+    items = []
+    for image_id_full in image_ids:
+        match = re.search(r'\d+', image_id_full)
+        items.append({
+            'image_id': image_id_full,
+            'icode': match.group(0) if match else None,
+            'deletemes': deletemes,
+            'login_id': login_id,
+            'login_password': login_password,
+            'batch': batch,
+        })
+
+    job_id = delete_jobs.submit(items, image_ids, on_done=_delete_job_done)
+    return jsonify({'status': 'success', 'job_id': job_id, 'total': len(items)})
+
+def _delete_job_item(item):
+    """ジョブの1項目を削除する。ログインに失敗したら、同じジョブの残りはブラウザを動かさずに失敗にする"""
+    batch = item['batch']
+    if item['icode'] is None:
+        result = {'status': 'error', 'message': '無効な画像IDフォーマットです'}
+    elif batch['login_failed']:
+        result = {'status': 'error', 'message': 'ログインに失敗したためスキップしました'}
+    else:
+        try:
+            result = browser.run(_delete_image, item['icode'], item['deletemes'],
+                                 item['login_id'], item['login_password'])
+        except LoginError:
+            batch['login_failed'] = True
+            result = {'status': 'error', 'message': 'ログインに失敗しました'}
+        except Exception as e:
+            result = {'status': 'error', 'message': str(e)}
+    return dict(result, image_id=item['image_id'])
+
+def _delete_job_done(results):
+    # 削除できた画像をキャッシュの一覧から除き、1度だけ書き込む
+    deleted_ids = [r['image_id'] for r in results if r['status'] == 'success']
+    if deleted_ids:
+        _remove_from_cache(deleted_ids)
+
+def _delete_image(page, image_icode, deletemes, login_id, login_password):
+    # --- STEP 1: Delete input page ---
+    target_url = f"https://mitemin.net/imagemanage/imagedeleteinput/icode/{image_icode}/"
+    print(f"[DEBUG Delete] アクセス先: {target_url}")
+    # Login check
+    login_if_needed(page, target_url, login_id, login_password)
+
+    # --- STEP 2: Fill delete reason and Confirm ---
+    try:
+        page.locator('textarea[name="deletemes"]').fill(deletemes)
+        submit(page, page.locator('#deleteconf, input[value="削除[確認]"]'))
+    except Exception as inner_e:
+        return {'status': 'error', 'message': f'削除画面の操作に失敗しました: {str(inner_e)}'}
+
+    # --- STEP 3: Execute Delete ---
+    try:
+        # Based on mitemin UI logic, usually execution buttons contain '実行' or '削除'
+        btn = page.locator('input[value*="削除"], button:has-text("実行"), button:has-text("削除")').first
+        if btn.is_visible():
+            submit(page, btn)
+        else:
+            # Fallback
+            limiter.acquire()
+            with page.expect_navigation(wait_until="domcontentloaded"):
+                page.evaluate('document.forms[0].submit()')
+    except Exception as inner_e:
+        return {'status': 'error', 'message': f'削除の最終確定に失敗しました: {str(inner_e)}'}
+
+    return {'status': 'success'}
+
+def _remove_from_cache(image_ids):
+    """image_list.json から image_ids の画像を除く"""
+    removed = set(image_ids)
+    with cache_lock:
+        data = _read_cache()
+        if not data:
+            return
+        data['images'] = [img for img in data.get('images', []) if img.get('image_id') not in removed]
+        _write_cache(data)
+
+# 一括削除のジョブ（1件ずつ順にブラウザで処理する）
+delete_jobs = JobQueue(_delete_job_item)
+
 if __name__ == '__main__':
     print("🚀 サーバーを起動します。ブラウザで http://127.0.0.1:5000 にアクセスしてください。")
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    app.run(debug=True, port=5000)
@@ -0,0 +1,194 @@
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from playwright.sync_api import sync_playwright, Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
+
+from config import USER_DATA_DIR, HEADLESS, MITEMIN_REQUESTS_PER_MINUTE, MITEMIN_BURST
+from ratelimit import TokenBucket
+
+# mitemin.net へのページ遷移・フォーム送信はすべてこの制限を通す（全エンドポイントで共有）
+limiter = TokenBucket(MITEMIN_REQUESTS_PER_MINUTE, MITEMIN_BURST)
+
+# 1つの処理の結果を待つ最大の秒数（ブラウザのスレッドが止まってもリクエストが永遠に待たないように）
+TASK_TIMEOUT = 30 * 60
+
+
+class LoginError(Exception):
+    """自動ログインに失敗した（ID/パスワードの間違いなど）"""
+
+
+def navigate(page, url):
+    """レート制限を守って url を開く（DOM ができた時点で戻る。要素は各操作が出現を待つ）"""
+    limiter.acquire()
+    page.goto(url, wait_until="domcontentloaded")
+
+
+def submit(page, locator):
+    """レート制限を守って locator をクリックし、次のページへの遷移（フォーム送信）を待つ"""
+    limiter.acquire()
+    with page.expect_navigation(wait_until="domcontentloaded"):
+        locator.click()
+
+
+def login_if_needed(page, target_url, login_id, login_password):
+    """target_url を開き、ログイン画面に飛ばされたら自動ログインしてから開き直す"""
+    navigate(page, target_url)
+    if "login" not in page.url:
+        return
+
+    print(f"[DEBUG] ログイン画面にリダイレクトされました。自動ログインを実行します。")
+    print(f"[DEBUG] 送信されたID: {login_id}, パスワード文字数: {len(login_password)}")
+    page.locator('input[name="miteminid"]').fill(login_id)
+    page.locator('input[name="pass"]').fill(login_password)
+
+    # 次回から自動的にログインにチェックを入れておく
+    if page.locator('input[name="skip"]').is_visible():
+        page.locator('input[name="skip"]').check()
+    try:
+        submit(page, page.get_by_role("button", name="LOGIN"))
+    except PlaywrightTimeoutError:
+        raise LoginError("ログインの送信後にページが切り替わりませんでした")
+
+    # ログイン成功後、最初に開こうとしたページへ再度遷移
+    navigate(page, target_url)
+
+    # それでもloginページにいるならID/PASS間違いなど
+    if "login" in page.url:
+        raise LoginError("自動ログインに失敗しました")
+
+
+class BrowserSession:
+    """サーバーが動いている間、Chromium（USER_DATA_DIR の永続コンテキスト）を起動したままにしておく
+
+    Playwright の sync API は作ったスレッドからしか使えないため、ブラウザは専用のスレッドが持ち、
+    各リクエストの処理（page を受け取る関数）はそのスレッドで1つずつ実行する。
+    処理ごとに新しいタブを渡し、終わったら閉じる。
+    コンテキストが落ちていたり、ログインに失敗したりしたときは、コンテキストを作り直す。
+    """
+
+    def __init__(self, user_data_dir=USER_DATA_DIR, headless=HEADLESS):
+        self.user_data_dir = user_data_dir
+        self.headless = headless
+        self.launch_count = 0
+        self._tasks = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._playwright = None
+        self._context = None
+
+    def run(self, func, *args, **kwargs):
+        """func(page, *args, **kwargs) をブラウザのスレッドで実行し、結果を返す（例外はそのまま送出される）
+
+        TASK_TIMEOUT 秒待っても終わらなければ concurrent.futures.TimeoutError を送出する。
+        """
+        future = Future()
+        with self._thread_lock:
+            # スレッドの起動と積むのを同じロックの中で行い、起動に失敗したスレッドに積んだまま残らないようにする
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="playwright", daemon=True)
+                self._thread.start()
+            self._tasks.put((func, args, kwargs, future))
+        try:
+            return future.result(timeout=TASK_TIMEOUT)
+        except FutureTimeoutError:
+            # まだ始まっていなければ取り消す（始まっていればそのまま終わるのを待たずに返る）
+            future.cancel()
+            raise
+
+    def close(self):
+        """ブラウザを閉じ、スレッドを終了する"""
+        with self._thread_lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._tasks.put(None)
+            thread.join(timeout=30)
+
+    def _loop(self):
+        try:
+            self._playwright = sync_playwright().start()
+        except BaseException as e:
+            # Playwright が起動できなければ（ブラウザ未インストールなど）、積まれている処理をすべて失敗にする。
+            # 次に run() が呼ばれたときは、新しいスレッドで起動し直す
+            print(f"[DEBUG] Playwright を起動できませんでした: {e}")
+            with self._thread_lock:
+                self._thread = None
+                self._fail_pending(e)
+            return
+        try:
+            while True:
+                task = self._tasks.get()
+                if task is None:
+                    break
+                func, args, kwargs, future = task
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(self._run_task(func, args, kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            self._close_context()
+            self._playwright.stop()
+            self._playwright = None
+
+    def _fail_pending(self, error):
+        while True:
+            try:
+                task = self._tasks.get_nowait()
+            except queue.Empty:
+                return
+            if task is None:
+                continue
+            future = task[3]
+            if future.set_running_or_notify_cancel():
+                future.set_exception(error)
+
+    def _run_task(self, func, args, kwargs):
+        page = self._new_page()
+        try:
+            return func(page, *args, **kwargs)
+        except LoginError:
+            # ログイン状態が壊れている可能性があるので、次のリクエストではコンテキストを作り直す
+            self._close_context()
+            raise
+        finally:
+            try:
+                page.close()
+            except PlaywrightError:
+                pass
+
+    def _new_page(self):
+        """新しいタブを返す。コンテキストがない・落ちているときは起動し直す"""
+        if self._context is not None:
+            try:
+                return self._context.new_page()
+            except PlaywrightError as e:
+                print(f"[DEBUG] ブラウザが応答しないため起動し直します: {e}")
+                self._close_context()
+        self._launch()
+        return self._context.new_page()
+
+    def _launch(self):
+        print(f"[DEBUG] ブラウザを起動します (headless={self.headless})")
+        context = self._playwright.chromium.launch_persistent_context(
+            user_data_dir=self.user_data_dir,
+            headless=self.headless
+        )
+        # ユーザーがウィンドウを閉じた場合などは、次のリクエストで起動し直す
+        context.on("close", lambda _: self._forget_context(context))
+        self._context = context
+        self.launch_count += 1
+
+    def _forget_context(self, context):
+        if self._context is context:
+            self._context = None
+
+    def _close_context(self):
+        context, self._context = self._context, None
+        if context is not None:
+            try:
+                context.close()
+            except PlaywrightError:
+                pass
@@ -0,0 +1,86 @@
+import queue
+import threading
+import time
+import uuid
+
+
+class JobQueue:
+    """時間のかかる処理をバックグラウンドのスレッドで1件ずつ実行し、進み具合を返せるようにする
+
+    ジョブは項目（アップロードするファイルなど）のリストで、process(item) を順に呼ぶ。
+    process は結果の dict（'status' が 'success' / 'error'）を返す。
+    HTTP のスレッドは submit() でジョブを積んだらすぐに返り、/jobs/<id> で get() を呼んで進み具合を見る。
+    """
+
+    def __init__(self, process, keep_finished=50):
+        self.process = process
+        self.keep_finished = keep_finished
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="jobs", daemon=True)
+        self._worker.start()
+
+    def submit(self, items, labels, on_done=None):
+        """ジョブを積み、ジョブIDを返す。labels は結果に表示する項目ごとの名前（ファイル名など）
+
+        on_done を渡すと、全項目が終わったときに結果のリストを渡して1度だけ呼ぶ。
+        """
+        job_id = uuid.uuid4().hex
+        job = {
+            'id': job_id,
+            'status': 'queued',
+            'total': len(items),
+            'done': 0,
+            'current': None,
+            'results': [],
+            'created': time.time(),
+            'finished': None,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+        self._queue.put((job_id, list(items), list(labels), on_done))
+        return job_id
+
+    def get(self, job_id):
+        """ジョブの状態のコピーを返す（なければ None）"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return dict(job, results=list(job['results']))
+
+    def _run(self):
+        while True:
+            job_id, items, labels, on_done = self._queue.get()
+            self._update(job_id, status='running')
+            for item, label in zip(items, labels):
+                self._update(job_id, current=label)
+                try:
+                    result = self.process(item)
+                except Exception as e:
+                    result = {'status': 'error', 'message': str(e)}
+                result = dict(result, name=label)
+                with self._lock:
+                    job = self._jobs[job_id]
+                    job['results'].append(result)
+                    job['done'] += 1
+            if on_done is not None:
+                try:
+                    on_done(self.get(job_id)['results'])
+                except Exception as e:
+                    print(f"[JOB ERROR] ジョブ {job_id} の後処理に失敗: {e}")
+            self._update(job_id, status='done', current=None, finished=time.time())
+            self._forget_old_jobs()
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _forget_old_jobs(self):
+        """終わったジョブは新しいものから keep_finished 件だけ残す"""
+        with self._lock:
+            finished = sorted((job for job in self._jobs.values() if job['status'] == 'done'),
+                              key=lambda job: job['finished'], reverse=True)
+            for job in finished[self.keep_finished:]:
+                del self._jobs[job['id']]
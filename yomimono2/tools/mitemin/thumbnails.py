@@ -0,0 +1,122 @@
+import http.client
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from config import CACHE_FOLDER, THUMBNAIL_WORKERS, THUMBNAIL_RETRIES
+
+# 1回の接続・読み込みのタイムアウト（秒）
+TIMEOUT = 30
+# リトライの待ち時間の基準（秒）。1回目は約1秒、2回目は約2秒、3回目は約4秒…と倍にしていく
+BACKOFF_SECONDS = 1.0
+# たどるリダイレクトの最大回数
+MAX_REDIRECTS = 3
+
+
+class DownloadError(Exception):
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class ThumbnailFetcher:
+    """サムネイル画像を別スレッドで並列にダウンロードし、CACHE_FOLDER に保存する
+
+    ワーカーのスレッドはホストごとに keep-alive の接続を持ち続けるので、
+    画像ごとに TLS の接続をやり直さずに済む。失敗したら待ち時間を倍にしながらリトライする。
+    保存は一時ファイルに書いてから名前を変えるので、途中までのファイルが残ることはない。
+    """
+
+    def __init__(self, cache_folder=CACHE_FOLDER, workers=THUMBNAIL_WORKERS, retries=THUMBNAIL_RETRIES):
+        self.cache_folder = cache_folder
+        self.retries = retries
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+        self._local = threading.local()
+
+    def submit(self, src, cache_filename):
+        """src を cache_filename として保存するダウンロードを積み、Future を返す（保存済みなら None）"""
+        cache_filepath = os.path.join(self.cache_folder, cache_filename)
+        if os.path.exists(cache_filepath):
+            return None
+        return self._executor.submit(self._download, src, cache_filepath)
+
+    def _download(self, src, cache_filepath):
+        attempt = 0
+        while True:
+            try:
+                data = self._get(src)
+                break
+            except DownloadError as e:
+                if not e.retryable or attempt >= self.retries:
+                    raise
+            except (http.client.HTTPException, OSError) as e:
+                if attempt >= self.retries:
+                    raise DownloadError(str(e))
+            time.sleep(BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5))
+            attempt += 1
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, cache_filepath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return cache_filepath
+
+    def _get(self, url):
+        """url の本文を返す。接続はスレッドごと・ホストごとに使い回す"""
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            key = (parts.scheme, parts.netloc)
+            connection = self._connection(key)
+            try:
+                connection.request("GET", path, headers={'User-Agent': 'Mozilla/5.0'})
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                # サーバー側で閉じられた keep-alive の接続などは捨てて、次は新しく接続する
+                self._drop(key)
+                raise
+            if response.will_close:
+                self._drop(key)
+
+            if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+                url = urllib.parse.urljoin(url, response.getheader("Location"))
+                continue
+            if response.status == 200:
+                return body
+            # 429 と 5xx は時間をおけば成功するかもしれないのでリトライする
+            retryable = response.status == 429 or response.status >= 500
+            raise DownloadError(f"HTTP {response.status}", retryable=retryable)
+        raise DownloadError("リダイレクトが多すぎます", retryable=False)
+
+    def _connection(self, key):
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get(key)
+        if connection is None:
+            scheme, netloc = key
+            if scheme == "https":
+                connection = http.client.HTTPSConnection(netloc, timeout=TIMEOUT)
+            elif scheme == "http":
+                connection = http.client.HTTPConnection(netloc, timeout=TIMEOUT)
+            else:
+                raise DownloadError(f"対応していないURLです: {scheme}://{netloc}", retryable=False)
+            connections[key] = connection
+        return connection
+
+    def _drop(self, key):
+        connection = self._local.connections.pop(key, None)
+        if connection is not None:
+            connection.close()